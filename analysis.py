@@ -1,90 +1,340 @@
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import scipy.stats as stats
+from us_regions import WEATHER_STATES
+from simulation import state_run_lengths, DEFAULT_CHUNK_SIZE
+from instrumentation import instrumented
 
-def compare_distributions(models_dict: Dict) -> Dict:
+# Added to both distributions before the KL divergence to avoid log(0)
+_KL_EPSILON = 1e-10
+
+# Bootstrap weights (replicates x paths) drawn at once
+_BOOTSTRAP_BLOCK_ENTRIES = 1 << 22
+
+@instrumented()
+def compare_distributions(models_dict: Dict,
+                          n_bootstrap: int = 1000,
+                          confidence: float = 0.95,
+                          seed: Optional[int] = None) -> Dict:
     """
     Compare stationary vs empirical distributions
+    
+    Regions with the same number of states, paths and days are compared
+    together as (regions x states) count arrays. KL divergence, MAE and
+    "chi2_statistic" measure the distance to the stationary distribution
+    and are descriptive: paths start from the initial distribution, so
+    they include the transient of the first days.
+    
+    The p-value tests the simulated frequencies against the frequencies
+    the model implies over the simulated horizon (the initial distribution
+    propagated day by day and averaged). Days of one path are correlated,
+    so the Pearson statistic is divided by the Rao-Scott design effect
+    estimated from the variance between paths (the variance the path
+    bootstrap resamples) before it is referred to the chi-square
+    distribution. Results without stored paths (streaming mode) or with
+    a single path have no p-value (NaN).
+    
+    Confidence intervals come from a bootstrap that never re-simulates:
+    per-path state counts are reweighted with multinomial resampling
+    weights over paths, shared by every region of a group, so a block
+    of replicates is a single matrix product. Results
+    without stored paths (streaming mode) resample their pooled state
+    counts multinomially over days instead.
+    
+    Parameters:
+    -----------
+    models_dict : Dict
+        simulate_multiple_regions results
+    n_bootstrap : int
+        Bootstrap replicates; 0 skips the confidence intervals
+    confidence : float
+        Level of the percentile intervals
+    seed : int or None
+        Seed of the resampling weights
+    
+    Returns:
+    --------
+    Dict
+        comparisons[region] with the point metrics, "design_effect",
+        "adjusted_chi2_statistic", "p_value", "n_observations" and
+        "empirical_ci" (2 x states), "kl_divergence_ci", "chi2_statistic_ci"
+        and "mean_absolute_error_ci" as (low, high), or None without
+        bootstrap
     """
-    comparisons = {}
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {confidence}")
+    
+    rng = np.random.default_rng(seed)
+    quantiles = [(1 - confidence) / 2, (1 + confidence) / 2]
     
+    groups = {}
     for region_name, results in models_dict.items():
-        stationary = results["stationary"]
-        empirical = results["empirical_dist"]
-        
-        # Calculate KL Divergence (relative entropy)
-        # Add small epsilon to avoid log(0)
-        epsilon = 1e-10
-        stationary_safe = stationary + epsilon
-        empirical_safe = empirical + epsilon
-        
-        # Normalize
-        stationary_safe = stationary_safe / stationary_safe.sum()
-        empirical_safe = empirical_safe / empirical_safe.sum()
-        
-        kl_divergence = np.sum(
-            stationary_safe * np.log(stationary_safe / empirical_safe)
-        )
+        groups.setdefault(_comparison_shape(results), []).append(region_name)
+    
+    comparisons = {}
+    for (n_states, n_paths, days, has_paths), names in groups.items():
+        stationary = np.array([models_dict[name]["stationary"] for name in names])
+        if has_paths:
+            path_counts = np.stack([
+                _path_state_counts(models_dict[name]["sequences"], n_states)
+                for name in names
+            ])
+            counts = path_counts.sum(axis=1)
+        else:
+            totals = n_paths * days
+            counts = np.rint(np.array([models_dict[name]["empirical_dist"]
+                                       for name in names]) * totals)
         
-        # Chi-square test
-        # Scale to expected counts (assuming 1000 samples)
-        expected = stationary * 1000
-        observed = empirical * 1000
+        empirical, kl, chi2, mae = _divergence_metrics(stationary, counts)
+        design_effect = adjusted_chi2 = p_values = np.full(len(names), np.nan)
+        if has_paths and n_paths > 1:
+            expected = np.array([
+                models_dict[name]["model"].distribution_over_horizons(
+                    None, range(days)
+                ).mean(axis=0)
+                for name in names
+            ])
+            design_effect, adjusted_chi2, p_values = _clustered_chi2_test(
+                expected, path_counts
+            )
         
-        chi2, p_value = stats.chisquare(observed, expected)
+        intervals = None
+        if n_bootstrap > 0:
+            if has_paths:
+                boot_counts = _bootstrap_path_counts(path_counts, n_bootstrap, rng)
+            else:
+                boot_counts = rng.multinomial(
+                    counts.sum(axis=1).astype(np.int64), empirical,
+                    size=(n_bootstrap, len(names))
+                ).swapaxes(0, 1)
+            boot = _divergence_metrics(stationary[:, None, :], boot_counts)
+            intervals = [np.quantile(metric, quantiles, axis=1)
+                         for metric in boot]
         
-        comparisons[region_name] = {
-            "stationary": stationary,
-            "empirical": empirical,
-            "kl_divergence": kl_divergence,
-            "chi2_statistic": chi2,
-            "p_value": p_value,
-            "mean_absolute_error": np.mean(np.abs(stationary - empirical))
-        }
+        for r, region_name in enumerate(names):
+            comparisons[region_name] = {
+                "stationary": stationary[r],
+                "empirical": empirical[r],
+                "state_labels": list(models_dict[region_name]["state_labels"]),
+                "kl_divergence": kl[r],
+                "chi2_statistic": chi2[r],
+                "design_effect": design_effect[r],
+                "adjusted_chi2_statistic": adjusted_chi2[r],
+                "p_value": p_values[r],
+                "mean_absolute_error": mae[r],
+                "n_observations": int(counts[r].sum()),
+                "empirical_ci": None,
+                "kl_divergence_ci": None,
+                "chi2_statistic_ci": None,
+                "mean_absolute_error_ci": None
+            }
+            if intervals is not None:
+                empirical_ci, kl_ci, chi2_ci, mae_ci = intervals
+                comparisons[region_name].update({
+                    "empirical_ci": empirical_ci[:, r],
+                    "kl_divergence_ci": tuple(kl_ci[:, r]),
+                    "chi2_statistic_ci": tuple(chi2_ci[:, r]),
+                    "mean_absolute_error_ci": tuple(mae_ci[:, r])
+                })
+    
+    return {region_name: comparisons[region_name]
+            for region_name in models_dict.keys()}
+
+def _comparison_shape(results: Dict) -> Tuple[int, int, int, bool]:
+    """(states, paths, days, paths stored) of one region's results"""
+    sequences = results.get("sequences")
+    n_states = len(results["stationary"])
+    if sequences is not None:
+        n_paths, days = np.shape(sequences)
+        return n_states, n_paths, days, True
+    
+    histogram = results["rainy_day_histogram"]
+    return n_states, int(np.sum(histogram)), len(histogram) - 1, False
+
+def _path_state_counts(sequences: np.ndarray, n_states: int,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """(paths x states) number of days each path spends in each state"""
+    n_paths = len(sequences)
+    counts = np.empty((n_paths, n_states), dtype=np.int64)
+    for start in range(0, n_paths, chunk_size):
+        block = np.asarray(sequences[start:start + chunk_size], dtype=np.intp)
+        rows = np.arange(len(block))[:, None] * n_states
+        counts[start:start + len(block)] = np.bincount(
+            (rows + block).ravel(), minlength=len(block) * n_states
+        ).reshape(len(block), n_states)
+    
+    return counts
+
+def _bootstrap_path_counts(path_counts: np.ndarray, n_bootstrap: int,
+                           rng: np.random.Generator) -> np.ndarray:
+    """
+    State counts of bootstrap replicates resampling paths
+    
+    path_counts is (regions x paths x states). A replicate's multinomial
+    weights are the bincount of n_paths uniform path indices, and a
+    block of replicates is one (replicates x paths) @ (paths x regions *
+    states) product.
+    """
+    n_regions, n_paths, n_states = path_counts.shape
+    counts = path_counts.transpose(1, 0, 2).reshape(n_paths, -1).astype(float)
+    boot = np.empty((n_bootstrap, n_regions * n_states))
+    block = max(1, _BOOTSTRAP_BLOCK_ENTRIES // max(n_paths, 1))
+    
+    for start in range(0, n_bootstrap, block):
+        stop = min(start + block, n_bootstrap)
+        picks = rng.integers(0, n_paths, size=(stop - start, n_paths))
+        picks += np.arange(stop - start)[:, None] * n_paths
+        weights = np.bincount(picks.ravel(), minlength=(stop - start) * n_paths)
+        boot[start:stop] = weights.reshape(stop - start, n_paths) @ counts
+    
+    return boot.reshape(n_bootstrap, n_regions, n_states).swapaxes(0, 1)
+
+def _clustered_chi2_test(expected: np.ndarray, path_counts: np.ndarray):
+    """
+    Design-effect adjusted chi-square test of pooled path counts
+    
+    expected is (regions x states), path_counts (regions x paths x
+    states). The mean design effect is sum_i Var(p_i) / e_i * N / dof,
+    with Var(p_i) the between-path variance of the pooled frequency; it
+    is 1 for independent days.
+    
+    Returns:
+    --------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        Design effect, adjusted statistic and p-value per region
+    """
+    n_paths = path_counts.shape[1]
+    totals = path_counts.sum(axis=(1, 2)).astype(float)
+    _, _, chi2, _ = _divergence_metrics(expected, path_counts.sum(axis=1))
+    
+    variance = (path_counts.var(axis=1, ddof=1) * n_paths
+                / totals[:, None] ** 2)
+    cells = expected > 0
+    dof = np.maximum(np.count_nonzero(cells, axis=1) - 1, 1)
+    design_effect = np.sum(
+        np.divide(variance, expected, out=np.zeros_like(variance), where=cells),
+        axis=1
+    ) * totals / dof
+    
+    adjusted = np.divide(chi2, design_effect, out=np.zeros_like(chi2),
+                         where=design_effect > 0)
+    return design_effect, adjusted, stats.chi2.sf(adjusted, dof)
+
+def _divergence_metrics(stationary: np.ndarray, counts: np.ndarray):
+    """
+    Empirical distribution, KL divergence, chi-square statistic and MAE
+    
+    Works on any leading shape; the last axis is the state.
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1, keepdims=True)
+    empirical = counts / total
     
-    return comparisons
+    stationary_safe = stationary + _KL_EPSILON
+    stationary_safe = stationary_safe / stationary_safe.sum(axis=-1, keepdims=True)
+    empirical_safe = empirical + _KL_EPSILON
+    empirical_safe = empirical_safe / empirical_safe.sum(axis=-1, keepdims=True)
+    kl_divergence = np.sum(
+        stationary_safe * np.log(stationary_safe / empirical_safe), axis=-1
+    )
+    
+    expected = stationary * total
+    deviations = np.divide((counts - expected) ** 2, expected,
+                           out=np.zeros(np.broadcast(counts, expected).shape),
+                           where=expected > 0)
+    chi2 = deviations.sum(axis=-1)
+    mean_absolute_error = np.mean(np.abs(stationary - empirical), axis=-1)
+    
+    return empirical, kl_divergence, chi2, mean_absolute_error
 
-def analyze_state_durations(sequences: List[List[str]], 
-                           state: str = "Rainy") -> Dict:
+def analyze_state_durations(sequences: np.ndarray, 
+                           state: str = "Rainy",
+                           states: List[str] = None) -> Dict:
     """
     Analyze duration of weather states (e.g., rainy streaks)
+    
+    Parameters:
+    -----------
+    sequences : np.ndarray
+        Integer-coded path matrix (paths x days), as stored in
+        simulate_multiple_regions results
+    state : str
+        State whose streaks are measured
+    states : List[str] or None
+        Code table; code i stands for states[i]
     """
-    all_durations = []
+    return analyze_all_state_durations(sequences, states)[state]
+
+@instrumented()
+def analyze_all_state_durations(sequences: np.ndarray,
+                                states: List[str] = None,
+                                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Dict]:
+    """
+    Analyze streak durations of every state in one vectorized pass
+    
+    Run boundaries are detected from adjacent-day changes across blocks
+    of chunk_size paths at once (see simulation.state_run_lengths).
+    """
+    if states is None:
+        states = WEATHER_STATES
     
-    for seq in sequences:
-        durations = []
-        current_duration = 0
+    # Row blocks keep temporaries small and let memory-mapped path
+    # matrices be read a slice at a time
+    n_paths, days = np.shape(sequences)
+    run_lengths = np.zeros((len(states), days + 1), dtype=np.int64)
+    for start in range(0, n_paths, chunk_size):
+        block = np.asarray(sequences[start:start + chunk_size])
+        run_lengths += state_run_lengths(block, len(states))
+    
+    return durations_from_run_lengths(run_lengths, states)
+
+def durations_from_run_lengths(run_lengths: np.ndarray,
+                               states: List[str] = None) -> Dict[str, Dict]:
+    """
+    Duration statistics from a run-length tally
+    
+    Parameters:
+    -----------
+    run_lengths : np.ndarray
+        Array (n_states x max_length + 1) where [s, L] counts runs of
+        state s lasting L days, e.g. results["run_lengths"] from a
+        streaming simulation
+    states : List[str] or None
+        Code table; code i stands for states[i]
+    """
+    if states is None:
+        states = WEATHER_STATES
+    
+    lengths = np.arange(run_lengths.shape[1])
+    durations = {}
+    
+    for idx, state in enumerate(states):
+        counts = run_lengths[idx]
+        n_runs = counts.sum()
         
-        for weather in seq:
-            if weather == state:
-                current_duration += 1
-            elif current_duration > 0:
-                durations.append(current_duration)
-                current_duration = 0
+        if n_runs == 0:
+            durations[state] = {
+                "mean": 0,
+                "max": 0,
+                "histogram": {}
+            }
+            continue
         
-        if current_duration > 0:
-            durations.append(current_duration)
+        observed = np.flatnonzero(counts)
+        mean = (lengths * counts).sum() / n_runs
+        variance = (counts * (lengths - mean) ** 2).sum() / n_runs
         
-        all_durations.extend(durations)
-    
-    if not all_durations:
-        return {
-            "mean": 0,
-            "max": 0,
-            "histogram": {}
+        durations[state] = {
+            "mean": mean,
+            "std": np.sqrt(variance),
+            "max": observed[-1],
+            "histogram": dict(zip(observed, counts[observed] / n_runs)),
+            "geometric_fit": 1 / mean
         }
     
-    unique, counts = np.unique(all_durations, return_counts=True)
-    histogram = dict(zip(unique, counts / len(all_durations)))
-    
-    return {
-        "mean": np.mean(all_durations),
-        "std": np.std(all_durations),
-        "max": np.max(all_durations),
-        "histogram": histogram,
-        "geometric_fit": 1 / np.mean(all_durations)  
-    }
+    return durations
 
+@instrumented()
 def regional_comparison_report(models_dict: Dict) -> str:
     """
     Generate a comparison report for all regions
@@ -105,7 +355,8 @@ def regional_comparison_report(models_dict: Dict) -> str:
         for i, state in enumerate(model.states):
             report.append(f"  {state}: {stationary[i]:.3f}")
         
-        report.append(f"\nRainy Day Statistics (30-day period):")
+        days = len(results["rainy_day_histogram"]) - 1
+        report.append(f"\nRainy Day Statistics ({days}-day period):")
         report.append(f"  Average rainy days: {results['avg_rainy_days']:.1f}")
         report.append(f"  Percentage rainy: {results['rainy_percentage']*100:.1f}%")
         
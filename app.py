@@ -1,12 +1,34 @@
+import importlib
+import os
+import sys
+import threading
+import time
 import streamlit as st
-import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+import instrumentation
 from us_regions import US_REGIONS, WEATHER_STATES
-from weather_model import MarkovWeatherModel
-import simulation
-import analysis
-import visualization
+
+# Plotting, statistics and simulation modules are imported through
+# lazy_import() when a view first needs them, keeping cold starts fast.
+# Set WEATHER_IMPORT_REPORT=1 (or open the app with ?import_report=1)
+# to show how long each of those imports took.
+IMPORT_REPORT = os.environ.get("WEATHER_IMPORT_REPORT") == "1"
+
+# Stage timings of the last run are shown with WEATHER_PERFORMANCE_PANEL=1
+# (or ?performance=1); WEATHER_TRACK_MEMORY=1 also records bytes allocated
+PERFORMANCE_PANEL = os.environ.get("WEATHER_PERFORMANCE_PANEL") == "1"
+if os.environ.get("WEATHER_TRACK_MEMORY") == "1":
+    instrumentation.enable_memory_tracking()
+
+# Shared simulation cache: maximum number of stored runs and their lifetime
+PIPELINE_CACHE_SIZE = int(os.environ.get("WEATHER_CACHE_SIZE", 32))
+PIPELINE_CACHE_TTL = int(os.environ.get("WEATHER_CACHE_TTL", 3600))
+
+# Simulations run on background threads; the page polls for progress at
+# this interval (seconds) and paths are simulated in batches of this size
+JOB_POLL_INTERVAL = 0.5
+JOB_WORKERS = int(os.environ.get("WEATHER_JOB_WORKERS", 2))
+PROGRESS_CHUNK_SIZE = 250
 
 st.set_page_config(
     page_title="Probabilistic Weather Prediction Model",
@@ -304,6 +326,20 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def _import_timings() -> dict:
+    """Process-wide record of lazy import durations in seconds"""
+    return {}
+
+def lazy_import(module_name: str):
+    """Import a module on first use and record how long it took"""
+    module = sys.modules.get(module_name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _import_timings()[module_name] = time.perf_counter() - start
+    return module
+
 def initialize_session_state():
     """Initialize session state variables"""
     defaults = {
@@ -313,13 +349,251 @@ def initialize_session_state():
         'forecasts': None,
         'selected_region': 'Southwest',
         'days': 30,
-        'simulations': 500
+        'simulations': 500,
+        'seed': 42,
+        'performance': None,
+        'performance_render_pending': False,
+        'job': None,
+        'job_status': None,
+        'run_params': None
     }
     
     for key, value in defaults.items():
         if key not in st.session_state:
             st.session_state[key] = value
 
+@st.cache_resource
+def _job_executor() -> ThreadPoolExecutor:
+    """Process-wide worker threads for background simulation runs"""
+    return ThreadPoolExecutor(max_workers=JOB_WORKERS,
+                              thread_name_prefix="weather-simulation")
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_SIZE,
+               show_spinner=False)
+def run_pipeline(days: int, simulations: int, seed: int, regions_key: str,
+                 _progress_callback=None, _region_callback=None,
+                 _cancel_event=None):
+    """
+    Simulate, compare and forecast all regions
+    
+    Cached across sessions; regions_key is the fingerprint of the
+    transition matrices so edited region data is never served stale.
+    The underscored arguments are not part of the cache key: progress is
+    reported per batch of paths, each region's results, comparison and
+    forecast are handed to _region_callback as soon as it finishes, and
+    setting _cancel_event aborts the run (nothing is cached then).
+    """
+    simulation = lazy_import("simulation")
+    
+    comparisons = {}
+    forecasts = {}
+    models_dict = simulation.simulate_multiple_regions(
+        days=days,
+        simulations=simulations,
+        seed=seed,
+        chunk_size=PROGRESS_CHUNK_SIZE,
+        progress_callback=_progress_callback,
+        region_callback=_report_region(comparisons, forecasts,
+                                       _region_callback),
+        cancel_event=_cancel_event,
+        extensible=True
+    )
+    return models_dict, comparisons, forecasts
+
+def extend_pipeline(models_dict: dict, days: int, simulations: int,
+                    progress_callback=None, region_callback=None,
+                    cancel_event=None):
+    """
+    Grow a previous run_pipeline result to more days and/or simulations
+    
+    Only the extra paths and days are simulated; callbacks and the
+    cancel event behave as in run_pipeline.
+    """
+    simulation = lazy_import("simulation")
+    
+    comparisons = {}
+    forecasts = {}
+    models_dict = simulation.extend_multiple_regions(
+        models_dict,
+        days=days,
+        simulations=simulations,
+        chunk_size=PROGRESS_CHUNK_SIZE,
+        progress_callback=progress_callback,
+        region_callback=_report_region(comparisons, forecasts,
+                                       region_callback),
+        cancel_event=cancel_event
+    )
+    return models_dict, comparisons, forecasts
+
+def _report_region(comparisons: dict, forecasts: dict, region_callback=None):
+    """Region callback that compares and forecasts each finished region"""
+    simulation = lazy_import("simulation")
+    analysis = lazy_import("analysis")
+    
+    def region_done(region_name, region_results):
+        single = {region_name: region_results}
+        comparisons.update(analysis.compare_distributions(single))
+        forecasts.update(simulation.forecast_probability_rain(
+            single,
+            days_ahead=[1, 3, 7, 14, 30]
+        ))
+        if region_callback is not None:
+            region_callback(region_name, region_results,
+                            comparisons[region_name], forecasts[region_name])
+    
+    return region_done
+
+class PipelineJob:
+    """
+    One run_pipeline call on a background thread
+    
+    The worker only updates plain attributes under a lock; the script
+    polls the job on each rerun, shows its progress and copies finished
+    regions into the session state.
+    """
+    
+    def __init__(self, days: int, simulations: int, seed: int,
+                 regions_key: str, base: dict = None):
+        self.params = (days, simulations, seed, regions_key)
+        self.base = base
+        # region -> (paths done, paths to do)
+        self.region_progress = {region: (0, simulations) for region in US_REGIONS}
+        self.models_dict = {}
+        self.comparisons = {}
+        self.forecasts = {}
+        self.performance = instrumentation.Profile()
+        self.cancel_event = threading.Event()
+        self.cancelled = False
+        self.error = None
+        self._lock = threading.Lock()
+        self.future = _job_executor().submit(self._run, *self.params)
+    
+    @property
+    def running(self) -> bool:
+        return not self.future.done()
+    
+    def _run(self, days: int, simulations: int, seed: int, regions_key: str):
+        simulation = lazy_import("simulation")
+        try:
+            with instrumentation.profile(self.performance):
+                if self.base is not None:
+                    with instrumentation.stage("app.extend_pipeline"):
+                        results = extend_pipeline(
+                            self.base, days, simulations,
+                            progress_callback=self._on_progress,
+                            region_callback=self._on_region,
+                            cancel_event=self.cancel_event
+                        )
+                else:
+                    with instrumentation.stage("app.run_pipeline"):
+                        results = run_pipeline(
+                            days, simulations, seed, regions_key,
+                            _progress_callback=self._on_progress,
+                            _region_callback=self._on_region,
+                            _cancel_event=self.cancel_event
+                        )
+            with self._lock:
+                # A cached run reports no progress; take the full result
+                self.models_dict, self.comparisons, self.forecasts = results
+                for region, (_, total) in self.region_progress.items():
+                    self.region_progress[region] = (total, total)
+        except simulation.SimulationCancelled:
+            self.cancelled = True
+        except Exception as exc:
+            self.error = exc
+    
+    def _on_progress(self, region_name: str, done: int, total: int):
+        with self._lock:
+            self.region_progress[region_name] = (done, total)
+    
+    def _on_region(self, region_name: str, results: dict,
+                   comparison: dict, forecast: dict):
+        with self._lock:
+            self.models_dict[region_name] = results
+            self.comparisons[region_name] = comparison
+            self.forecasts[region_name] = forecast
+    
+    def cancel(self):
+        self.cancel_event.set()
+    
+    def progress(self) -> float:
+        """Mean fraction of each region's work done so far"""
+        with self._lock:
+            fractions = [done / total if total else 1.0
+                         for done, total in self.region_progress.values()]
+        return sum(fractions) / len(fractions)
+    
+    def snapshot(self):
+        """Copies of the results of all regions finished so far"""
+        with self._lock:
+            return (dict(self.models_dict), dict(self.comparisons),
+                    dict(self.forecasts), dict(self.region_progress))
+
+def sync_pipeline_job():
+    """Copy (partial) results of the background run into the session"""
+    job = st.session_state.job
+    if job is None:
+        return
+    
+    models_dict, comparisons, forecasts, _ = job.snapshot()
+    if models_dict:
+        st.session_state.models_dict = models_dict
+        st.session_state.comparisons = comparisons
+        st.session_state.forecasts = forecasts
+        st.session_state.simulations_run = True
+    
+    if job.running:
+        return
+    
+    st.session_state.job = None
+    # Only complete runs can be extended later
+    complete = job.error is None and not job.cancelled
+    st.session_state.run_params = job.params if complete else None
+    if job.error is not None:
+        st.session_state.job_status = ("error", f"Simulation failed: {job.error}")
+    elif job.cancelled:
+        st.session_state.job_status = (
+            "warning", "Simulation cancelled; showing the regions that finished."
+        )
+    else:
+        st.session_state.job_status = ("success", "Simulation complete!")
+    # Rendering on this rerun is added to the same profile
+    st.session_state.performance = job.performance
+    st.session_state.performance_render_pending = True
+
+def extendable_results(params: tuple):
+    """
+    The shown results, if the requested run only adds days or paths to them
+    
+    Returns None when a fresh run is needed: no complete previous run,
+    another seed or region data, fewer days or paths, or the same run.
+    """
+    previous = st.session_state.run_params
+    if previous is None or previous == params:
+        return None
+    
+    days, simulations, seed, regions_key = params
+    old_days, old_simulations, old_seed, old_key = previous
+    if (seed, regions_key) != (old_seed, old_key):
+        return None
+    if days < old_days or simulations < old_simulations:
+        return None
+    
+    return st.session_state.models_dict
+
+def display_job_progress(job: PipelineJob):
+    """Progress bars and cancel button of the running simulation"""
+    _, _, _, region_progress = job.snapshot()
+    action = "Extending" if job.base is not None else "Running"
+    st.progress(job.progress(), text=f"{action} weather simulations...")
+    
+    for region, (done, total) in region_progress.items():
+        st.progress(done / total if total else 1.0,
+                    text=f"{region}: {done}/{total} paths")
+    
+    st.button("Cancel", on_click=job.cancel, width="stretch",
+              disabled=job.cancel_event.is_set())
+
 def display_header():
     """Display centered header"""
     st.markdown('<div class="centered-container">', unsafe_allow_html=True)
@@ -331,7 +605,7 @@ def display_controls():
     """Display centered control panel"""
     st.markdown('<div class="centered-container">', unsafe_allow_html=True)
     
-    col1, col2, col3 = st.columns([2, 2, 1])
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
     
     with col1:
         st.session_state.selected_region = st.selectbox(
@@ -356,24 +630,37 @@ def display_controls():
             index=sim_options.index(st.session_state.simulations) if st.session_state.simulations in sim_options else 2
         )
     
+    with col4:
+        st.session_state.seed = int(st.number_input(
+            "Seed",
+            min_value=0,
+            value=st.session_state.seed,
+            step=1
+        ))
+    
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if st.button("Run Simulation", type="primary", use_container_width=True):
-            with st.spinner("Running weather simulations..."):
-                st.session_state.models_dict = simulation.simulate_multiple_regions(
-                    days=st.session_state.days,
-                    simulations=st.session_state.simulations
-                )
-                st.session_state.comparisons = analysis.compare_distributions(
-                    st.session_state.models_dict
-                )
-                st.session_state.forecasts = simulation.forecast_probability_rain(
-                    st.session_state.models_dict,
-                    days_ahead=[1, 3, 7, 14, 30]
-                )
-                st.session_state.simulations_run = True
-            st.success("Simulation complete!")
+        job = st.session_state.job
+        if job is not None:
+            display_job_progress(job)
+        elif st.button("Run Simulation", type="primary", width="stretch"):
+            params = (
+                st.session_state.days,
+                st.session_state.simulations,
+                st.session_state.seed,
+                lazy_import("simulation").regions_fingerprint(US_REGIONS)
+            )
+            st.session_state.job_status = None
+            st.session_state.job = PipelineJob(
+                *params, base=extendable_results(params)
+            )
             st.rerun()
+        
+        if st.session_state.job_status is not None:
+            kind, message = st.session_state.job_status
+            getattr(st, kind)(message)
+            if kind == "success":
+                st.session_state.job_status = None
     
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -451,6 +738,8 @@ def display_main_content():
 
 def display_regional_analysis():
     """Display regional analysis content"""
+    visualization = lazy_import("visualization")
+    
     st.markdown(f'<div class="section-header">{st.session_state.selected_region} Analysis</div>', unsafe_allow_html=True)
     
     if st.session_state.selected_region not in st.session_state.models_dict:
@@ -490,16 +779,11 @@ def display_regional_analysis():
     
     st.markdown('<div class="subsection-header">Transition Matrix</div>', unsafe_allow_html=True)
     
-    fig = visualization.plot_transition_matrix(model.P, st.session_state.selected_region)
-    
-    ax = fig.get_axes()[0]
-    im = ax.images[0]
-    im.set_cmap('gray')
-    ax.set_facecolor('white')
-    fig.patch.set_facecolor('white')
-    
-    st.pyplot(fig)
-    plt.close(fig)
+    st.image(
+        visualization.render_transition_matrix(model.P, st.session_state.selected_region,
+                                               states=list(model.states)),
+        width="stretch"
+    )
     
     st.markdown('<div class="subsection-header">Sample Weather Sequence</div>', unsafe_allow_html=True)
     sample_seq = model.simulate_sequence(15)
@@ -507,6 +791,9 @@ def display_regional_analysis():
 
 def display_probability_forecasts():
     """Display probability forecasts"""
+    pd = lazy_import("pandas")
+    visualization = lazy_import("visualization")
+    
     st.markdown('<div class="section-header">Rain Probability Forecasts</div>', unsafe_allow_html=True)
     
     forecast_data = []
@@ -517,11 +804,10 @@ def display_probability_forecasts():
                 row[f"{days}d"] = f"{probs['theoretical']:.1%}"
             forecast_data.append(row)
     
-    import pandas as pd
     df = pd.DataFrame(forecast_data)
     st.dataframe(
         df.set_index('Region'),
-        use_container_width=True,
+        width="stretch",
         column_config={
             "1d": st.column_config.NumberColumn("1 Day", format="%.1f%%"),
             "3d": st.column_config.NumberColumn("3 Days", format="%.1f%%"),
@@ -531,39 +817,48 @@ def display_probability_forecasts():
         }
     )
     
-    st.markdown('<div class="subsection-header">Probability Trends</div>', unsafe_allow_html=True)
-    fig = visualization.plot_rain_probability_forecast(st.session_state.forecasts)
-    
-    ax = fig.get_axes()[0]
-    ax.set_facecolor('white')
-    fig.patch.set_facecolor('white')
-    
-    for line in ax.get_lines():
-        line.set_color('black')
-        line.set_linewidth(2)
+    # Horizons at or past the simulated days have no paths to count
+    simulated_data = []
+    for region in US_REGIONS.keys():
+        if region in st.session_state.forecasts:
+            row = {"Region": region}
+            for days, probs in st.session_state.forecasts[region].items():
+                row[f"{days}d"] = ("n/a" if pd.isna(probs['empirical']) else
+                                   f"{probs['empirical']:.1%} "
+                                   f"[{probs['ci_low']:.1%}, {probs['ci_high']:.1%}]")
+            simulated_data.append(row)
     
-    ax.grid(True, color='#e0e0e0', linestyle='-', linewidth=0.5)
+    st.markdown('<div class="subsection-header">Simulated Share of Rainy Paths</div>', unsafe_allow_html=True)
+    st.dataframe(pd.DataFrame(simulated_data).set_index('Region'),
+                 width="stretch")
+    st.caption("95% Wilson intervals. n/a: the horizon lies beyond the "
+               "simulated days, so only the theoretical value is available.")
     
-    st.pyplot(fig)
-    plt.close(fig)
+    st.markdown('<div class="subsection-header">Probability Trends</div>', unsafe_allow_html=True)
+    st.image(
+        visualization.render_rain_probability_forecast(st.session_state.forecasts),
+        width="stretch"
+    )
     
     st.markdown('<div class="subsection-header">Regional Comparison</div>', unsafe_allow_html=True)
-    fig2 = visualization.plot_regional_comparison(st.session_state.models_dict)
-    
-    for ax in fig2.get_axes():
-        ax.set_facecolor('white')
-        for line in ax.get_lines():
-            line.set_color('black')
-        for patch in ax.patches:
-            patch.set_facecolor('#f0f0f0')
-            patch.set_edgecolor('black')
-    
-    fig2.patch.set_facecolor('white')
-    st.pyplot(fig2)
-    plt.close(fig2)
+    st.image(
+        visualization.render_regional_comparison(st.session_state.models_dict),
+        width="stretch"
+    )
+
+def _format_interval(interval, fmt: str) -> str:
+    """(low, high) as "[low, high]", or an em dash without an interval"""
+    if interval is None:
+        return "—"
+    low, high = interval
+    return f"[{low:{fmt}}, {high:{fmt}}]"
 
 def display_data_reports():
     """Display data reports and statistics"""
+    pd = lazy_import("pandas")
+    analysis = lazy_import("analysis")
+    visualization = lazy_import("visualization")
+    
     st.markdown('<div class="section-header">Statistical Reports</div>', unsafe_allow_html=True)
     
     report = analysis.regional_comparison_report(st.session_state.models_dict)
@@ -585,17 +880,10 @@ def display_data_reports():
     st.markdown('<div class="subsection-header">Distribution Validation</div>', unsafe_allow_html=True)
     
     if st.session_state.comparisons:
-        fig = visualization.plot_stationary_vs_empirical(st.session_state.comparisons)
-        
-        for ax in fig.get_axes():
-            ax.set_facecolor('white')
-            for patch in ax.patches:
-                patch.set_color('#666666')
-                patch.set_edgecolor('black')
-        
-        fig.patch.set_facecolor('white')
-        st.pyplot(fig)
-        plt.close(fig)
+        st.image(
+            visualization.render_stationary_vs_empirical(st.session_state.comparisons),
+            width="stretch"
+        )
         
         st.markdown('<div class="subsection-header">Model Statistics by Region</div>', unsafe_allow_html=True)
         
@@ -604,17 +892,19 @@ def display_data_reports():
             stats_data.append({
                 'Region': region,
                 'KL Divergence': f"{comp['kl_divergence']:.4f}",
+                'KL 95% CI': _format_interval(comp.get('kl_divergence_ci'), ".4f"),
                 'Chi-Square': f"{comp['chi2_statistic']:.2f}",
                 'Mean Error': f"{comp['mean_absolute_error']:.4f}",
+                'Mean Error 95% CI': _format_interval(comp.get('mean_absolute_error_ci'), ".4f"),
+                'Design Effect': f"{comp['design_effect']:.2f}",
                 'p-value': f"{comp['p_value']:.4f}"
             })
         
-        import pandas as pd
         df_stats = pd.DataFrame(stats_data)
         
         st.dataframe(
             df_stats.set_index('Region'),
-            use_container_width=True,
+            width="stretch",
             column_config={
                 "KL Divergence": st.column_config.NumberColumn("KL Divergence", format="%.4f"),
                 "Chi-Square": st.column_config.NumberColumn("Chi-Square", format="%.2f"),
@@ -628,9 +918,11 @@ def display_data_reports():
         <small>
         <strong>Interpretation:</strong><br>
         • <strong>KL Divergence:</strong> Measures how different empirical distribution is from stationary (0 = identical)<br>
-        • <strong>Chi-Square:</strong> Tests if observed frequencies match expected (lower = better fit)<br>
+        • <strong>Chi-Square:</strong> Distance between empirical and stationary frequencies (descriptive; includes the transient from the initial distribution)<br>
+        • <strong>Design Effect:</strong> Variance inflation from correlated days within a path (1 = independent days)<br>
         • <strong>Mean Error:</strong> Average absolute difference between stationary and empirical probabilities<br>
-        • <strong>p-value:</strong> Probability of observing this data if model is correct (>0.05 suggests good fit)
+        • <strong>95% CI:</strong> Bootstrap intervals from resampling the simulated paths<br>
+        • <strong>p-value:</strong> Chi-square test against the frequencies the model implies over the simulated horizon, adjusted by the design effect (small values indicate a mismatch between simulation and model)
         </small>
         </div>
         """, unsafe_allow_html=True)
@@ -646,20 +938,78 @@ def display_footer():
     """)
     st.markdown('</div>', unsafe_allow_html=True)
 
+def display_import_report():
+    """Display per-module import cost, when requested"""
+    if not (IMPORT_REPORT or st.query_params.get("import_report") == "1"):
+        return
+    
+    timings = _import_timings()
+    with st.expander("⏱️ Startup Import Timing", expanded=False):
+        if not timings:
+            st.text("No heavy modules imported yet.")
+        for module_name, seconds in sorted(timings.items(),
+                                           key=lambda item: -item[1]):
+            st.text(f"{module_name:<20} {seconds * 1000:8.1f} ms")
+
+def display_performance():
+    """Display stage timings of the last simulation run, when requested"""
+    if not (PERFORMANCE_PANEL or st.query_params.get("performance") == "1"):
+        return
+    
+    performance = st.session_state.performance
+    with st.expander("⚙️ Performance", expanded=False):
+        if performance is None:
+            st.text("Run a simulation to record stage timings.")
+            return
+        
+        st.text(f"{'Stage':<48} {'Calls':>6} {'Time (ms)':>11} {'Peak KiB':>10}")
+        for row in performance.report():
+            allocated = row['bytes_allocated']
+            allocated_text = "-" if allocated is None else f"{allocated / 1024:.1f}"
+            st.text(
+                f"{row['stage']:<48} {row['calls']:>6} "
+                f"{row['seconds'] * 1000:>11.1f} {allocated_text:>10}"
+            )
+        
+        st.download_button(
+            "Download JSON",
+            data=performance.to_json(indent=2),
+            file_name="performance.json",
+            mime="application/json"
+        )
+
 def main():
     """Main application function"""
     initialize_session_state()
     
+    sync_pipeline_job()
+    
     display_header()
     
     display_controls()
     
-    if st.session_state.simulations_run:
-        display_metrics()
+    if st.session_state.performance_render_pending:
+        render_profile = st.session_state.performance
+    else:
+        render_profile = instrumentation.Profile()
+    
+    with instrumentation.profile(render_profile):
+        if st.session_state.simulations_run:
+            display_metrics()
 
-    display_main_content()
+        display_main_content()
+    st.session_state.performance_render_pending = False
+    
+    display_performance()
+    
+    display_import_report()
     
     display_footer()
+    
+    if st.session_state.job is not None:
+        # Poll the background run; finished regions appear on each rerun
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
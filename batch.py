@@ -0,0 +1,420 @@
+"""
+Headless batch runner for scenario files
+
+    python batch.py scenarios.json --output-dir results --workers 4
+    python batch.py scenarios.json --only wet_spring --bootstrap 0
+
+A scenario file is JSON: either a list of scenarios or an object with
+"scenarios" and optional "defaults" applied to every scenario:
+
+    {
+        "defaults": {"days": 30, "simulations": 2000, "seed": 42},
+        "scenarios": [
+            {"name": "all_regions"},
+            {"name": "midwest_year", "regions": ["Midwest"], "days": 365,
+             "horizons": [1, 7, 30, 90, 180, 364]},
+            {"name": "custom", "regions": {"Coast": {
+                "transition_matrix": [[0.6, 0.4], [0.3, 0.7]],
+                "initial_dist": [0.5, 0.5],
+                "state_labels": ["Dry", "Wet"], "rain_states": ["Wet"]}}}
+        ]
+    }
+
+"regions" is a list of US_REGIONS names or a dict of region definitions
+in the US_REGIONS format (default: all US regions). Every scenario is
+simulated, forecast and compared, and written to its own directory:
+
+    output_dir/
+        index.json
+        all_regions/
+            summary.json      parameters, scalar statistics, timings
+            summary.npz       per-region arrays
+            forecasts.csv     rain probability per region and horizon
+            comparisons.csv   stationary vs empirical metrics
+            report.txt        regional_comparison_report
+            store/            result_store paths (only with "save_paths")
+
+Scenarios run on a process pool; a single scenario spreads its regions
+over the workers instead. Only NumPy/SciPy modules are imported here,
+never Streamlit, matplotlib or pandas.
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import analysis
+import result_store
+import simulation
+from us_regions import US_REGIONS
+
+INDEX_NAME = "index.json"
+
+# Forecast horizons when a scenario does not list any
+DEFAULT_HORIZONS = [1, 3, 7, 14, 30]
+
+# Keys a scenario may set, with their defaults
+_SCENARIO_DEFAULTS = {
+    "name": None,
+    "regions": None,
+    "days": 30,
+    "simulations": 1000,
+    "seed": None,
+    "horizons": None,
+    "tolerance": None,
+    "target": "rainy_days",
+    "variance_reduction": [],
+    "confidence": 0.95,
+    "chunk_size": simulation.DEFAULT_CHUNK_SIZE,
+    "save_paths": False
+}
+
+# Result entries saved per region in summary.npz (when present)
+_ARRAY_KEYS = [
+    "stationary", "empirical_dist", "rainy_day_histogram", "run_lengths",
+    "daily_rainy_counts"
+]
+
+def load_scenarios(path: str) -> List[Dict]:
+    """
+    Read a scenario file and fill in defaults
+    
+    Raises ValueError for unknown keys, unknown region names, duplicate
+    scenario names or names that share an output slug, before anything
+    is simulated.
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    
+    if isinstance(spec, list):
+        spec = {"scenarios": spec}
+    defaults = dict(_SCENARIO_DEFAULTS)
+    defaults.update(spec.get("defaults", {}))
+    
+    scenarios = []
+    for idx, entry in enumerate(spec.get("scenarios", [])):
+        unknown = (set(entry) | set(defaults)) - set(_SCENARIO_DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown scenario keys: {sorted(unknown)}")
+        
+        scenario = dict(defaults)
+        scenario.update(entry)
+        if scenario["name"] is None:
+            scenario["name"] = f"scenario_{idx}"
+        if scenario["horizons"] is None:
+            scenario["horizons"] = DEFAULT_HORIZONS
+        scenario["regions"] = _resolve_regions(scenario["regions"])
+        scenarios.append(scenario)
+    
+    names = [scenario["name"] for scenario in scenarios]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate scenario names: {duplicates}")
+    _check_slugs(scenarios)
+    
+    return scenarios
+
+def _check_slugs(scenarios: List[Dict]):
+    """
+    Raise ValueError if two scenarios (or two regions of one scenario)
+    map to the same slug, as one's outputs would overwrite the other's
+    """
+    def collisions(names) -> List[List[str]]:
+        groups = {}
+        for name in names:
+            groups.setdefault(_slug(name), []).append(str(name))
+        return [group for group in groups.values() if len(group) > 1]
+    
+    clashes = collisions(scenario["name"] for scenario in scenarios)
+    if clashes:
+        raise ValueError(f"Scenario names share an output directory: {clashes}")
+    for scenario in scenarios:
+        clashes = collisions(scenario["regions"])
+        if clashes:
+            raise ValueError(f"Region names in scenario {scenario['name']!r} "
+                             f"share an output key: {clashes}")
+
+def _resolve_regions(regions) -> Dict:
+    """Region definitions from a list of US region names or a dict"""
+    if regions is None:
+        return dict(US_REGIONS)
+    if isinstance(regions, dict):
+        return regions
+    
+    missing = [name for name in regions if name not in US_REGIONS]
+    if missing:
+        raise ValueError(f"Unknown regions: {missing}")
+    return {name: US_REGIONS[name] for name in regions}
+
+def run_scenario(scenario: Dict, output_dir: str,
+                 max_workers: Optional[int] = None,
+                 n_bootstrap: int = 1000) -> Dict:
+    """
+    Simulate, forecast and compare one scenario and write its outputs
+    
+    Module level so that process pools can pickle it. Returns the
+    scenario's index entry.
+    """
+    directory = os.path.join(output_dir, _slug(scenario["name"]))
+    os.makedirs(directory, exist_ok=True)
+    timings = {}
+    
+    start = time.perf_counter()
+    models_dict = simulation.simulate_multiple_regions(
+        days=scenario["days"],
+        simulations=scenario["simulations"],
+        seed=scenario["seed"],
+        regions=scenario["regions"],
+        max_workers=max_workers,
+        chunk_size=scenario["chunk_size"],
+        tolerance=scenario["tolerance"],
+        target=scenario["target"],
+        confidence=scenario["confidence"],
+        variance_reduction=tuple(scenario["variance_reduction"])
+    )
+    timings["simulate"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    forecasts = simulation.forecast_probability_rain(
+        models_dict, days_ahead=scenario["horizons"],
+        confidence=scenario["confidence"]
+    )
+    timings["forecast"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    comparisons = analysis.compare_distributions(
+        models_dict, n_bootstrap=n_bootstrap,
+        confidence=scenario["confidence"], seed=scenario["seed"]
+    )
+    timings["compare"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    outputs, summary = _write_outputs(directory, scenario, models_dict,
+                                      forecasts, comparisons)
+    if scenario["save_paths"]:
+        result_store.save_results(models_dict, os.path.join(directory, "store"),
+                                  {"scenario": scenario["name"],
+                                   "seed": scenario["seed"]})
+        outputs.append("store")
+    timings["write"] = time.perf_counter() - start
+    
+    summary["timings"] = timings
+    _write_json(os.path.join(directory, "summary.json"), summary)
+    outputs.insert(0, "summary.json")
+    
+    return {
+        "name": scenario["name"],
+        "status": "ok",
+        "directory": os.path.relpath(directory, output_dir),
+        "outputs": outputs,
+        "seconds": sum(timings.values())
+    }
+
+def _write_outputs(directory: str, scenario: Dict, models_dict: Dict,
+                   forecasts: Dict, comparisons: Dict) -> Tuple[List[str], Dict]:
+    """
+    Write summary.npz, the CSV tables and the text report
+    
+    Returns the files written and the summary.json content, which the
+    caller completes with timings.
+    """
+    arrays = {}
+    regions = {}
+    for region_name, results in models_dict.items():
+        prefix = _slug(region_name)
+        for key in _ARRAY_KEYS:
+            if results.get(key) is not None:
+                arrays[f"{prefix}__{key}"] = np.asarray(results[key])
+        
+        horizons = list(forecasts[region_name])
+        arrays[f"{prefix}__horizons"] = np.asarray(horizons)
+        for key in ("theoretical", "empirical", "ci_low", "ci_high"):
+            arrays[f"{prefix}__forecast_{key}"] = np.array(
+                [forecasts[region_name][n][key] for n in horizons], dtype=float
+            )
+        if comparisons[region_name]["empirical_ci"] is not None:
+            arrays[f"{prefix}__empirical_ci"] = comparisons[region_name]["empirical_ci"]
+        
+        comparison = comparisons[region_name]
+        regions[region_name] = {
+            "key": prefix,
+            "states": list(results["state_labels"]),
+            "simulations": int(np.sum(results["rainy_day_histogram"])),
+            "avg_rainy_days": results["avg_rainy_days"],
+            "rainy_percentage": results["rainy_percentage"],
+            "kl_divergence": comparison["kl_divergence"],
+            "chi2_statistic": comparison["chi2_statistic"],
+            "design_effect": comparison["design_effect"],
+            "p_value": comparison["p_value"],
+            "mean_absolute_error": comparison["mean_absolute_error"],
+            "precision": results.get("precision")
+        }
+    
+    np.savez_compressed(os.path.join(directory, "summary.npz"), **arrays)
+    
+    with open(os.path.join(directory, "forecasts.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["region", "horizon", "theoretical", "empirical",
+                         "ci_low", "ci_high", "n_paths"])
+        for region_name, region_forecast in forecasts.items():
+            for n, values in region_forecast.items():
+                writer.writerow([region_name, n] + [
+                    _csv_value(values[key])
+                    for key in ("theoretical", "empirical", "ci_low",
+                                "ci_high", "n_paths")
+                ])
+    
+    with open(os.path.join(directory, "comparisons.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["region", "kl_divergence", "kl_low", "kl_high",
+                         "chi2_statistic", "chi2_low", "chi2_high",
+                         "design_effect", "p_value",
+                         "mean_absolute_error", "mae_low", "mae_high",
+                         "n_observations"])
+        for region_name, comp in comparisons.items():
+            row = [region_name]
+            for key in ("kl_divergence", "chi2_statistic"):
+                row += [comp[key]] + list(comp[f"{key}_ci"] or (None, None))
+            row += [comp["design_effect"], comp["p_value"]]
+            row += ([comp["mean_absolute_error"]]
+                    + list(comp["mean_absolute_error_ci"] or (None, None)))
+            row.append(comp["n_observations"])
+            writer.writerow([_csv_value(value) for value in row])
+    
+    with open(os.path.join(directory, "report.txt"), "w") as f:
+        f.write(analysis.regional_comparison_report(models_dict) + "\n")
+    
+    parameters = {key: value for key, value in scenario.items()
+                  if key != "regions"}
+    parameters["regions"] = list(scenario["regions"])
+    summary = {"scenario": parameters, "regions": regions}
+    
+    return (["summary.npz", "forecasts.csv", "comparisons.csv", "report.txt"],
+            summary)
+
+def run_batch(scenarios: List[Dict], output_dir: str,
+              max_workers: Optional[int] = None,
+              n_bootstrap: int = 1000) -> Dict:
+    """
+    Run every scenario and write output_dir/index.json
+    
+    With several scenarios and max_workers > 1 each scenario runs in
+    its own worker process; a lone scenario uses the workers for its
+    regions. A failing scenario is recorded in the index and does not
+    stop the others. Raises ValueError up front if two scenarios would
+    write to the same directory.
+    """
+    _check_slugs(scenarios)
+    os.makedirs(output_dir, exist_ok=True)
+    entries = {}
+    
+    if max_workers is not None and max_workers > 1 and len(scenarios) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(run_scenario, scenario, output_dir, None,
+                            n_bootstrap): scenario["name"]
+                for scenario in scenarios
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                entries[name] = _finished(name, future.result, output_dir)
+    else:
+        for scenario in scenarios:
+            name = scenario["name"]
+            entries[name] = _finished(
+                name, lambda: run_scenario(scenario, output_dir, max_workers,
+                                           n_bootstrap),
+                output_dir
+            )
+    
+    index = {"scenarios": [entries[scenario["name"]] for scenario in scenarios]}
+    _write_json(os.path.join(output_dir, INDEX_NAME), index)
+    return index
+
+def _finished(name: str, result, output_dir: str) -> Dict:
+    """Index entry of a scenario, reporting failures instead of raising"""
+    try:
+        entry = result()
+    except Exception as exc:
+        entry = {"name": name, "status": "error",
+                 "error": f"{type(exc).__name__}: {exc}"}
+        print(f"[{name}] failed: {entry['error']}")
+        return entry
+    
+    print(f"[{name}] done in {entry['seconds']:.2f}s -> "
+          f"{os.path.join(output_dir, entry['directory'])}")
+    return entry
+
+def _slug(name: str) -> str:
+    """Filesystem- and key-safe version of a scenario or region name"""
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_") or "unnamed"
+
+def _csv_value(value):
+    """Plain Python value for csv, with NaN and None as empty cells"""
+    if value is None:
+        return ""
+    value = value.item() if isinstance(value, np.generic) else value
+    if isinstance(value, float) and math.isnan(value):
+        return ""
+    return value
+
+def _json_value(value):
+    """JSON-compatible copy of value; NaN and infinities become null"""
+    if isinstance(value, dict):
+        return {str(key): _json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _json_value(value.tolist())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def _write_json(path: str, data: Dict):
+    with open(path, "w") as f:
+        json.dump(_json_value(data), f, indent=2)
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenario_file")
+    parser.add_argument("--output-dir", "-o", default="batch_results")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="worker processes")
+    parser.add_argument("--bootstrap", type=int, default=1000,
+                        help="bootstrap replicates per comparison (0: none)")
+    parser.add_argument("--only", nargs="+",
+                        help="run only the scenarios with these names")
+    
+    args = parser.parse_args(argv)
+    
+    try:
+        scenarios = load_scenarios(args.scenario_file)
+    except (OSError, ValueError) as exc:
+        parser.error(str(exc))
+    if args.only:
+        missing = set(args.only) - {scenario["name"] for scenario in scenarios}
+        if missing:
+            parser.error(f"unknown scenarios: {sorted(missing)}")
+        scenarios = [scenario for scenario in scenarios
+                     if scenario["name"] in args.only]
+    
+    index = run_batch(scenarios, args.output_dir, args.workers, args.bootstrap)
+    failed = [entry["name"] for entry in index["scenarios"]
+              if entry["status"] != "ok"]
+    print(f"Wrote {len(index['scenarios']) - len(failed)} of "
+          f"{len(index['scenarios'])} scenarios to {args.output_dir}")
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
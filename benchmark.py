@@ -0,0 +1,278 @@
+"""
+Performance benchmarks with regression gating
+
+    python benchmark.py run --output baseline.json
+    python benchmark.py run --output current.json --days 30 90 --simulations 500 2000
+    python benchmark.py compare baseline.json current.json --threshold 0.2
+
+'run' times every benchmark over a grid of days x simulations x number
+of regions and records the best wall time and peak traced memory.
+'compare' exits with status 1 if any benchmark got slower (or used more
+memory) than the baseline by more than the threshold fraction.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+
+import analysis
+import simulation
+import visualization
+from us_regions import US_REGIONS
+from weather_model import MarkovWeatherModel
+
+def region_subset(n_regions: int) -> Dict:
+    """
+    First n_regions regions; beyond the five US regions the table is
+    repeated under numbered names so larger region sets can be measured
+    """
+    names = list(US_REGIONS.keys())
+    subset = {}
+    for idx in range(n_regions):
+        base = names[idx % len(names)]
+        name = base if idx < len(names) else f"{base} {idx // len(names) + 1}"
+        subset[name] = US_REGIONS[base]
+    return subset
+
+def fresh_model() -> MarkovWeatherModel:
+    """Model with empty caches, so memoized results are not measured"""
+    region_data = US_REGIONS["Southwest"]
+    return MarkovWeatherModel(
+        transition_matrix=region_data["transition_matrix"],
+        initial_dist=region_data["initial_dist"],
+        region_name="Southwest"
+    )
+
+def plotted(plot_func: Callable) -> Callable:
+    """Wrap a plot function so its figure is closed after rendering"""
+    def run(*args):
+        fig = plot_func(*args)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+def build_cases(days: int, simulations: int,
+                n_regions: int) -> List[Tuple[str, Tuple[str, ...], Callable]]:
+    """
+    Benchmark cases for one grid point
+    
+    Each case is (name, grid axes it depends on, setup). setup() returns
+    the zero-argument callable that is timed.
+    """
+    regions = region_subset(n_regions)
+    
+    def simulated():
+        return simulation.simulate_multiple_regions(days, simulations,
+                                                    seed=0, regions=regions)
+    
+    def with_results(func: Callable,
+                     derive: Optional[Callable] = None) -> Callable:
+        """Time func on simulated results, or on derive(results) if given"""
+        def setup():
+            results = simulated()
+            if derive is not None:
+                results = derive(results)
+            return lambda: func(results)
+        return setup
+    
+    def first_paths(results: Dict) -> np.ndarray:
+        return next(iter(results.values()))["sequences"]
+    
+    def with_model(call: Callable) -> Callable:
+        def setup():
+            model = fresh_model()
+            return lambda: call(model)
+        return setup
+    
+    model_axes = ("days", "simulations")
+    region_axes = ("days", "simulations", "regions")
+    
+    return [
+        ("model.simulate_sequence", ("days",),
+         with_model(lambda m: m.simulate_sequence(days))),
+        ("model.expected_rainy_days", ("days",),
+         with_model(lambda m: m.expected_rainy_days(days))),
+        ("model.expected_rainy_days[monte_carlo]", model_axes,
+         with_model(lambda m: m.expected_rainy_days(
+             days, simulations, method="monte_carlo"))),
+        ("model.probability_rain_in_n_days", ("days",),
+         with_model(lambda m: m.probability_rain_in_n_days(days))),
+        ("model.stationary_distribution", (),
+         with_model(lambda m: m.stationary_distribution())),
+        ("simulation.simulate_multiple_regions", region_axes,
+         lambda: simulated),
+        ("simulation.forecast_probability_rain", region_axes,
+         with_results(simulation.forecast_probability_rain)),
+        ("analysis.compare_distributions", region_axes,
+         with_results(analysis.compare_distributions)),
+        ("analysis.analyze_state_durations", model_axes,
+         with_results(lambda r: analysis.analyze_state_durations(
+             first_paths(r)))),
+        ("visualization.plot_transition_matrix", (),
+         with_model(lambda m: plotted(visualization.plot_transition_matrix)(
+             m.P, m.region))),
+        ("visualization.plot_stationary_vs_empirical", ("regions",),
+         with_results(plotted(visualization.plot_stationary_vs_empirical),
+                      derive=analysis.compare_distributions)),
+        ("visualization.plot_rain_probability_forecast", ("regions",),
+         with_results(plotted(visualization.plot_rain_probability_forecast),
+                      derive=simulation.forecast_probability_rain)),
+        ("visualization.plot_regional_comparison", ("regions",),
+         with_results(plotted(visualization.plot_regional_comparison))),
+    ]
+
+def measure(setup: Callable, repeat: int) -> Dict:
+    """Best wall time over repeat runs, then peak traced memory of one run"""
+    timings = []
+    for _ in range(repeat):
+        target = setup()
+        start = time.perf_counter()
+        target()
+        timings.append(time.perf_counter() - start)
+    
+    target = setup()
+    tracemalloc.start()
+    try:
+        target()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return {"seconds": min(timings), "peak_bytes": peak}
+
+def run_benchmarks(days_grid: List[int], simulations_grid: List[int],
+                   regions_grid: List[int], repeat: int = 3,
+                   only: str = None) -> Dict:
+    """Run every case over the grid, skipping repeats of grid points a
+    case does not depend on"""
+    results = []
+    seen = set()
+    
+    for days in days_grid:
+        for simulations in simulations_grid:
+            for n_regions in regions_grid:
+                params = {"days": days, "simulations": simulations,
+                          "regions": n_regions}
+                for name, axes, setup in build_cases(days, simulations,
+                                                     n_regions):
+                    if only and only not in name:
+                        continue
+                    point = {axis: params[axis] for axis in axes}
+                    key = benchmark_key(name, point)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    
+                    record = {"name": name, "params": point}
+                    record.update(measure(setup, repeat))
+                    results.append(record)
+                    print(f"{key:<75} {record['seconds'] * 1000:10.2f} ms "
+                          f"{record['peak_bytes'] / 1024:10.1f} KiB")
+    
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "repeat": repeat
+        },
+        "results": results
+    }
+
+def benchmark_key(name: str, params: Dict) -> str:
+    """Identifier of one benchmark at one grid point"""
+    point = ",".join(f"{axis}={value}" for axis, value in sorted(params.items()))
+    return f"{name}[{point}]"
+
+def compare_runs(baseline: Dict, current: Dict, threshold: float,
+                 memory_threshold: float = None) -> List[str]:
+    """
+    Report lines for every benchmark slower (or larger) than baseline by
+    more than the threshold fraction
+    """
+    previous = {benchmark_key(r["name"], r["params"]): r
+                for r in baseline["results"]}
+    regressions = []
+    
+    for record in current["results"]:
+        key = benchmark_key(record["name"], record["params"])
+        if key not in previous:
+            continue
+        old = previous[key]
+        
+        ratio = record["seconds"] / max(old["seconds"], 1e-12)
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{key}: time {old['seconds'] * 1000:.2f} ms -> "
+                f"{record['seconds'] * 1000:.2f} ms ({ratio:.2f}x)"
+            )
+        
+        if memory_threshold is not None:
+            mem_ratio = record["peak_bytes"] / max(old["peak_bytes"], 1)
+            if mem_ratio > 1 + memory_threshold:
+                regressions.append(
+                    f"{key}: peak memory {old['peak_bytes']} B -> "
+                    f"{record['peak_bytes']} B ({mem_ratio:.2f}x)"
+                )
+    
+    return regressions
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    run_parser = commands.add_parser("run", help="run benchmarks")
+    run_parser.add_argument("--output", "-o", default="benchmark_results.json")
+    run_parser.add_argument("--days", type=int, nargs="+", default=[30, 90])
+    run_parser.add_argument("--simulations", type=int, nargs="+",
+                            default=[100, 1000])
+    run_parser.add_argument("--regions", type=int, nargs="+", default=[1, 5])
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--only", help="run benchmarks whose name "
+                                           "contains this text")
+    
+    compare_parser = commands.add_parser("compare",
+                                         help="compare against a baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.25,
+                                help="allowed slowdown fraction")
+    compare_parser.add_argument("--memory-threshold", type=float,
+                                help="allowed peak memory growth fraction")
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == "run":
+        report = run_benchmarks(args.days, args.simulations, args.regions,
+                                args.repeat, args.only)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(report['results'])} results to {args.output}")
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    
+    regressions = compare_runs(baseline, current, args.threshold,
+                               args.memory_threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print("No regressions beyond threshold")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,400 @@
+"""
+Transition matrix estimation from historical daily observations
+
+Observation files (CSV or Parquet) are read in chunks of rows. Each chunk
+is reduced to per-station transition counts with one vectorized bincount,
+and chunk counts are merged in file order, stitching together the pairs
+of days that straddle a chunk boundary. Memory therefore depends on the
+chunk size and the number of stations, not on the size of the input.
+
+Rows of one station are expected in chronological order (files may be
+interleaved by station). With a date column, only pairs of observations
+exactly one day apart are counted, so gaps in the record are skipped.
+"""
+
+import csv
+import os
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+from weather_model import DEFAULT_STATES, MarkovWeatherModel
+from instrumentation import instrumented
+import simulation
+
+# Rows per chunk read from an observation file
+DEFAULT_CHUNK_ROWS = 100000
+
+# Default column names in observation files
+DEFAULT_COLUMNS = {
+    "region": "region",
+    "station": "station",
+    "date": "date",
+    "state": "weather"
+}
+
+class TransitionCounts:
+    """
+    Mergeable transition and state counts per (region, station)
+    
+    Besides the counts, the first and last observation of every station
+    are kept so that a later chunk can add the transition that crosses
+    the boundary between the two.
+    """
+    
+    def __init__(self, states: Optional[List[str]] = None):
+        self.states = list(states) if states is not None else list(DEFAULT_STATES)
+        # (region, station) -> (S, S) transition counts
+        self.transitions = {}
+        # (region, station) -> (S,) observation counts
+        self.observations = {}
+        # (region, station) -> (day, state code) of first / last observation
+        self.first = {}
+        self.last = {}
+    
+    @property
+    def keys(self) -> List[Tuple[str, str]]:
+        return list(self.transitions.keys())
+    
+    def merge(self, other: "TransitionCounts") -> "TransitionCounts":
+        """
+        Add the counts of other, which must cover data that comes after
+        this object's data in file order; returns self
+        """
+        if other.states != self.states:
+            raise ValueError("Cannot merge counts over different state labels")
+        
+        for key, transitions in other.transitions.items():
+            if key not in self.transitions:
+                self.transitions[key] = transitions.copy()
+                self.observations[key] = other.observations[key].copy()
+                self.first[key] = other.first[key]
+                self.last[key] = other.last[key]
+                continue
+            
+            self.transitions[key] += transitions
+            self.observations[key] += other.observations[key]
+            
+            prev_day, prev_state = self.last[key]
+            next_day, next_state = other.first[key]
+            if _consecutive(prev_day, next_day):
+                self.transitions[key][prev_state, next_state] += 1
+            self.last[key] = other.last[key]
+        
+        return self
+    
+    def region_counts(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Transition and observation counts summed over each region's stations"""
+        totals = {}
+        for (region, station), transitions in self.transitions.items():
+            observations = self.observations[(region, station)]
+            if region in totals:
+                totals[region][0] += transitions
+                totals[region][1] += observations
+            else:
+                totals[region] = [transitions.copy(), observations.copy()]
+        
+        return {region: tuple(pair) for region, pair in totals.items()}
+    
+    def to_regions(self, smoothing: float = 0.0,
+                   by: str = "region",
+                   rain_states: Optional[List[str]] = None) -> Dict:
+        """
+        Region definitions in the US_REGIONS format
+        
+        Parameters:
+        -----------
+        smoothing : float
+            Pseudocount added to every transition count (additive /
+            Laplace smoothing); with 0, every state must have at least one
+            observed outgoing transition
+        by : str
+            "region" pools all stations of a region; "station" gives one
+            entry per station, named "region/station"
+        rain_states : List[str] or None
+            Stored with each definition when the states are not the
+            default Sunny/Rainy/Cloudy
+        """
+        if by == "region":
+            grouped = self.region_counts()
+        elif by == "station":
+            grouped = {
+                f"{region}/{station}": (self.transitions[(region, station)],
+                                        self.observations[(region, station)])
+                for region, station in self.transitions
+            }
+        else:
+            raise ValueError(f"Unknown grouping: {by}")
+        
+        regions = {}
+        for name, (transitions, observations) in grouped.items():
+            region_data = {
+                "transition_matrix": estimate_transition_matrix(
+                    transitions, smoothing, name, self.states
+                ),
+                "initial_dist": observations / observations.sum(),
+                "n_transitions": int(transitions.sum())
+            }
+            if self.states != list(DEFAULT_STATES) or rain_states is not None:
+                region_data["state_labels"] = list(self.states)
+                region_data["rain_states"] = rain_states
+            regions[name] = region_data
+        
+        return regions
+
+def estimate_transition_matrix(transitions: np.ndarray,
+                               smoothing: float = 0.0,
+                               name: str = "",
+                               states: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Row-normalize transition counts into a stochastic matrix
+    """
+    if smoothing < 0:
+        raise ValueError(f"Smoothing must be non-negative: {smoothing}")
+    
+    smoothed = np.asarray(transitions, dtype=float) + smoothing
+    row_sums = smoothed.sum(axis=1)
+    if np.any(row_sums == 0):
+        states = states if states is not None else list(DEFAULT_STATES)
+        missing = [states[i] for i in np.flatnonzero(row_sums == 0)]
+        where = f" for {name}" if name else ""
+        raise ValueError(
+            f"No observed transitions out of {missing}{where}; "
+            f"use smoothing > 0"
+        )
+    
+    return smoothed / row_sums[:, None]
+
+def count_chunk(chunk: Dict[str, np.ndarray],
+                states: Optional[List[str]] = None) -> TransitionCounts:
+    """
+    Transition counts for one chunk of observations
+    
+    chunk maps "region", "station", "state" and optionally "date" (days
+    since the epoch as integers) to equal-length arrays in file order.
+    Rows with labels outside states are treated as missing observations
+    (without dates, the rows around them are still paired).
+    """
+    counts = TransitionCounts(states)
+    size = len(counts.states)
+    
+    labels = np.asarray(chunk["state"]).astype(str)
+    codes = np.full(len(labels), -1, dtype=np.intp)
+    for code, label in enumerate(counts.states):
+        codes[labels == label] = code
+    
+    valid = codes >= 0
+    keys = np.char.add(np.char.add(np.asarray(chunk["region"]).astype(str), "\x1f"),
+                       np.asarray(chunk["station"]).astype(str))[valid]
+    codes = codes[valid]
+    if chunk.get("date") is not None:
+        days = np.asarray(chunk["date"], dtype=np.int64)[valid]
+    else:
+        days = None
+    if len(codes) == 0:
+        return counts
+    
+    unique_keys, groups = np.unique(keys, return_inverse=True)
+    n_groups = len(unique_keys)
+    
+    # Stations may be interleaved; a stable sort puts each station's rows
+    # together while keeping them in file order
+    order = np.argsort(groups.ravel(), kind="stable")
+    groups = groups.ravel()[order]
+    codes = codes[order]
+    if days is not None:
+        days = days[order]
+    
+    # Pairs of adjacent rows from the same station (and, with dates,
+    # exactly one day apart)
+    pairs = groups[1:] == groups[:-1]
+    if days is not None:
+        pairs &= np.diff(days) == 1
+    index = (groups[:-1][pairs] * size + codes[:-1][pairs]) * size + codes[1:][pairs]
+    transitions = np.bincount(index, minlength=n_groups * size * size)
+    transitions = transitions.reshape(n_groups, size, size)
+    observations = np.bincount(groups * size + codes,
+                               minlength=n_groups * size).reshape(n_groups, size)
+    
+    first_rows = np.searchsorted(groups, np.arange(n_groups), side="left")
+    last_rows = np.searchsorted(groups, np.arange(n_groups), side="right") - 1
+    
+    for group, key in enumerate(unique_keys):
+        key = tuple(key.split("\x1f", 1))
+        counts.transitions[key] = transitions[group].astype(np.int64)
+        counts.observations[key] = observations[group].astype(np.int64)
+        first, last = first_rows[group], last_rows[group]
+        counts.first[key] = (None if days is None else int(days[first]),
+                             int(codes[first]))
+        counts.last[key] = (None if days is None else int(days[last]),
+                            int(codes[last]))
+    
+    return counts
+
+def read_observation_chunks(path: str,
+                            chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                            columns: Optional[Dict[str, str]] = None
+                            ) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Yield chunks of an observation file as column arrays
+    
+    Files ending in .parquet / .pq are read with pyarrow, others as CSV
+    (with pandas when installed, else the csv module). columns maps the
+    keys "region", "station", "date" and "state" to column names; a key
+    mapped to None is treated as absent ("station" then defaults to one
+    station per region, "date" to consecutive rows being consecutive days).
+    """
+    columns = {**DEFAULT_COLUMNS, **(columns or {})}
+    wanted = {key: name for key, name in columns.items() if name is not None}
+    
+    if path.lower().endswith((".parquet", ".pq")):
+        raw_chunks = _read_parquet(path, chunk_rows, list(wanted.values()))
+    else:
+        raw_chunks = _read_csv(path, chunk_rows, list(wanted.values()))
+    
+    for raw in raw_chunks:
+        chunk = {key: raw[name] for key, name in wanted.items()}
+        n_rows = len(chunk["state"])
+        chunk.setdefault("station", np.full(n_rows, ""))
+        if "date" in chunk:
+            chunk["date"] = _to_days(chunk["date"])
+        yield chunk
+
+@instrumented()
+def count_observations(paths: Union[str, Sequence[str]],
+                       states: Optional[List[str]] = None,
+                       chunk_rows: int = DEFAULT_CHUNK_ROWS,
+                       columns: Optional[Dict[str, str]] = None,
+                       max_workers: Optional[int] = None,
+                       executor: Optional[Executor] = None) -> TransitionCounts:
+    """
+    Accumulate transition counts over one or more observation files
+    
+    Files are read chunk by chunk in the given order (a station's record
+    may continue from one file into the next). With an executor or
+    max_workers > 1, chunks are counted in worker processes while the
+    next chunks are read; at most two chunks per worker (max_workers, or
+    the CPU count for a caller-supplied executor) are in flight and results
+    are merged in file order.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    
+    chunks = (chunk for path in paths
+              for chunk in read_observation_chunks(path, chunk_rows, columns))
+    total = TransitionCounts(states)
+    
+    if executor is None and (max_workers is None or max_workers <= 1):
+        for chunk in chunks:
+            total.merge(count_chunk(chunk, states))
+        return total
+    
+    max_pending = 2 * (max_workers or os.cpu_count() or 1)
+    if executor is not None:
+        _count_in_pool(executor, chunks, states, total, max_pending)
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            _count_in_pool(pool, chunks, states, total, max_pending)
+    
+    return total
+
+@instrumented()
+def fit_regions(paths: Union[str, Sequence[str]],
+                states: Optional[List[str]] = None,
+                rain_states: Optional[List[str]] = None,
+                smoothing: float = 0.0,
+                by: str = "region",
+                **count_kwargs) -> Dict:
+    """
+    Estimate region definitions (US_REGIONS format) from observation files
+    
+    The result can be passed as regions= to simulate_multiple_regions.
+    Extra keyword arguments go to count_observations.
+    """
+    counts = count_observations(paths, states, **count_kwargs)
+    return counts.to_regions(smoothing, by, rain_states)
+
+def fit_models(paths: Union[str, Sequence[str]],
+               states: Optional[List[str]] = None,
+               rain_states: Optional[List[str]] = None,
+               smoothing: float = 0.0,
+               by: str = "region",
+               **count_kwargs) -> Dict[str, MarkovWeatherModel]:
+    """
+    Fitted MarkovWeatherModel per region (or station) from observation files
+    """
+    regions = fit_regions(paths, states, rain_states, smoothing, by,
+                          **count_kwargs)
+    return {
+        name: simulation.build_region_model(name, region_data)
+        for name, region_data in regions.items()
+    }
+
+def _count_in_pool(executor: Executor, chunks: Iterator[Dict],
+                   states: Optional[List[str]], total: TransitionCounts,
+                   max_pending: int):
+    """Count chunks on executor, keeping the read-ahead bounded"""
+    pending = []
+    for chunk in chunks:
+        pending.append(executor.submit(count_chunk, chunk, states))
+        if len(pending) >= max_pending:
+            total.merge(pending.pop(0).result())
+    for future in pending:
+        total.merge(future.result())
+
+def _consecutive(prev_day: Optional[int], next_day: Optional[int]) -> bool:
+    """Whether two observations are on adjacent days (or undated)"""
+    if prev_day is None or next_day is None:
+        return prev_day is None and next_day is None
+    return next_day - prev_day == 1
+
+def _to_days(values) -> np.ndarray:
+    """Dates (strings or datetime64) as integer days since the epoch"""
+    return np.asarray(values).astype("datetime64[D]").astype(np.int64)
+
+def _read_csv(path: str, chunk_rows: int,
+              names: List[str]) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield CSV chunks as column arrays"""
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+    
+    if pd is not None:
+        reader = pd.read_csv(path, usecols=names, dtype=str,
+                             chunksize=chunk_rows)
+        for frame in reader:
+            yield {name: frame[name].to_numpy(dtype=str) for name in names}
+        return
+    
+    with open(path, newline="") as handle:
+        reader = csv.reader(handle)
+        header = next(reader)
+        missing = [name for name in names if name not in header]
+        if missing:
+            raise ValueError(f"Columns {missing} not found in {path}")
+        positions = [header.index(name) for name in names]
+        
+        rows = []
+        for row in reader:
+            rows.append([row[pos] for pos in positions])
+            if len(rows) == chunk_rows:
+                yield dict(zip(names, np.array(rows, dtype=str).T))
+                rows = []
+        if rows:
+            yield dict(zip(names, np.array(rows, dtype=str).T))
+
+def _read_parquet(path: str, chunk_rows: int,
+                  names: List[str]) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield Parquet record batches as column arrays"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet observation files requires pyarrow")
+    
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows,
+                                           columns=names):
+        yield {
+            name: batch.column(name).to_numpy(zero_copy_only=False)
+            for name in names
+        }
@@ -0,0 +1,139 @@
+"""
+Lightweight stage timing for the simulation, analysis and plotting code
+
+    with instrumentation.profile() as prof:
+        results = simulation.simulate_multiple_regions(30, 500)
+    print(prof.to_json())
+
+Functions decorated with @instrumented (or blocks wrapped in stage())
+record wall time, call count and, while memory tracking is enabled,
+peak bytes allocated into the active Profile.
+
+Memory figures never reset the tracemalloc peak, which is process-wide
+and shared with other users (benchmark peaks, other threads). A stage
+reports the highest traced memory it can observe above its start: the
+traced size at its own and its nested stages' boundaries, and the
+process peak whenever the stage pushed it higher. Transient peaks below
+an earlier process peak are therefore missed, making the figure a lower
+bound, and allocations by other threads running at the same time are
+counted too.
+"""
+
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+class Profile:
+    """Per-stage totals: calls, wall seconds and peak bytes allocated"""
+    
+    def __init__(self):
+        self.stages = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def record(self, name: str, seconds: float, allocated: Optional[int]):
+        with self._lock:
+            entry = self.stages.setdefault(
+                name, {"calls": 0, "seconds": 0.0, "bytes_allocated": None}
+            )
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            if allocated is not None:
+                entry["bytes_allocated"] = max(entry["bytes_allocated"] or 0,
+                                               allocated)
+    
+    def report(self) -> List[Dict]:
+        """Stages in first-seen order, as a list of flat dicts"""
+        with self._lock:
+            return [dict(stage=name, **entry)
+                    for name, entry in self.stages.items()]
+    
+    def to_json(self, **kwargs) -> str:
+        return json.dumps({"stages": self.report()}, **kwargs)
+    
+    def reset(self):
+        with self._lock:
+            self.stages.clear()
+
+# Stages recorded outside any profile() block land here
+GLOBAL_PROFILE = Profile()
+
+_active_profile = ContextVar("active_profile", default=GLOBAL_PROFILE)
+
+# Open stages of this context, innermost last; each frame is
+# [traced bytes at entry, process peak at entry, highest bytes seen]
+_open_frames: ContextVar[Tuple[List[int], ...]] = ContextVar("open_frames",
+                                                            default=())
+
+@contextmanager
+def profile(target: Optional[Profile] = None):
+    """Record stages in this context into target (a new Profile if None)"""
+    target = Profile() if target is None else target
+    token = _active_profile.set(target)
+    try:
+        yield target
+    finally:
+        _active_profile.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """
+    Time a block and add it to the active profile
+    
+    See the module docstring for what the bytes figure can and cannot
+    see; the tracemalloc state itself is only read.
+    """
+    token = None
+    frame = None
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        frame = [current, peak, current]
+        token = _open_frames.set(_open_frames.get() + (frame,))
+    
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        
+        allocated = None
+        if frame is not None:
+            _open_frames.reset(token)
+            if tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                start_bytes, entry_peak, highest = frame
+                highest = max(highest, current,
+                              peak if peak > entry_peak else 0)
+                allocated = highest - start_bytes
+                parents = _open_frames.get()
+                if parents:
+                    parents[-1][2] = max(parents[-1][2], highest)
+        
+        _active_profile.get().record(name, seconds, allocated)
+
+def instrumented(name: Optional[str] = None) -> Callable:
+    """Decorator form of stage(); defaults to module.function as name"""
+    def decorator(func: Callable) -> Callable:
+        stage_name = name or f"{func.__module__}.{func.__qualname__}"
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+def enable_memory_tracking():
+    """Start tracemalloc so stages also report bytes allocated"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def disable_memory_tracking():
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
@@ -0,0 +1,250 @@
+"""
+On-disk store for simulation results
+Each region's path matrix is a memory-mapped .npy file, its summary
+statistics an .npz file, and a JSON manifest ties a run together:
+
+    run_dir/
+        manifest.json
+        000_southwest/paths.npy
+        000_southwest/summary.npz
+        ...
+"""
+
+import json
+import os
+import re
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Union
+import scipy.sparse as sparse
+from weather_model import state_code_dtype
+import simulation
+
+MANIFEST_NAME = "manifest.json"
+FORMAT_VERSION = 1
+
+# Result entries written to summary.npz (when present)
+_SUMMARY_KEYS = [
+    "stationary", "empirical_dist", "avg_rainy_days", "rainy_percentage",
+    "rainy_day_histogram", "run_lengths", "rainy_counts", "daily_rainy_counts"
+]
+
+def simulate_to_store(directory: str,
+                      days: int = 30,
+                      simulations: int = 1000,
+                      seed: Union[int, np.random.SeedSequence, None] = None,
+                      regions: Optional[Dict] = None,
+                      chunk_size: int = simulation.DEFAULT_CHUNK_SIZE) -> "ResultStore":
+    """
+    Simulate all regions straight into an on-disk store
+    
+    Paths are written chunk by chunk into memory-mapped files, so a run
+    may be larger than RAM. Region streams are spawned from seed exactly
+    as in simulate_multiple_regions, giving identical paths.
+    """
+    if regions is None:
+        from us_regions import US_REGIONS
+        regions = US_REGIONS
+    
+    os.makedirs(directory, exist_ok=True)
+    seed_seq = (seed if isinstance(seed, np.random.SeedSequence)
+                else np.random.SeedSequence(seed))
+    streams = seed_seq.spawn(len(regions))
+    entries = {}
+    
+    for idx, ((region_name, region_data), stream) in enumerate(
+            zip(regions.items(), streams)):
+        region_dir = _region_dir_name(idx, region_name)
+        os.makedirs(os.path.join(directory, region_dir), exist_ok=True)
+        
+        matrix = region_data["transition_matrix"]
+        n_states = (matrix.shape if sparse.issparse(matrix)
+                    else np.shape(matrix))[1]
+        paths_file = os.path.join(region_dir, "paths.npy")
+        sequences = np.lib.format.open_memmap(
+            os.path.join(directory, paths_file), mode="w+",
+            dtype=state_code_dtype(n_states), shape=(simulations, days)
+        )
+        results = simulation.simulate_region(
+            region_name, region_data, days, simulations, stream,
+            chunk_size=chunk_size, sequences_out=sequences
+        )
+        sequences.flush()
+        del sequences
+        
+        entries[region_name] = _write_region(directory, region_dir,
+                                             results, paths_file)
+    
+    _write_manifest(directory, days, simulations, entries,
+                    {"seed": _seed_entropy(seed_seq)})
+    return ResultStore(directory)
+
+def save_results(models_dict: Dict, directory: str,
+                 metadata: Optional[Dict] = None) -> "ResultStore":
+    """
+    Write in-memory simulate_multiple_regions results to a store
+    """
+    os.makedirs(directory, exist_ok=True)
+    entries = {}
+    days = simulations = None
+    
+    for idx, (region_name, results) in enumerate(models_dict.items()):
+        region_dir = _region_dir_name(idx, region_name)
+        os.makedirs(os.path.join(directory, region_dir), exist_ok=True)
+        
+        paths_file = None
+        sequences = results.get("sequences")
+        if sequences is not None:
+            paths_file = os.path.join(region_dir, "paths.npy")
+            np.save(os.path.join(directory, paths_file),
+                    np.asarray(sequences))
+            simulations, days = sequences.shape
+        
+        entries[region_name] = _write_region(directory, region_dir,
+                                             results, paths_file)
+    
+    _write_manifest(directory, days, simulations, entries, metadata or {})
+    return ResultStore(directory)
+
+class ResultStore:
+    """
+    Read access to a run written by simulate_to_store or save_results
+    
+    Path matrices are opened as read-only memory maps, so slices are
+    read from disk only when touched.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            self.manifest = json.load(f)
+        
+        if self.manifest.get("format_version") != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported result store version: "
+                f"{self.manifest.get('format_version')}"
+            )
+    
+    @property
+    def regions(self) -> List[str]:
+        return list(self.manifest["regions"].keys())
+    
+    def paths(self, region_name: str) -> Optional[np.ndarray]:
+        """Memory-mapped (simulations, days) path matrix, or None"""
+        paths_file = self.manifest["regions"][region_name]["paths"]
+        if paths_file is None:
+            return None
+        
+        return np.load(os.path.join(self.directory, paths_file),
+                       mmap_mode="r")
+    
+    def iter_path_chunks(self, region_name: str,
+                         chunk_size: int = simulation.DEFAULT_CHUNK_SIZE) -> Iterator[np.ndarray]:
+        """Yield the path matrix in row blocks of at most chunk_size"""
+        paths = self.paths(region_name)
+        if paths is None:
+            return
+        
+        for start in range(0, len(paths), chunk_size):
+            yield np.asarray(paths[start:start + chunk_size])
+    
+    def summary(self, region_name: str) -> Dict:
+        """Summary statistics of one region"""
+        entry = self.manifest["regions"][region_name]
+        with np.load(os.path.join(self.directory, entry["summary"])) as data:
+            summary = {key: data[key] for key in data.files}
+        
+        for key in ("avg_rainy_days", "rainy_percentage"):
+            summary[key] = float(summary[key])
+        summary["state_labels"] = entry["state_labels"]
+        
+        return summary
+    
+    def load_models_dict(self) -> Dict:
+        """
+        Rebuild results in the simulate_multiple_regions format
+        
+        "sequences" entries are memory maps; models are reconstructed
+        from the stored transition matrices.
+        """
+        models_dict = {}
+        for region_name in self.regions:
+            summary = self.summary(region_name)
+            entry = self.manifest["regions"][region_name]
+            if "transition_table" in summary:
+                matrix = summary.pop("transition_table")
+            elif "transition_indptr" in summary:
+                matrix = sparse.csr_matrix(
+                    (summary.pop("transition_data"),
+                     summary.pop("transition_indices"),
+                     summary.pop("transition_indptr")),
+                    shape=(len(entry["state_labels"]),) * 2
+                )
+            else:
+                matrix = summary.pop("transition_matrix")
+            model = simulation.build_region_model(region_name, {
+                "transition_matrix": matrix,
+                "initial_dist": summary.pop("initial_dist"),
+                "state_labels": entry["state_labels"],
+                "rain_states": entry.get("rain_states"),
+                "order": entry.get("order", 1)
+            })
+            summary.setdefault("rainy_counts", None)
+            summary["model"] = model
+            summary["sequences"] = self.paths(region_name)
+            models_dict[region_name] = summary
+        
+        return models_dict
+
+def _region_dir_name(idx: int, region_name: str) -> str:
+    """Filesystem-safe, collision-free directory name for a region"""
+    slug = re.sub(r"[^a-z0-9]+", "_", region_name.lower()).strip("_")
+    return f"{idx:03d}_{slug}"
+
+def _write_region(directory: str, region_dir: str, results: Dict,
+                  paths_file: Optional[str]) -> Dict:
+    """Save one region's summary and return its manifest entry"""
+    summary = {
+        key: np.asarray(results[key]) for key in _SUMMARY_KEYS
+        if results.get(key) is not None
+    }
+    model = results["model"]
+    order = getattr(model, "order", 1)
+    if order > 1:
+        summary["transition_table"] = model.table
+        summary["initial_dist"] = model.lifted.initial
+    elif model.is_sparse:
+        summary["transition_data"] = model.P.data
+        summary["transition_indices"] = model.P.indices
+        summary["transition_indptr"] = model.P.indptr
+    else:
+        summary["transition_matrix"] = model.P
+    summary.setdefault("initial_dist", model.initial)
+    
+    summary_file = os.path.join(region_dir, "summary.npz")
+    np.savez(os.path.join(directory, summary_file), **summary)
+    
+    return {
+        "paths": paths_file,
+        "summary": summary_file,
+        "state_labels": list(results["state_labels"]),
+        "rain_states": list(model.rain_states),
+        "order": order
+    }
+
+def _write_manifest(directory: str, days: Optional[int],
+                    simulations: Optional[int], entries: Dict,
+                    metadata: Dict):
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "days": days,
+        "simulations": simulations,
+        "metadata": metadata,
+        "regions": entries
+    }
+    with open(os.path.join(directory, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+def _seed_entropy(seed_seq: np.random.SeedSequence):
+    """JSON-serializable entropy of a SeedSequence"""
+    entropy = seed_seq.entropy
+    return list(map(int, entropy)) if isinstance(entropy, (list, tuple, np.ndarray)) else int(entropy)
@@ -1,86 +1,1120 @@
+import copy
+import hashlib
+import logging
+import threading
 import numpy as np
-from typing import List, Dict, Tuple
-from weather_model import MarkovWeatherModel
+from statistics import NormalDist
+from scipy import stats
+from concurrent.futures import (Executor, ProcessPoolExecutor, FIRST_COMPLETED,
+                                wait)
+from typing import Callable, List, Dict, Tuple, Optional, Union
+import scipy.sparse as sparse
+from weather_model import MarkovWeatherModel, HigherOrderMarkovWeatherModel, RegionEnsemble
+from instrumentation import instrumented
 
+logger = logging.getLogger(__name__)
+
+# Paths simulated per chunk by simulate_region
+DEFAULT_CHUNK_SIZE = 10000
+
+# Seconds between cancellation checks while waiting on pool workers
+_CANCEL_POLL_INTERVAL = 0.1
+
+# Options accepted in variance_reduction by simulate_region
+VARIANCE_REDUCTION_METHODS = ("antithetic", "control_variate", "stratified")
+
+# Quantities an adaptive run can be asked to pin down
+_PRECISION_TARGETS = ("rainy_days", "state_frequencies")
+
+# Per-path visit counts held at once by PrecisionEstimator.update
+_PRECISION_BLOCK_ENTRIES = 1 << 22
+
+# Independent Latin hypercubes per stratified chunk; their spread gives
+# the variance of stratified estimates
+_LHS_REPLICATES = 10
+
+# Largest double below 1; keeps transformed uniforms inside [0, 1)
+_BELOW_ONE = np.nextafter(1.0, 0.0)
+
+class SimulationCancelled(Exception):
+    """Raised when a simulation is stopped through its cancel event"""
+
+@instrumented()
 def simulate_multiple_regions(days: int = 30, 
-                             simulations: int = 1000) -> Dict:
+                             simulations: int = 1000,
+                             seed: Union[int, np.random.SeedSequence, None] = None,
+                             regions: Optional[Dict] = None,
+                             max_workers: Optional[int] = None,
+                             executor: Optional[Executor] = None,
+                             keep_sequences: bool = True,
+                             chunk_size: int = DEFAULT_CHUNK_SIZE,
+                             progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                             region_callback: Optional[Callable[[str, Dict], None]] = None,
+                             cancel_event: Optional[threading.Event] = None,
+                             extensible: bool = False,
+                             tolerance: Optional[float] = None,
+                             target: str = "rainy_days",
+                             confidence: float = 0.95,
+                             variance_reduction: Tuple[str, ...] = ()) -> Dict:
     """
     Simulate weather for all US regions
+    
+    Parameters:
+    -----------
+    days : int
+        Length of each simulated sequence
+    simulations : int
+        Number of sequences per region
+    seed : int, SeedSequence or None
+        Root seed; each region gets its own child stream spawned from it,
+        so results do not depend on how regions are spread over workers
+    regions : Dict or None
+        Region definitions in the US_REGIONS format (default US_REGIONS)
+    max_workers : int or None
+        If greater than 1, regions are simulated in a process pool of
+        this size
+    executor : Executor or None
+        Existing executor to fan regions out to; takes precedence over
+        max_workers and is not shut down here
+    keep_sequences : bool
+        If False, run in streaming mode: paths are simulated chunk by
+        chunk and only summary statistics are returned ("sequences" and
+        "rainy_counts" are None)
+    chunk_size : int
+        Paths simulated per chunk
+    progress_callback : callable or None
+        Called as progress_callback(region_name, paths_done, simulations);
+        after every chunk when regions run in this process, once per
+        finished region when they run on a pool
+    region_callback : callable or None
+        Called as region_callback(region_name, region_results) as soon as
+        a region finishes, so partial results can be shown early
+    cancel_event : threading.Event or None
+        When set, remaining chunks and regions are abandoned and
+        SimulationCancelled is raised
+    extensible : bool
+        Keep what extend_multiple_regions needs to add paths or days
+        later (see simulate_region)
+    tolerance, target, confidence, variance_reduction
+        Adaptive precision and variance reduction options, passed to
+        simulate_region; with a tolerance, simulations is the maximum
+        number of paths per region
     """
-    from us_regions import US_REGIONS, WEATHER_STATES
+    if regions is None:
+        from us_regions import US_REGIONS
+        regions = US_REGIONS
     
-    results = {}
+    seed_seq = (seed if isinstance(seed, np.random.SeedSequence)
+                else np.random.SeedSequence(seed))
+    streams = seed_seq.spawn(len(regions))
+    options = {
+        "extensible": extensible,
+        "tolerance": tolerance,
+        "target": target,
+        "confidence": confidence,
+        "variance_reduction": tuple(variance_reduction)
+    }
+    tasks = [
+        (region_name, region_data, days, simulations, stream,
+         keep_sequences, chunk_size, options)
+        for (region_name, region_data), stream in zip(regions.items(), streams)
+    ]
+    
+    if executor is not None:
+        region_results = _run_region_tasks(executor, tasks, progress_callback,
+                                           region_callback, cancel_event)
+    elif max_workers is not None and max_workers > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            region_results = _run_region_tasks(pool, tasks, progress_callback,
+                                               region_callback, cancel_event)
+    else:
+        region_results = {}
+        for task in tasks:
+            region_name = task[0]
+            region_results[region_name] = simulate_region(
+                *task[:-1], **task[-1],
+                progress_callback=progress_callback,
+                cancel_event=cancel_event
+            )
+            if region_callback is not None:
+                region_callback(region_name, region_results[region_name])
+    
+    return {region_name: region_results[region_name]
+            for region_name in regions.keys()}
+
+def _run_region_tasks(executor: Executor, tasks: List[Tuple],
+                      progress_callback: Optional[Callable],
+                      region_callback: Optional[Callable],
+                      cancel_event: Optional[threading.Event]) -> Dict:
+    """
+    Run region tasks on an executor, reporting regions as they finish
+    
+    Callbacks and the cancel event stay in this process; workers only
+    receive the picklable task tuples.
+    """
+    futures = {executor.submit(_simulate_region_task, task): task
+               for task in tasks}
+    pending = set(futures)
+    region_results = {}
+    
+    try:
+        while pending:
+            if cancel_event is not None and cancel_event.is_set():
+                raise SimulationCancelled("Simulation cancelled")
+            done, pending = wait(pending, timeout=_CANCEL_POLL_INTERVAL,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                region_name, _, _, simulations = futures[future][:4]
+                region_results[region_name] = future.result()
+                if progress_callback is not None:
+                    progress_callback(region_name, simulations, simulations)
+                if region_callback is not None:
+                    region_callback(region_name, region_results[region_name])
+    finally:
+        for future in pending:
+            future.cancel()
+    
+    return region_results
+
+@instrumented()
+def simulate_ensemble(days: int = 30,
+                      simulations: int = 1000,
+                      seed: Union[int, np.random.SeedSequence, None] = None,
+                      regions: Optional[Dict] = None,
+                      keep_sequences: bool = True,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict:
+    """
+    Simulate all regions together through a RegionEnsemble
     
-    for region_name, region_data in US_REGIONS.items():
-        print(f"Simulating {region_name}...")
+    Same result format as simulate_multiple_regions, but every chunk of
+    paths is simulated for all regions in one vectorized step loop and the
+    statistics are reduced across regions at once, so the cost per
+    additional region is a few rows in each batched array. All regions
+    draw from one random stream, so paths differ from (but are
+    distributed as) those of simulate_multiple_regions with the same seed.
+    Regions must be dense first-order chains over the same states.
+    """
+    if regions is None:
+        from us_regions import US_REGIONS
+        regions = US_REGIONS
+    
+    rng = np.random.default_rng(seed)
+    ensemble = RegionEnsemble.from_regions(regions)
+    n_regions, size = len(ensemble), len(ensemble.states)
+    
+    sequences = None
+    rainy_counts = None
+    if keep_sequences:
+        sequences = np.empty((n_regions, simulations, days),
+                             dtype=ensemble.code_dtype)
+        rainy_counts = np.empty((n_regions, simulations), dtype=np.int64)
+    
+    # Region r's state s is counted under the flat code r * S + s
+    offsets = (np.arange(n_regions) * size)[:, None, None]
+    state_counts = np.zeros(n_regions * size, dtype=np.int64)
+    rainy_day_histogram = np.zeros(n_regions * (days + 1), dtype=np.int64)
+    run_lengths = np.zeros((n_regions * size, days + 1), dtype=np.int64)
+    daily_rainy_counts = np.zeros((n_regions, days), dtype=np.int64)
+    is_rain = ensemble.rain_mask.astype(bool)
+    chunk_size = max(1, chunk_size)
+    
+    for start in range(0, simulations, chunk_size):
+        stop = min(start + chunk_size, simulations)
+        chunk = ensemble.simulate_batch(stop - start, days, rng=rng,
+                                        dtype=ensemble.code_dtype)
+        flat = chunk + offsets
         
-        # Create model
-        model = MarkovWeatherModel(
-            transition_matrix=region_data["transition_matrix"],
+        state_counts += np.bincount(flat.ravel(),
+                                    minlength=n_regions * size)
+        chunk_rain = is_rain[chunk]
+        rainy = np.count_nonzero(chunk_rain, axis=2)
+        daily_rainy_counts += np.count_nonzero(chunk_rain, axis=1)
+        rainy_day_histogram += np.bincount(
+            (rainy + (np.arange(n_regions) * (days + 1))[:, None]).ravel(),
+            minlength=n_regions * (days + 1)
+        )
+        run_lengths += state_run_lengths(flat.reshape(-1, days),
+                                         n_regions * size)
+        if keep_sequences:
+            sequences[:, start:stop] = chunk
+            rainy_counts[:, start:stop] = rainy
+    
+    state_counts = state_counts.reshape(n_regions, size)
+    rainy_day_histogram = rainy_day_histogram.reshape(n_regions, days + 1)
+    run_lengths = run_lengths.reshape(n_regions, size, days + 1)
+    stationary = ensemble.stationary_distribution()
+    total_states = days * simulations
+    rainy_totals = state_counts[:, ensemble.rain_codes].sum(axis=1)
+    
+    results = {}
+    for r, region_name in enumerate(ensemble.regions):
+        results[region_name] = {
+            "model": ensemble.region_model(r),
+            "sequences": None if sequences is None else sequences[r],
+            "state_labels": list(ensemble.states),
+            "rainy_counts": None if rainy_counts is None else rainy_counts[r],
+            "stationary": stationary[r],
+            "empirical_dist": state_counts[r] / total_states,
+            "avg_rainy_days": rainy_totals[r] / simulations,
+            "rainy_percentage": rainy_totals[r] / total_states,
+            "rainy_day_histogram": rainy_day_histogram[r],
+            "run_lengths": run_lengths[r],
+            "daily_rainy_counts": daily_rainy_counts[r]
+        }
+    
+    return results
+
+def regions_fingerprint(regions: Dict) -> str:
+    """
+    Stable hash of region names, transition matrices and initial
+    distributions, for use in cache keys
+    """
+    digest = hashlib.sha256()
+    for region_name, region_data in regions.items():
+        digest.update(region_name.encode())
+        matrix = region_data["transition_matrix"]
+        if sparse.issparse(matrix):
+            matrix = sparse.csr_matrix(matrix)
+            for part in (matrix.indptr, matrix.indices, matrix.data):
+                digest.update(np.asarray(part).tobytes())
+        else:
+            digest.update(np.asarray(matrix, dtype=float).tobytes())
+        digest.update(np.asarray(region_data["initial_dist"],
+                                 dtype=float).tobytes())
+        for key in ("state_labels", "rain_states", "order"):
+            digest.update(repr(region_data.get(key)).encode())
+    
+    return digest.hexdigest()
+
+def _simulate_region_task(task: Tuple) -> Dict:
+    """Unpack a task tuple; module level so process pools can pickle it"""
+    return simulate_region(*task[:-1], **task[-1])
+
+def build_region_model(region_name: str, region_data: Dict) -> MarkovWeatherModel:
+    """
+    Model for one region definition
+    
+    Besides "transition_matrix" (dense or scipy.sparse) and
+    "initial_dist", region data may give "state_labels" and "rain_states"
+    for state spaces other than Sunny/Rainy/Cloudy. With "order" k > 1,
+    "transition_matrix" is the (S^k, S) table of a k-th order chain and a
+    HigherOrderMarkovWeatherModel is returned.
+    """
+    order = region_data.get("order", 1)
+    if order > 1:
+        return HigherOrderMarkovWeatherModel(
+            transition_table=region_data["transition_matrix"],
             initial_dist=region_data["initial_dist"],
-            region_name=region_name
+            order=order,
+            region_name=region_name,
+            states=region_data.get("state_labels"),
+            rain_states=region_data.get("rain_states")
+        )
+    
+    return MarkovWeatherModel(
+        transition_matrix=region_data["transition_matrix"],
+        initial_dist=region_data["initial_dist"],
+        region_name=region_name,
+        states=region_data.get("state_labels"),
+        rain_states=region_data.get("rain_states")
+    )
+
+@instrumented()
+def simulate_region(region_name: str, region_data: Dict,
+                    days: int, simulations: int,
+                    seed: Union[int, np.random.SeedSequence, None] = None,
+                    keep_sequences: bool = True,
+                    chunk_size: int = DEFAULT_CHUNK_SIZE,
+                    sequences_out: Optional[np.ndarray] = None,
+                    progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                    cancel_event: Optional[threading.Event] = None,
+                    extensible: bool = False,
+                    tolerance: Optional[float] = None,
+                    target: str = "rainy_days",
+                    confidence: float = 0.95,
+                    variance_reduction: Tuple[str, ...] = ()) -> Dict:
+    """
+    Simulate one region and collect its summary statistics
+    
+    Paths are simulated in chunks of at most chunk_size and folded into a
+    SimulationAccumulator. With keep_sequences=False nothing beyond the
+    current chunk is kept, so peak memory does not grow with simulations.
+    The RNG stream is consumed identically for any chunk size.
+    
+    sequences_out, if given, is a preallocated (simulations, days) uint8
+    array (e.g. a memory-mapped file) that receives the paths chunk by
+    chunk instead of a new in-memory array.
+    
+    progress_callback(region_name, paths_done, simulations) is called
+    after every chunk; cancel_event is checked before every chunk and
+    raises SimulationCancelled once set.
+    
+    With extensible=True the result also holds an "extension" entry (the
+    generator, seed sequence and an accumulator with per-path tails) that
+    extend_region uses to add paths or days without starting over.
+    
+    With a tolerance, simulations is an upper bound: chunks are simulated
+    until the confidence-interval half-width of the target ("rainy_days":
+    mean rainy days per path, in days; "state_frequencies": every state's
+    share of days) is at most tolerance. variance_reduction may name any
+    of VARIANCE_REDUCTION_METHODS (see PrecisionEstimator); antithetic
+    runs use an even number of paths per chunk. Whenever either option
+    is given the result holds a "precision" entry with the estimates and
+    their half-widths. The first chunk is also the pilot sample for the
+    variance estimate, so chunk_size should not be tiny.
+    """
+    if target not in _PRECISION_TARGETS:
+        raise ValueError(f"Unknown precision target: {target}")
+    if tolerance is not None and tolerance <= 0:
+        raise ValueError(f"tolerance must be positive, got {tolerance}")
+    
+    logger.debug("Simulating %s", region_name)
+    
+    seed_seq = (seed if isinstance(seed, np.random.SeedSequence)
+                else np.random.SeedSequence(seed))
+    rng = np.random.default_rng(seed_seq)
+    
+    model = build_region_model(region_name, region_data)
+    chunk_size = max(1, chunk_size)
+    
+    estimator = None
+    if tolerance is not None or variance_reduction:
+        estimator = PrecisionEstimator(model, days, variance_reduction,
+                                       confidence)
+        if estimator.antithetic:
+            # Antithetic pairs never straddle two chunks
+            chunk_size += chunk_size % 2
+            simulations += simulations % 2
+    
+    # Paths are stored as a (simulations, days) code matrix (uint8 for
+    # up to 256 states); code i stands for model.states[i]
+    sequences = sequences_out
+    rainy_counts = None
+    if sequences is None and keep_sequences:
+        sequences = np.empty((simulations, days), dtype=model.code_dtype)
+    if sequences is not None:
+        rainy_counts = np.empty(simulations, dtype=np.int64)
+    
+    accumulator = SimulationAccumulator(
+        len(model.states), days, model.rain_codes,
+        tail_days=getattr(model, "order", 1) if extensible else 0
+    )
+    converged = False
+    
+    for start in range(0, simulations, chunk_size):
+        if cancel_event is not None and cancel_event.is_set():
+            raise SimulationCancelled(f"Simulation of {region_name} cancelled")
+        stop = min(start + chunk_size, simulations)
+        if estimator is None:
+            chunk = model.simulate_batch(stop - start, days, rng=rng,
+                                         dtype=model.code_dtype)
+        else:
+            chunk = model.simulate_batch(
+                stop - start, days, dtype=model.code_dtype,
+                uniforms=estimator.draw_uniforms(stop - start, days, rng)
+            )
+            estimator.update(chunk)
+        accumulator.update(chunk)
+        if sequences is not None:
+            sequences[start:stop] = chunk
+            rainy_counts[start:stop] = np.count_nonzero(
+                np.isin(chunk, model.rain_codes), axis=1
+            )
+        if tolerance is not None:
+            converged = estimator.converged(tolerance, target)
+        if progress_callback is not None:
+            progress_callback(region_name, stop,
+                              stop if converged else simulations)
+        if converged:
+            break
+    
+    if accumulator.n_paths < simulations and sequences is not None:
+        sequences = sequences[:accumulator.n_paths]
+        rainy_counts = rainy_counts[:accumulator.n_paths]
+    
+    region_results = {
+        "model": model,
+        "sequences": sequences,
+        "state_labels": list(model.states),
+        "rainy_counts": rainy_counts,
+        "stationary": model.stationary_distribution()
+    }
+    region_results.update(accumulator.summary())
+    if estimator is not None:
+        precision = estimator.summary()
+        precision.update(tolerance=tolerance, target=target,
+                         converged=converged)
+        region_results["precision"] = precision
+    if extensible:
+        region_results["extension"] = {
+            "rng": rng,
+            "seed": seed_seq,
+            "accumulator": accumulator
+        }
+    
+    return region_results
+
+@instrumented()
+def extend_region(region_results: Dict,
+                  days: Optional[int] = None,
+                  simulations: Optional[int] = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE,
+                  progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                  cancel_event: Optional[threading.Event] = None) -> Dict:
+    """
+    Grow an extensible simulate_region result to more days and/or paths
+    
+    Existing paths are continued from their last states for the extra
+    days, using a stream spawned from the region's seed sequence; new
+    paths then come from the region's original generator. Only the delta
+    is simulated and the summary statistics are updated by folding it
+    into a copy of the stored accumulator. Adding paths to a run whose
+    days were never extended gives exactly the paths of a fresh run with
+    the larger count. region_results itself is left unchanged.
+    
+    progress_callback and cancel_event work as in simulate_region;
+    progress counts the new paths simulated (plus old paths continued).
+    """
+    if "extension" not in region_results:
+        raise ValueError("Result was not simulated with extensible=True")
+    
+    extension = copy.deepcopy(region_results["extension"])
+    accumulator = extension["accumulator"]
+    rng = extension["rng"]
+    model = region_results["model"]
+    region_name = model.region
+    
+    old_days, old_simulations = accumulator.days, accumulator.n_paths
+    days = old_days if days is None else days
+    simulations = old_simulations if simulations is None else simulations
+    if days < old_days or simulations < old_simulations:
+        raise ValueError(
+            f"Can only extend {old_simulations} paths x {old_days} days, "
+            f"not shrink to {simulations} x {days}"
+        )
+    
+    old_sequences = region_results["sequences"]
+    sequences = None
+    if old_sequences is not None:
+        sequences = np.empty((simulations, days), dtype=model.code_dtype)
+        sequences[:old_simulations, :old_days] = old_sequences
+    
+    work = (old_simulations if days > old_days else 0) + simulations - old_simulations
+    done = 0
+    chunk_size = max(1, chunk_size)
+    
+    if days > old_days:
+        day_rng = np.random.default_rng(extension["seed"].spawn(1)[0])
+        accumulator.extend_days(days - old_days)
+        for start in range(0, old_simulations, chunk_size):
+            if cancel_event is not None and cancel_event.is_set():
+                raise SimulationCancelled(f"Extension of {region_name} cancelled")
+            stop = min(start + chunk_size, old_simulations)
+            continuation = model.continue_batch(
+                accumulator.tails[start:stop], days - old_days,
+                rng=day_rng, dtype=model.code_dtype
+            )
+            accumulator.update_continuation(start, continuation)
+            if sequences is not None:
+                sequences[start:stop, old_days:] = continuation
+            done += stop - start
+            if progress_callback is not None:
+                progress_callback(region_name, done, work)
+    
+    for start in range(old_simulations, simulations, chunk_size):
+        if cancel_event is not None and cancel_event.is_set():
+            raise SimulationCancelled(f"Extension of {region_name} cancelled")
+        stop = min(start + chunk_size, simulations)
+        chunk = model.simulate_batch(stop - start, days, rng=rng,
+                                     dtype=model.code_dtype)
+        accumulator.update(chunk)
+        if sequences is not None:
+            sequences[start:stop] = chunk
+        done += stop - start
+        if progress_callback is not None:
+            progress_callback(region_name, done, work)
+    
+    extended = dict(region_results)
+    # Precision estimates described the paths before the extension
+    extended.pop("precision", None)
+    extended.update(accumulator.summary())
+    extended["sequences"] = sequences
+    extended["rainy_counts"] = (None if sequences is None
+                                else accumulator.path_rainy.copy())
+    extended["extension"] = extension
+    
+    return extended
+
+@instrumented()
+def extend_multiple_regions(models_dict: Dict,
+                            days: Optional[int] = None,
+                            simulations: Optional[int] = None,
+                            chunk_size: int = DEFAULT_CHUNK_SIZE,
+                            progress_callback: Optional[Callable[[str, int, int], None]] = None,
+                            region_callback: Optional[Callable[[str, Dict], None]] = None,
+                            cancel_event: Optional[threading.Event] = None) -> Dict:
+    """
+    Extend every region of an extensible simulate_multiple_regions result
+    
+    See extend_region; callbacks and cancel_event behave as in
+    simulate_multiple_regions.
+    """
+    extended = {}
+    for region_name, region_results in models_dict.items():
+        extended[region_name] = extend_region(
+            region_results, days, simulations, chunk_size,
+            progress_callback=progress_callback, cancel_event=cancel_event
+        )
+        if region_callback is not None:
+            region_callback(region_name, extended[region_name])
+    
+    return extended
+
+class SimulationAccumulator:
+    """
+    Running statistics over chunks of simulated paths
+    
+    Tracks state counts, a histogram of rainy days per path, the number of
+    rainy paths on each day and run-length tallies per state. All arrays
+    are sized by days and number of states, never by the number of paths.
+    
+    With tail_days > 0 the accumulator also keeps a few numbers per path
+    (its last tail_days states, rainy-day count and the length of its
+    final run) so that paths can later be continued for more days with
+    extend_days / update_continuation.
+    """
+    
+    def __init__(self, n_states: int, days: int, rain_codes: np.ndarray,
+                 tail_days: int = 0):
+        self.n_states = n_states
+        self.days = days
+        self.rain_codes = np.asarray(rain_codes)
+        self._is_rain = np.zeros(n_states, dtype=bool)
+        self._is_rain[self.rain_codes] = True
+        self.n_paths = 0
+        self.state_counts = np.zeros(n_states, dtype=np.int64)
+        # rainy_day_histogram[k] = number of paths with k rainy days
+        self.rainy_day_histogram = np.zeros(days + 1, dtype=np.int64)
+        # daily_rainy[t] = number of paths that are rainy on day t
+        self.daily_rainy = np.zeros(days, dtype=np.int64)
+        # run_lengths[s, L] = number of maximal runs of state s lasting L days
+        self.run_lengths = np.zeros((n_states, days + 1), dtype=np.int64)
+        
+        self.tail_days = tail_days
+        if tail_days:
+            self.tails = np.empty((0, tail_days), dtype=np.intp)
+            self.path_rainy = np.empty(0, dtype=np.int64)
+            self.final_runs = np.empty(0, dtype=np.int64)
+    
+    def update(self, paths: np.ndarray):
+        """Fold a (paths x days) chunk of state codes into the totals"""
+        self.n_paths += len(paths)
+        self.state_counts += np.bincount(paths.ravel(),
+                                         minlength=self.n_states)
+        chunk_rain = self._is_rain[paths]
+        rainy = np.count_nonzero(chunk_rain, axis=1)
+        self.daily_rainy += np.count_nonzero(chunk_rain, axis=0)
+        self.rainy_day_histogram += np.bincount(rainy,
+                                                minlength=self.days + 1)
+        self.run_lengths += state_run_lengths(paths, self.n_states)
+        
+        if self.tail_days:
+            self.tails = np.vstack([self.tails, _path_tails(paths, self.tail_days)])
+            self.path_rainy = np.concatenate([self.path_rainy, rainy])
+            self.final_runs = np.concatenate([self.final_runs,
+                                              _edge_runs(paths, last=True)])
+    
+    def extend_days(self, extra_days: int):
+        """
+        Make room for extra_days more days on every path
+        
+        The existing paths must then be passed, in order, to
+        update_continuation.
+        """
+        if not self.tail_days:
+            raise ValueError("Accumulator does not keep per-path tails")
+        
+        self.days += extra_days
+        self.rainy_day_histogram = np.concatenate([
+            self.rainy_day_histogram, np.zeros(extra_days, dtype=np.int64)
+        ])
+        self.daily_rainy = np.concatenate([
+            self.daily_rainy, np.zeros(extra_days, dtype=np.int64)
+        ])
+        self.run_lengths = np.hstack([
+            self.run_lengths,
+            np.zeros((self.n_states, extra_days), dtype=np.int64)
+        ])
+    
+    def update_continuation(self, start: int, continuation: np.ndarray):
+        """
+        Fold the extra days of paths start, start + 1, ... into the totals
+        
+        A run that was open at the old last day and goes on into the
+        continuation is re-tallied as one longer run.
+        """
+        stop = start + len(continuation)
+        extra = continuation.shape[1]
+        size = self.days + 1
+        if extra == 0:
+            return
+        
+        self.state_counts += np.bincount(continuation.ravel(),
+                                         minlength=self.n_states)
+        
+        chunk_rain = self._is_rain[continuation]
+        rainy = np.count_nonzero(chunk_rain, axis=1)
+        self.daily_rainy[self.days - extra:] += np.count_nonzero(chunk_rain,
+                                                                 axis=0)
+        old_rainy = self.path_rainy[start:stop]
+        self.rainy_day_histogram -= np.bincount(old_rainy, minlength=size)
+        self.rainy_day_histogram += np.bincount(old_rainy + rainy,
+                                                minlength=size)
+        self.path_rainy[start:stop] = old_rainy + rainy
+        
+        tally = state_run_lengths(continuation, self.n_states)
+        self.run_lengths[:, :extra + 1] += tally
+        
+        # Join each old final run with the continuation's first run
+        last_states = self.tails[start:stop, -1]
+        first_runs = _edge_runs(continuation, last=False)
+        joined = continuation[:, 0] == last_states
+        states = last_states[joined]
+        old_lengths = self.final_runs[start:stop][joined]
+        new_lengths = first_runs[joined]
+        np.subtract.at(self.run_lengths, (states, old_lengths), 1)
+        np.subtract.at(self.run_lengths, (states, new_lengths), 1)
+        np.add.at(self.run_lengths, (states, old_lengths + new_lengths), 1)
+        
+        final_runs = _edge_runs(continuation, last=True)
+        whole = joined & (final_runs == extra)
+        final_runs[whole] += self.final_runs[start:stop][whole]
+        self.final_runs[start:stop] = final_runs
+        
+        self.tails[start:stop] = _path_tails(
+            np.hstack([self.tails[start:stop], continuation]), self.tail_days
         )
+    
+    def summary(self) -> Dict:
+        """Statistics in the simulate_multiple_regions result format"""
+        total_states = self.days * self.n_paths
+        rainy_days_total = self.state_counts[self.rain_codes].sum()
         
-        # Collect statistics
-        region_results = {
-            "model": model,
-            "sequences": [],
-            "rainy_counts": [],
-            "stationary": model.stationary_distribution(),
-            "empirical_dist": np.zeros(len(WEATHER_STATES))
+        return {
+            "empirical_dist": self.state_counts / total_states,
+            "avg_rainy_days": rainy_days_total / self.n_paths,
+            "rainy_percentage": rainy_days_total / total_states,
+            "rainy_day_histogram": self.rainy_day_histogram.copy(),
+            "run_lengths": self.run_lengths.copy(),
+            "daily_rainy_counts": self.daily_rainy.copy()
         }
+
+class PrecisionEstimator:
+    """
+    Running confidence intervals for mean rainy days and state frequencies
+    
+    Draws the uniforms for each chunk of paths and keeps, per estimated
+    quantity, the sums needed for its mean and variance, so memory does
+    not grow with the number of paths. Variance reduction methods:
+    
+    - "antithetic": the second half of each chunk reuses the first half's
+      uniforms as 1 - u; every pair counts as one observation. This only
+      pays off when the quantity is monotone in the uniforms, i.e. rain
+      states come first or last in the state order; with Rainy between
+      Sunny and Cloudy it can widen the interval instead
+    - "stratified": every chunk is split into _LHS_REPLICATES independent
+      Latin hypercubes, one stratum per path for the start and for every
+      day's step
+    - "control_variate": the one-step predictions sum_t P[s_t] of each
+      path, whose expectation is known exactly from the initial
+      distribution, serve as controls with the optimal coefficient
+      estimated from the paths (first-order models only)
+    
+    Paths within a Latin hypercube are not independent, so intervals use
+    batch means: each replicate's sums are one observation (each path, or
+    antithetic pair, is its own replicate otherwise) and the half-width
+    comes from the spread of replicate means with a t critical value.
+    """
+    
+    def __init__(self, model: MarkovWeatherModel, days: int,
+                 variance_reduction: Tuple[str, ...] = (),
+                 confidence: float = 0.95):
+        unknown = set(variance_reduction) - set(VARIANCE_REDUCTION_METHODS)
+        if unknown:
+            raise ValueError(f"Unknown variance reduction: {sorted(unknown)}")
+        if not 0 < confidence < 1:
+            raise ValueError(f"confidence must be between 0 and 1, got {confidence}")
         
-        # Run simulations
-        rainy_days_total = 0
-        state_counts = {state: 0 for state in WEATHER_STATES}
+        self.model = model
+        self.days = days
+        self.variance_reduction = tuple(variance_reduction)
+        self.antithetic = "antithetic" in variance_reduction
+        self.stratified = "stratified" in variance_reduction
+        self.control_variate = "control_variate" in variance_reduction
+        self.confidence = confidence
+        self.n_paths = 0
         
-        for _ in range(simulations):
-            seq = model.simulate_sequence(days)
-            region_results["sequences"].append(seq)
-            
-            # Count rainy days
-            rainy_days = seq.count("Rainy")
-            region_results["rainy_counts"].append(rainy_days)
-            rainy_days_total += rainy_days
+        self.n_states = len(model.states)
+        self._rain_mask = np.asarray(model.rain_mask, dtype=float)
+        if self.control_variate:
+            if getattr(model, "order", 1) > 1:
+                raise ValueError("Control variates need a first-order model")
+            # Expected visits to each state over the horizon
+            expected = model.distribution_over_horizons(None, range(days)).sum(axis=0)
+            self._control_mean = self._columns(expected[None, :])[0]
+        
+        # Column 0 is rainy days per path, columns 1.. state frequencies.
+        # Sums run over replicates r with m_r observations and sums Y_r, Z_r
+        # of values and controls: "y" is sum Y_r, "yy" sum Y_r^2, "my" sum
+        # m_r Y_r, and so on
+        size = self.n_states + 1
+        self._count = 0
+        self._replicates = 0
+        self._count_squares = 0
+        self._sums = {key: np.zeros(size)
+                      for key in ("y", "yy", "my", "z", "zz", "mz", "yz")}
+    
+    def draw_uniforms(self, n_paths: int, days: int,
+                      rng: np.random.Generator) -> np.ndarray:
+        """(n_paths, days) uniforms for the next chunk"""
+        base = n_paths // 2 if self.antithetic else n_paths
+        if self.stratified:
+            uniforms = np.vstack([
+                (rng.permuted(np.tile(np.arange(size), (days, 1)), axis=1).T
+                 + rng.random((size, days))) / size
+                for size in self._replicate_sizes(base)
+            ])
+        else:
+            uniforms = rng.random((base, days))
+        
+        if self.antithetic:
+            uniforms = np.vstack([uniforms, 1.0 - uniforms])
+        return np.minimum(uniforms, _BELOW_ONE)
+    
+    def update(self, paths: np.ndarray):
+        """Fold a chunk of paths drawn with draw_uniforms into the sums"""
+        n_paths = len(paths)
+        self.n_paths += n_paths
+        if paths.size == 0:
+            return
+        half = n_paths // 2 if self.antithetic else n_paths
+        block = max(1, _PRECISION_BLOCK_ENTRIES // self.n_states)
+        sizes = self._replicate_sizes(half)
+        if self.stratified:
+            replicate_ids = np.repeat(np.arange(len(sizes)), sizes)
+            replicate_y = np.zeros((len(sizes), self.n_states + 1))
+            replicate_z = np.zeros_like(replicate_y)
+        
+        for start in range(0, half, block):
+            rows = np.arange(start, min(start + block, half))
+            values, controls = self._path_values(paths[rows])
+            if self.antithetic:
+                pair_values, pair_controls = self._path_values(paths[rows + half])
+                values = (values + pair_values) / 2
+                controls = (controls + pair_controls) / 2
             
-            # Count all states
-            for state in seq:
-                state_counts[state] += 1
+            if not self.stratified:
+                self._fold(values, controls, np.ones(len(values)))
+                continue
+            # Blocks may split a replicate, so collect its sums first
+            ids = replicate_ids[rows]
+            firsts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+            replicate_y[ids[firsts]] += np.add.reduceat(values, firsts, axis=0)
+            replicate_z[ids[firsts]] += np.add.reduceat(controls, firsts, axis=0)
+        
+        if self.stratified and half > 0:
+            self._fold(replicate_y, replicate_z, sizes.astype(float))
+    
+    def _replicate_sizes(self, n_paths: int) -> np.ndarray:
+        """Paths (or antithetic pairs) in each replicate of a chunk"""
+        if not self.stratified:
+            return np.ones(n_paths, dtype=np.intp)
+        return np.array([len(part) for part in np.array_split(
+            np.arange(n_paths), min(_LHS_REPLICATES, n_paths)
+        ) if len(part)], dtype=np.intp)
+    
+    def _fold(self, values: np.ndarray, controls: np.ndarray,
+              counts: np.ndarray):
+        """Add replicate sums of values and controls to the running sums"""
+        self._count += counts.sum()
+        self._replicates += len(counts)
+        self._count_squares += (counts ** 2).sum()
+        weights = counts[:, None]
+        self._sums["y"] += values.sum(axis=0)
+        self._sums["yy"] += (values ** 2).sum(axis=0)
+        self._sums["my"] += (weights * values).sum(axis=0)
+        self._sums["z"] += controls.sum(axis=0)
+        self._sums["zz"] += (controls ** 2).sum(axis=0)
+        self._sums["mz"] += (weights * controls).sum(axis=0)
+        self._sums["yz"] += (values * controls).sum(axis=0)
+    
+    def _path_values(self, paths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Estimated quantities and their controls for every path"""
+        n_paths = len(paths)
+        codes = (np.arange(n_paths)[:, None] * self.n_states
+                 + paths.astype(np.intp))
+        visits = np.bincount(codes[:, :-1].ravel(),
+                             minlength=n_paths * self.n_states)
+        visits = visits.reshape(n_paths, self.n_states).astype(float)
+        controls = None
+        if self.control_variate:
+            # Start distribution plus one-step predictions from days 0..n-2
+            controls = self.model.initial + np.asarray(self.model.P.T @ visits.T).T
+        visits[np.arange(n_paths), paths[:, -1]] += 1
         
-        # Calculate empirical distribution
-        total_states = days * simulations
-        for i, state in enumerate(WEATHER_STATES):
-            region_results["empirical_dist"][i] = state_counts[state] / total_states
+        values = self._columns(visits)
+        return values, (values if controls is None else self._columns(controls))
+    
+    def _columns(self, visits: np.ndarray) -> np.ndarray:
+        """Rainy days and state frequencies from per-path visit counts"""
+        return np.hstack([visits @ self._rain_mask[:, None],
+                          visits / self.days])
+    
+    def estimates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Current estimates and confidence-interval half-widths
         
-        # Average rainy days
-        region_results["avg_rainy_days"] = rainy_days_total / simulations
-        region_results["rainy_percentage"] = rainy_days_total / (days * simulations)
+        Returns:
+        --------
+        Tuple[np.ndarray, np.ndarray]
+            Arrays of length n_states + 1: mean rainy days per path, then
+            the frequency of every state
+        """
+        n = self._count
+        replicates = self._replicates
+        size = self.n_states + 1
+        if replicates < 2:
+            return np.full(size, np.nan), np.full(size, np.inf)
         
-        results[region_name] = region_results
+        # Ratio-estimator variance over replicates: residuals
+        # Y_r - m_r * mean, which reduces to s^2 / n for single paths
+        sums = self._sums
+        mm = self._count_squares
+        mean_y = sums["y"] / n
+        ss_y = sums["yy"] - 2 * mean_y * sums["my"] + mean_y ** 2 * mm
+        estimate = mean_y
+        if self.control_variate:
+            mean_z = sums["z"] / n
+            ss_z = sums["zz"] - 2 * mean_z * sums["mz"] + mean_z ** 2 * mm
+            ss_yz = (sums["yz"] - mean_y * sums["mz"] - mean_z * sums["my"]
+                     + mean_y * mean_z * mm)
+            beta = np.divide(ss_yz, ss_z, out=np.zeros(size), where=ss_z > 0)
+            estimate = mean_y - beta * (mean_z - self._control_mean)
+            ss_y = ss_y - beta * ss_yz
+        
+        variance = (replicates / (replicates - 1)
+                    * np.maximum(ss_y, 0.0) / n ** 2)
+        critical = stats.t.ppf(0.5 + self.confidence / 2, replicates - 1)
+        half_width = critical * np.sqrt(variance)
+        return estimate, half_width
     
-    return results
+    def converged(self, tolerance: float, target: str = "rainy_days") -> bool:
+        """Whether the target's half-width is at most tolerance"""
+        _, half_width = self.estimates()
+        if target == "rainy_days":
+            return bool(half_width[0] <= tolerance)
+        return bool(np.max(half_width[1:]) <= tolerance)
+    
+    def summary(self) -> Dict:
+        """Estimates and half-widths in result-entry form"""
+        estimate, half_width = self.estimates()
+        return {
+            "simulations": self.n_paths,
+            "variance_reduction": list(self.variance_reduction),
+            "confidence": self.confidence,
+            "avg_rainy_days": estimate[0],
+            "avg_rainy_days_half_width": half_width[0],
+            "empirical_dist": estimate[1:],
+            "empirical_dist_half_width": half_width[1:]
+        }
+
+def _path_tails(paths: np.ndarray, tail_days: int) -> np.ndarray:
+    """
+    Last tail_days codes of every path, oldest first
+    
+    Paths shorter than tail_days are padded with their first day, as
+    higher-order models embed a starting state.
+    """
+    paths = np.asarray(paths, dtype=np.intp)
+    if paths.shape[1] < tail_days:
+        padding = np.repeat(paths[:, :1], tail_days - paths.shape[1], axis=1)
+        paths = np.hstack([padding, paths])
+    return paths[:, paths.shape[1] - tail_days:]
 
+def _edge_runs(paths: np.ndarray, last: bool) -> np.ndarray:
+    """Length of the first (or last) run of every path"""
+    n_paths, days = paths.shape
+    if days < 2:
+        return np.full(n_paths, days, dtype=np.int64)
+    
+    changes = paths[:, 1:] != paths[:, :-1]
+    if last:
+        changes = changes[:, ::-1]
+    
+    return np.where(changes.any(axis=1), changes.argmax(axis=1) + 1,
+                    days).astype(np.int64)
+
+def state_run_lengths(paths: np.ndarray, n_states: int) -> np.ndarray:
+    """
+    Tally maximal runs of every state in a path matrix
+    
+    Run boundaries are found with one vectorized comparison of adjacent
+    days; runs never cross from one path (row) into the next.
+    
+    Returns:
+    --------
+    np.ndarray
+        Array of shape (n_states, days + 1) where entry [s, L] counts the
+        runs of state s lasting exactly L days
+    """
+    n_paths, days = paths.shape
+    if n_paths == 0 or days == 0:
+        return np.zeros((n_states, days + 1), dtype=np.int64)
+    
+    changes = paths[:, 1:] != paths[:, :-1]
+    edge = np.ones((n_paths, 1), dtype=bool)
+    run_starts = np.flatnonzero(np.hstack([edge, changes]))
+    run_ends = np.flatnonzero(np.hstack([changes, edge]))
+    
+    lengths = run_ends - run_starts + 1
+    run_states = paths.ravel()[run_starts].astype(np.intp)
+    
+    tally = np.bincount(run_states * (days + 1) + lengths,
+                        minlength=n_states * (days + 1))
+    return tally.reshape(n_states, days + 1)
+
+def daily_rain_counts(paths: np.ndarray, rain_codes: np.ndarray,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> np.ndarray:
+    """
+    Number of rainy paths on each day of a (paths x days) code matrix
+    
+    One column reduction per block of chunk_size paths, so memory-mapped
+    path matrices are read block by block.
+    """
+    n_paths, days = paths.shape
+    counts = np.zeros(days, dtype=np.int64)
+    for start in range(0, n_paths, chunk_size):
+        chunk = np.asarray(paths[start:start + chunk_size])
+        counts += np.count_nonzero(np.isin(chunk, rain_codes), axis=0)
+    
+    return counts
+
+def wilson_interval(successes: np.ndarray, trials: int,
+                    confidence: float = 0.95) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Wilson score confidence interval for binomial proportions
+    
+    Unlike the normal approximation it stays inside [0, 1] and keeps a
+    nonzero width when no (or every) trial succeeds.
+    
+    Parameters:
+    -----------
+    successes : np.ndarray
+        Success counts
+    trials : int
+        Number of trials behind every count
+    confidence : float
+        Two-sided confidence level, between 0 and 1
+    
+    Returns:
+    --------
+    Tuple[np.ndarray, np.ndarray]
+        Lower and upper bounds, shaped like successes
+    """
+    if not 0 < confidence < 1:
+        raise ValueError(f"confidence must be between 0 and 1, got {confidence}")
+    
+    successes = np.asarray(successes, dtype=float)
+    if trials <= 0:
+        return np.zeros_like(successes), np.ones_like(successes)
+    
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    z2n = z * z / trials
+    p_hat = successes / trials
+    center = (p_hat + z2n / 2) / (1 + z2n)
+    half = z / (1 + z2n) * np.sqrt(p_hat * (1 - p_hat) / trials
+                                   + z2n / (4 * trials))
+    
+    return np.clip(center - half, 0.0, 1.0), np.clip(center + half, 0.0, 1.0)
+
+@instrumented()
 def forecast_probability_rain(models_dict: Dict, 
-                             days_ahead: List[int] = [1, 3, 7, 14, 30]) -> Dict:
+                             days_ahead: List[int] = [1, 3, 7, 14, 30],
+                             confidence: float = 0.95) -> Dict:
     """
     Calculate probability of rain for various days ahead
+    
+    Day 0 of every simulated path is drawn from the initial distribution,
+    so the empirical probability n days ahead is the share of paths that
+    are rainy on day n. It is read from the per-day rainy counts of the
+    results (or one column reduction over the stored paths); horizons
+    beyond the simulated days get NaN. Theoretical probabilities for all
+    horizons come from one propagation of the initial distribution.
+    
+    Parameters:
+    -----------
+    models_dict : Dict
+        simulate_multiple_regions results
+    days_ahead : List[int]
+        Horizons in days, in any order (e.g. range(1, 366) for a
+        daily curve)
+    confidence : float
+        Level of the Wilson intervals around the empirical values
+    
+    Returns:
+    --------
+    Dict
+        forecasts[region][n] with "theoretical", "empirical", "ci_low",
+        "ci_high" and "n_paths"
     """
+    days_ahead = [int(n) for n in days_ahead]
     forecasts = {}
     
     for region_name, results in models_dict.items():
         model = results["model"]
         forecasts[region_name] = {}
         
-        for n in days_ahead:
-            # Theoretical probability
-            theoretical = model.probability_rain_in_n_days(n)
-            
-            # Empirical from simulations
-            empirical = results["rainy_percentage"]  # Simplified
-            
+        # Theoretical probabilities for every horizon in one call
+        dists = model.distribution_over_horizons(None, days_ahead)
+        rain_probs = dists @ model.rain_mask
+        
+        daily, n_paths = _daily_rain_counts(results)
+        horizons = np.asarray(days_ahead, dtype=np.int64)
+        simulated = (horizons >= 0) & (horizons < len(daily))
+        successes = np.zeros(len(horizons), dtype=np.int64)
+        successes[simulated] = daily[horizons[simulated]]
+        
+        empirical = np.full(len(horizons), np.nan)
+        ci_low = np.full(len(horizons), np.nan)
+        ci_high = np.full(len(horizons), np.nan)
+        if n_paths:
+            empirical[simulated] = successes[simulated] / n_paths
+            low, high = wilson_interval(successes[simulated], n_paths,
+                                        confidence)
+            ci_low[simulated] = low
+            ci_high[simulated] = high
+        
+        for k, n in enumerate(days_ahead):
             forecasts[region_name][n] = {
-                "theoretical": theoretical,
-                "empirical": empirical
+                "theoretical": rain_probs[k],
+                "empirical": empirical[k],
+                "ci_low": ci_low[k],
+                "ci_high": ci_high[k],
+                "n_paths": n_paths
             }
     
-    return forecasts
\ No newline at end of file
+    return forecasts
+
+def _daily_rain_counts(results: Dict) -> Tuple[np.ndarray, int]:
+    """Per-day rainy path counts and number of paths of one region"""
+    daily = results.get("daily_rainy_counts")
+    sequences = results.get("sequences")
+    if daily is None and sequences is not None:
+        daily = daily_rain_counts(sequences, results["model"].rain_codes)
+    if daily is None:
+        return np.zeros(0, dtype=np.int64), 0
+    
+    histogram = results.get("rainy_day_histogram")
+    n_paths = (int(np.sum(histogram)) if histogram is not None
+               else len(sequences))
+    return np.asarray(daily), n_paths
@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+import batch
+
+
+def _write_scenarios(tmp_path, scenarios):
+    path = tmp_path / "scenarios.json"
+    path.write_text(json.dumps({"scenarios": scenarios}))
+    return str(path)
+
+
+def test_scenario_names_with_the_same_slug_are_rejected(tmp_path):
+    path = _write_scenarios(tmp_path, [
+        {"name": "Wet Summer", "simulations": 10},
+        {"name": "wet-summer", "simulations": 10},
+    ])
+    with pytest.raises(ValueError, match="share an output directory"):
+        batch.load_scenarios(path)
+
+
+def test_run_batch_rejects_colliding_scenarios(tmp_path):
+    path = _write_scenarios(tmp_path, [{"name": "Base", "simulations": 10}])
+    scenario = batch.load_scenarios(path)[0]
+    twin = dict(scenario, name="base!")
+    with pytest.raises(ValueError, match="share an output directory"):
+        batch.run_batch([scenario, twin], str(tmp_path / "out"))
+    assert not (tmp_path / "out").exists()
+
+
+def test_region_names_with_the_same_slug_are_rejected(tmp_path):
+    region = {
+        "transition_matrix": [[0.6, 0.4], [0.3, 0.7]],
+        "initial_dist": [0.5, 0.5],
+        "state_labels": ["Dry", "Wet"],
+        "rain_states": ["Wet"],
+    }
+    path = _write_scenarios(tmp_path, [{
+        "name": "custom",
+        "regions": {"Gulf Coast": region, "gulf_coast": region},
+    }])
+    with pytest.raises(ValueError, match="share an output key"):
+        batch.load_scenarios(path)
@@ -0,0 +1,28 @@
+import time
+
+import numpy as np
+
+from weather_model import HigherOrderMarkovWeatherModel
+
+
+def test_stationary_distribution_of_large_lifted_chain():
+    """Order 7 over 5 states (78125 histories) solves without an LU"""
+    n_states, order = 5, 7
+    rng = np.random.default_rng(0)
+    table = rng.dirichlet(np.ones(n_states), size=n_states ** order)
+    states = [f"S{i}" for i in range(n_states)]
+    model = HigherOrderMarkovWeatherModel(
+        table, np.full(n_states, 1.0 / n_states), order,
+        states=states, rain_states=states[:1]
+    )
+
+    start = time.perf_counter()
+    pi = model.stationary_distribution()
+    elapsed = time.perf_counter() - start
+
+    lifted_pi = model.lifted.stationary_distribution()
+    assert elapsed < 10.0
+    assert np.all(lifted_pi >= 0)
+    assert np.isclose(lifted_pi.sum(), 1.0)
+    assert np.allclose(lifted_pi @ model.lifted.P, lifted_pi, atol=1e-12)
+    assert np.isclose(pi.sum(), 1.0)
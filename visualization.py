@@ -1,42 +1,92 @@
+import hashlib
+import io
+import threading
 import matplotlib.pyplot as plt
 import numpy as np
-from typing import Dict, List
-import seaborn as sns
+import scipy.sparse as sparse
+from collections import OrderedDict
+from typing import Callable, Dict, List
+from instrumentation import instrumented
 
+# Rendered figures kept by render_* functions, keyed by content hash
+FIGURE_CACHE_SIZE = 64
+_figure_cache = OrderedDict()
+# Script runs and the app's background job render concurrently; the lock
+# covers cache bookkeeping only, figures are drawn outside it
+_figure_cache_lock = threading.Lock()
+
+# Largest matrix side drawn with tick labels and per-cell values
+_ANNOTATE_MAX_STATES = 12
+
+# Larger sparse matrices are drawn as their nonzero pattern
+_HEATMAP_MAX_STATES = 512
+
+@instrumented()
 def plot_transition_matrix(matrix: np.ndarray, 
                           region_name: str,
-                          states: List[str] = None):
+                          states: List[str] = None,
+                          style: str = "default"):
     """
     Visualize transition matrix as heatmap
-    """
-    if states is None:
-        states = ["Sunny", "Rainy", "Cloudy"]
     
+    states label both axes when they match the matrix size (the lifted
+    matrix of a higher-order model has one row per history, so its axes
+    stay unlabelled). Cell values are written out only for small
+    matrices, and large sparse matrices are drawn as a spy plot of their
+    nonzeros instead of being densified.
+    """
+    n_rows, n_cols = matrix.shape
     fig, ax = plt.subplots(figsize=(8, 6))
     
-    im = ax.imshow(matrix, cmap='Blues', vmin=0, vmax=1)
+    if sparse.issparse(matrix) and max(n_rows, n_cols) > _HEATMAP_MAX_STATES:
+        ax.spy(matrix, markersize=max(0.5, 200 / max(n_rows, n_cols)),
+               color='black' if style == "grayscale" else 'tab:blue')
+        ax.set_xlabel("To State")
+        ax.set_ylabel("From State")
+        ax.set_title(f"Transition Matrix - {region_name} (nonzero pattern)")
+        fig.tight_layout()
+        return fig
     
-    for i in range(len(states)):
-        for j in range(len(states)):
-            text = ax.text(j, i, f"{matrix[i, j]:.2f}",
-                          ha="center", va="center", 
-                          color="black" if matrix[i, j] < 0.7 else "white")
+    if sparse.issparse(matrix):
+        matrix = matrix.toarray()
+    matrix = np.asarray(matrix)
     
-    ax.set_xticks(np.arange(len(states)))
-    ax.set_yticks(np.arange(len(states)))
-    ax.set_xticklabels(states)
-    ax.set_yticklabels(states)
+    cmap = 'gray' if style == "grayscale" else 'Blues'
+    im = ax.imshow(matrix, cmap=cmap, vmin=0, vmax=1)
+    
+    if max(n_rows, n_cols) <= _ANNOTATE_MAX_STATES:
+        for i in range(n_rows):
+            for j in range(n_cols):
+                ax.text(j, i, f"{matrix[i, j]:.2f}",
+                        ha="center", va="center",
+                        color="black" if matrix[i, j] < 0.7 else "white")
+    
+    if states is None:
+        states = [f"State {i}" for i in range(n_cols)]
+    if len(states) == n_cols and n_cols <= _ANNOTATE_MAX_STATES:
+        ax.set_xticks(np.arange(n_cols))
+        ax.set_xticklabels(states)
+        if n_rows == n_cols:
+            ax.set_yticks(np.arange(n_rows))
+            ax.set_yticklabels(states)
     ax.set_xlabel("To State")
     ax.set_ylabel("From State")
     ax.set_title(f"Transition Matrix - {region_name}")
     
-    plt.colorbar(im, ax=ax)
-    plt.tight_layout()
+    fig.colorbar(im, ax=ax)
+    if style == "grayscale":
+        ax.set_facecolor('white')
+        fig.patch.set_facecolor('white')
+    fig.tight_layout()
     return fig
 
-def plot_stationary_vs_empirical(comparisons: Dict):
+@instrumented()
+def plot_stationary_vs_empirical(comparisons: Dict, style: str = "default"):
     """
     Compare stationary and empirical distributions
+    
+    Empirical bars carry their bootstrap confidence intervals when the
+    comparison has them.
     """
     regions = list(comparisons.keys())
     n_regions = len(regions)
@@ -48,36 +98,74 @@ def plot_stationary_vs_empirical(comparisons: Dict):
     
     for idx, region in enumerate(regions):
         comp = comparisons[region]
-        x = np.arange(3)  # 3 states
+        x = np.arange(len(comp['stationary']))
+        labels = comp.get('state_labels',
+                          [f"State {i}" for i in range(len(x))])
         
         width = 0.35
         axes[idx].bar(x - width/2, comp['stationary'], 
                      width, label='Stationary', alpha=0.8)
+        interval = comp.get('empirical_ci')
+        yerr = None
+        if interval is not None:
+            yerr = np.abs(np.asarray(interval) - comp['empirical'])
         axes[idx].bar(x + width/2, comp['empirical'], 
-                     width, label='Empirical', alpha=0.8)
+                     width, label='Empirical', alpha=0.8,
+                     yerr=yerr, capsize=4)
         
         axes[idx].set_xticks(x)
-        axes[idx].set_xticklabels(['Sunny', 'Rainy', 'Cloudy'])
+        axes[idx].set_xticklabels(labels)
         axes[idx].set_ylabel('Probability')
         axes[idx].set_title(f'{region}\nMAE: {comp["mean_absolute_error"]:.4f}')
         axes[idx].legend()
         axes[idx].grid(True, alpha=0.3)
     
-    plt.suptitle('Stationary vs Empirical Distributions', fontsize=14)
-    plt.tight_layout()
+    if style == "grayscale":
+        for ax in fig.get_axes():
+            ax.set_facecolor('white')
+            for patch in ax.patches:
+                patch.set_color('#666666')
+                patch.set_edgecolor('black')
+        fig.patch.set_facecolor('white')
+    
+    fig.suptitle('Stationary vs Empirical Distributions', fontsize=14)
+    fig.tight_layout()
     return fig
 
-def plot_rain_probability_forecast(forecasts: Dict):
+@instrumented()
+def plot_rain_probability_forecast(forecasts: Dict, style: str = "default"):
     """
     Plot probability of rain over time for different regions
+    
+    Lines are the theoretical probabilities; where a forecast carries
+    empirical values, they are drawn as dots with their confidence band.
     """
     fig, ax = plt.subplots(figsize=(10, 6))
     
     days = sorted(list(forecasts[list(forecasts.keys())[0]].keys()))
+    # Markers only for short horizon lists, daily curves stay readable
+    marker = 'o' if len(days) <= 60 else None
+    last_simulated = None
     
     for region_name, region_forecast in forecasts.items():
         probs = [region_forecast[d]['theoretical'] for d in days]
-        ax.plot(days, probs, marker='o', label=region_name, linewidth=2)
+        line, = ax.plot(days, probs, marker=marker, label=region_name,
+                        linewidth=2)
+        
+        empirical = np.array([region_forecast[d].get('empirical', np.nan)
+                              for d in days], dtype=float)
+        if np.isnan(empirical).all():
+            continue
+        observed = np.asarray(days)[~np.isnan(empirical)]
+        last_simulated = max(last_simulated or observed.max(), observed.max())
+        low = np.array([region_forecast[d].get('ci_low', np.nan)
+                        for d in days], dtype=float)
+        high = np.array([region_forecast[d].get('ci_high', np.nan)
+                         for d in days], dtype=float)
+        ax.fill_between(days, low, high, color=line.get_color(), alpha=0.15,
+                        linewidth=0)
+        ax.plot(days, empirical, linestyle='none', marker='.',
+                color=line.get_color(), alpha=0.7)
     
     ax.set_xlabel('Days Ahead')
     ax.set_ylabel('Probability of Rain')
@@ -87,72 +175,235 @@ def plot_rain_probability_forecast(forecasts: Dict):
     
     ax.axhline(y=0.5, color='red', linestyle='--', alpha=0.3, label='50% threshold')
     
-    plt.tight_layout()
+    if last_simulated is not None and last_simulated < max(days):
+        # Empirical dots stop where the simulated paths end
+        ax.axvline(x=last_simulated, color='gray', linestyle=':', alpha=0.6)
+        ax.text(0.99, 0.02,
+                f"Simulated values end at day {last_simulated}; later "
+                "horizons are theoretical only",
+                transform=ax.transAxes, ha='right', va='bottom',
+                fontsize=8, color='gray')
+    
+    if style == "grayscale":
+        ax.set_facecolor('white')
+        fig.patch.set_facecolor('white')
+        for line in ax.get_lines():
+            line.set_color('black')
+            line.set_linewidth(2)
+        ax.grid(True, color='#e0e0e0', linestyle='-', linewidth=0.5)
+    
+    fig.tight_layout()
     return fig
 
-def plot_regional_comparison(models_dict: Dict):
+@instrumented()
+def plot_regional_comparison(models_dict: Dict, style: str = "default",
+                             convergence_horizon: int = 30,
+                             mixing_epsilon: float = 0.25):
     """
     Create comparison plot for all regions
+    
+    The convergence panel shows, for every region, the worst-case total
+    variation distance from stationarity over start states up to
+    convergence_horizon days, with its mixing time for mixing_epsilon.
     """
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(12, 10))
     
     regions = list(models_dict.keys())
     avg_rainy = [models_dict[r]['avg_rainy_days'] for r in regions]
+    days = len(models_dict[regions[0]]['rainy_day_histogram']) - 1
     
     ax1.barh(regions, avg_rainy, color='skyblue')
-    ax1.set_xlabel('Average Rainy Days (30-day period)')
+    ax1.set_xlabel(f'Average Rainy Days ({days}-day period)')
     ax1.set_title('Rainy Days by Region')
     ax1.grid(True, alpha=0.3, axis='x')
     
-    rain_probs = []
-    for region in regions:
-        stationary = models_dict[region]['stationary']
-        rain_idx = 1
-        rain_probs.append(stationary[rain_idx])
+    rain_probs = [
+        models_dict[region]['stationary'] @ models_dict[region]['model'].rain_mask
+        for region in regions
+    ]
     
     colors = plt.cm.Set3(np.linspace(0, 1, len(regions)))
     wedges, texts, autotexts = ax2.pie(rain_probs, labels=regions, 
                                        autopct='%1.1f%%', colors=colors)
     ax2.set_title('Stationary Probability of Rain')
     
-    ax3.set_title('Sample 30-Day Simulations')
+    ax3.set_title(f'Sample {days}-Day Simulations')
     for i, region in enumerate(regions[:3]):
-        seq = models_dict[region]['sequences'][0]
-        numeric_seq = []
-        for state in seq:
-            if state == 'Sunny':
-                numeric_seq.append(0)
-            elif state == 'Rainy':
-                numeric_seq.append(1)
-            else:
-                numeric_seq.append(0.5)
+        if models_dict[region]['sequences'] is None:
+            continue  # streaming run, no paths kept
+        codes = models_dict[region]['sequences'][0]
+        labels = models_dict[region]['state_labels']
+        rain_mask = models_dict[region]['model'].rain_mask
+        
+        # Map state codes onto the 0 / 0.5 / 1 plotting scale: rain
+        # states 1, Cloudy 0.5, every other dry state 0
+        levels = np.where(rain_mask > 0, 1.0,
+                          np.where(np.asarray(labels) == 'Cloudy', 0.5, 0.0))
+        numeric_seq = levels[codes]
         
         ax3.plot(numeric_seq, label=region, alpha=0.7)
     
     ax3.set_xlabel('Day')
-    ax3.set_ylabel('Weather (0=Sunny, 0.5=Cloudy, 1=Rainy)')
+    ax3.set_ylabel('Weather (0=Dry, 0.5=Cloudy, 1=Rain)')
     ax3.legend()
     ax3.grid(True, alpha=0.3)
     
     ax4.set_title('Convergence to Stationary Distribution')
-    for region in regions[:2]:
+    horizons = np.arange(convergence_horizon + 1)
+    for region in regions:
         model = models_dict[region]['model']
-        distances = []
-        days = range(1, 31)
+        distances = model.worst_case_curve(convergence_horizon)
+        mixing = model.mixing_time(mixing_epsilon)
         
-        for n in days:
-            pi_n = model.initial @ np.linalg.matrix_power(model.P, n)
-            stationary = models_dict[region]['stationary']
-            distance = np.linalg.norm(pi_n - stationary)
-            distances.append(distance)
-        
-        ax4.plot(days, distances, label=region, marker='.')
+        # Floor at machine precision so the log scale can show mixed chains
+        ax4.plot(horizons[1:], np.maximum(distances[1:], 1e-16), marker='.',
+                 label=f"{region} (t_mix={mixing:.0f})")
     
+    ax4.axhline(y=mixing_epsilon, color='gray', linestyle=':', alpha=0.5)
+    ax4.set_yscale('log')
     ax4.set_xlabel('Days')
-    ax4.set_ylabel('Distance from Stationary')
+    ax4.set_ylabel('Worst-case TV Distance from Stationary')
     ax4.legend()
     ax4.grid(True, alpha=0.3)
     
-    plt.suptitle('US Regional Weather Markov Model Analysis', fontsize=16)
-    plt.tight_layout()
-    return fig
\ No newline at end of file
+    if style == "grayscale":
+        for ax in fig.get_axes():
+            ax.set_facecolor('white')
+            for line in ax.get_lines():
+                line.set_color('black')
+            for patch in ax.patches:
+                patch.set_facecolor('#f0f0f0')
+                patch.set_edgecolor('black')
+        fig.patch.set_facecolor('white')
+    
+    fig.suptitle('US Regional Weather Markov Model Analysis', fontsize=16)
+    fig.tight_layout()
+    return fig
+
+@instrumented()
+def render_transition_matrix(matrix: np.ndarray,
+                             region_name: str,
+                             states: List[str] = None,
+                             style: str = "grayscale",
+                             fmt: str = "png") -> bytes:
+    """
+    Transition matrix heatmap as cached PNG/SVG bytes
+    """
+    key = _content_key("transition_matrix", matrix, region_name, states,
+                       style, fmt)
+    return _render_cached(
+        key, lambda: plot_transition_matrix(matrix, region_name, states,
+                                            style=style), fmt
+    )
+
+@instrumented()
+def render_stationary_vs_empirical(comparisons: Dict,
+                                   style: str = "grayscale",
+                                   fmt: str = "png") -> bytes:
+    """
+    Stationary vs empirical bar charts as cached PNG/SVG bytes
+    """
+    key = _content_key("stationary_vs_empirical", [
+        (region, comp['stationary'], comp['empirical'],
+         comp['mean_absolute_error'], comp.get('empirical_ci'),
+         comp.get('state_labels'))
+        for region, comp in comparisons.items()
+    ], style, fmt)
+    return _render_cached(
+        key, lambda: plot_stationary_vs_empirical(comparisons, style=style),
+        fmt
+    )
+
+@instrumented()
+def render_rain_probability_forecast(forecasts: Dict,
+                                     style: str = "grayscale",
+                                     fmt: str = "png") -> bytes:
+    """
+    Rain probability forecast chart as cached PNG/SVG bytes
+    """
+    key = _content_key("rain_probability_forecast", [
+        (region, [(n, values['theoretical'], values.get('empirical'),
+                   values.get('ci_low'), values.get('ci_high'))
+                  for n, values in region_forecast.items()])
+        for region, region_forecast in forecasts.items()
+    ], style, fmt)
+    return _render_cached(
+        key, lambda: plot_rain_probability_forecast(forecasts, style=style),
+        fmt
+    )
+
+@instrumented()
+def render_regional_comparison(models_dict: Dict,
+                               style: str = "grayscale",
+                               fmt: str = "png",
+                               convergence_horizon: int = 30,
+                               mixing_epsilon: float = 0.25) -> bytes:
+    """
+    Regional comparison panels as cached PNG/SVG bytes
+    """
+    key = _content_key("regional_comparison", [
+        (region, results['avg_rainy_days'], results['stationary'],
+         results['model'].P, results['model'].initial,
+         results['model'].rain_mask, results['state_labels'],
+         len(results['rainy_day_histogram']),
+         None if results['sequences'] is None else results['sequences'][0])
+        for region, results in models_dict.items()
+    ], style, fmt, convergence_horizon, mixing_epsilon)
+    return _render_cached(
+        key, lambda: plot_regional_comparison(
+            models_dict, style=style,
+            convergence_horizon=convergence_horizon,
+            mixing_epsilon=mixing_epsilon
+        ), fmt
+    )
+
+def clear_figure_cache():
+    """Drop all cached renderings"""
+    with _figure_cache_lock:
+        _figure_cache.clear()
+
+def _render_cached(key: str, build: Callable, fmt: str) -> bytes:
+    """Return cached bytes for key, rendering with build() on a miss"""
+    with _figure_cache_lock:
+        image = _figure_cache.get(key)
+        if image is not None:
+            _figure_cache.move_to_end(key)
+            return image
+    
+    fig = build()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=200, bbox_inches="tight")
+    plt.close(fig)
+    image = buffer.getvalue()
+    
+    with _figure_cache_lock:
+        _figure_cache[key] = image
+        _figure_cache.move_to_end(key)
+        if len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    
+    return image
+
+def _content_key(*parts) -> str:
+    """Hash nested arrays, containers and scalars into a cache key"""
+    digest = hashlib.sha256()
+    
+    def feed(obj):
+        if sparse.issparse(obj):
+            # repr() of a sparse matrix only shows shape and nnz
+            obj = sparse.csr_matrix(obj)
+            digest.update(f"csr{obj.shape}".encode())
+            for part in (obj.indptr, obj.indices, obj.data):
+                feed(np.asarray(part))
+        elif isinstance(obj, np.ndarray):
+            digest.update(f"nd{obj.dtype}{obj.shape}".encode())
+            digest.update(np.ascontiguousarray(obj).tobytes())
+        elif isinstance(obj, (list, tuple)):
+            digest.update(f"seq{len(obj)}".encode())
+            for item in obj:
+                feed(item)
+        else:
+            digest.update(repr(obj).encode())
+    
+    feed(parts)
+    return digest.hexdigest()
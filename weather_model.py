@@ -1,49 +1,358 @@
+import warnings
 import numpy as np
-from typing import List, Tuple, Dict
+import scipy.sparse as sparse
+import scipy.sparse.linalg as sparse_linalg
+from collections import OrderedDict
+from typing import List, Tuple, Dict, Iterable, Optional, Union
+
+# Compact storage type for integer-coded state sequences
+STATE_CODE_DTYPE = np.uint8
+
+# Default labels of the three-state weather model
+DEFAULT_STATES = ["Sunny", "Rainy", "Cloudy"]
+
+# Horizons up to this length are summed day by day; longer ones use the
+# closed-form geometric series
+_DIRECT_SUM_HORIZON = 512
+
+# Number of P^n matrices kept per model
+_POWER_CACHE_SIZE = 64
+
+# From this many steps on, P^n is taken from the eigendecomposition
+_SPECTRAL_MIN_STEPS = 1024
+
+# Eigenbases worse conditioned than this (near-defective P) are not used
+_MAX_BASIS_CONDITION = 1e8
+
+# Dense chains with more states than this sample through alias tables
+# instead of the cumulative table
+_ALIAS_MIN_STATES = 32
+
+# convergence_curve evaluates all horizons from the eigendecomposition
+# for chains up to this many states (per-step Python overhead dominates
+# there); larger chains propagate step by step with real matrix products
+_CURVE_SPECTRAL_MAX_STATES = 16
+
+# Entries (horizons x starts x states) per block of that spectral path
+_CURVE_BLOCK_ENTRIES = 1 << 22
+
+# Sparse chains up to this many states solve for π with a sparse LU;
+# beyond it the LU fill-in of lifted higher-order chains explodes and
+# an iterative solve is used instead
+_SPARSE_DIRECT_MAX_STATES = 4096
+
+# Residual target of the iterative stationary solve
+_STATIONARY_TOLERANCE = 1e-12
+
+# mixing_time gives up (returns inf) beyond this many steps
+_MAX_MIXING_STEPS = 1 << 20
+
+def state_code_dtype(n_states: int) -> np.dtype:
+    """Smallest unsigned integer type able to hold n_states codes"""
+    if n_states <= 1 << 8:
+        return STATE_CODE_DTYPE
+    return np.min_scalar_type(n_states - 1)
 
 class MarkovWeatherModel:
     """Markov Chain model for weather prediction"""
     
     def __init__(self, transition_matrix: np.ndarray, 
                  initial_dist: List[float],
-                 region_name: str = "Generic"):
+                 region_name: str = "Generic",
+                 states: Optional[List[str]] = None,
+                 rain_states: Optional[List[str]] = None):
         """
         Initialize weather model
         
         Parameters:
         -----------
-        transition_matrix : np.ndarray
-            Square matrix where P[i][j] = probability from state i to j
+        transition_matrix : np.ndarray or scipy.sparse matrix
+            Square matrix where P[i][j] = probability from state i to j.
+            Sparse input is kept in CSR form and all computations scale
+            with its nonzeros.
         initial_dist : List[float]
             Initial probability distribution
         region_name : str
             Name of the US region
+        states : List[str] or None
+            State labels; defaults to Sunny/Rainy/Cloudy
+        rain_states : List[str] or None
+            Labels counted as rain; defaults to ["Rainy"]
         """
-        self.P = np.array(transition_matrix)
-        self.initial = np.array(initial_dist)
+        self.is_sparse = sparse.issparse(transition_matrix)
+        if self.is_sparse:
+            self.P = sparse.csr_matrix(transition_matrix, dtype=float)
+            self.P.sum_duplicates()
+            self.P.eliminate_zeros()
+        else:
+            self.P = np.array(transition_matrix, dtype=float)
+        self.initial = np.array(initial_dist, dtype=float)
         self.region = region_name
-        self.states = ["Sunny", "Rainy", "Cloudy"]
+        self.states = list(states) if states is not None else list(DEFAULT_STATES)
+        self.rain_states = list(rain_states) if rain_states is not None else ["Rainy"]
         
         self._validate_matrix()
         
+        # Rain is a set of states: rain_mask[i] = 1 if state i is rainy
+        self.rain_mask = np.isin(self.states, self.rain_states).astype(float)
+        self.rain_codes = np.flatnonzero(self.rain_mask)
+        self.code_dtype = state_code_dtype(len(self.states))
+        
+        self._initial_cumulative = np.cumsum(self.initial)
+        self._initial_cumulative[-1] = 1.0
+        # Alias tables are built on first use by simulate_batch
+        self._alias = None
+        if self.is_sparse or len(self.states) > _ALIAS_MIN_STATES:
+            self._cumulative = None
+        else:
+            # Row-wise cumulative transition table for inverse-CDF sampling
+            self._cumulative = np.cumsum(self.P, axis=1)
+            self._cumulative[:, -1] = 1.0
+        
+        # n-step engine state: LRU cache of P^n and the eigenbasis of P,
+        # both derived from P and computed on demand
+        self._power_cache = OrderedDict()
+        self._spectrum = None
+        self._stationary = None
+        
     def _validate_matrix(self):
         """Check transition matrix is valid"""
-        for i in range(len(self.P)):
-            if not np.isclose(self.P[i].sum(), 1.0, atol=1e-10):
-                raise ValueError(f"Row {i} doesn't sum to 1: {self.P[i].sum()}")
+        size = len(self.states)
+        if self.P.shape != (size, size):
+            raise ValueError(
+                f"Transition matrix shape {self.P.shape} doesn't match "
+                f"{size} states"
+            )
+        if self.initial.shape != (size,):
+            raise ValueError(
+                f"Initial distribution has {self.initial.size} entries, "
+                f"expected {size}"
+            )
+        
+        missing = set(self.rain_states) - set(self.states)
+        if missing:
+            raise ValueError(f"Unknown rain states: {sorted(missing)}")
+        
+        if self.is_sparse:
+            entries = self.P.data
+            row_sums = np.asarray(self.P.sum(axis=1)).ravel()
+        else:
+            entries = self.P
+            row_sums = self.P.sum(axis=1)
+        
+        if np.any(entries < 0):
+            raise ValueError("Transition probabilities must be non-negative")
+        
+        bad_rows = np.flatnonzero(~np.isclose(row_sums, 1.0, atol=1e-10))
+        if len(bad_rows):
+            i = bad_rows[0]
+            raise ValueError(f"Row {i} doesn't sum to 1: {row_sums[i]}")
     
     def n_step_transition(self, n: int) -> np.ndarray:
         """
         Compute n-step transition matrix: P^n
+        
+        Results are kept in a bounded LRU cache, so the returned array is
+        read-only. Very large n is computed from the eigendecomposition
+        of P instead of repeated squaring. For a sparse model the result
+        is a sparse matrix; it can fill in, so prefer
+        distribution_over_horizons when only distributions are needed.
         """
-        return np.linalg.matrix_power(self.P, n)
+        power = self._power_cache.get(n)
+        if power is not None:
+            self._power_cache.move_to_end(n)
+            return power
+        
+        if self.is_sparse:
+            power = _sparse_matrix_power(self.P, n)
+        elif n >= _SPECTRAL_MIN_STEPS and self._spectral_basis() is not None:
+            power = self._spectral_powers(np.array([n]))[0]
+            power.setflags(write=False)
+        else:
+            power = np.linalg.matrix_power(self.P, n)
+            power.setflags(write=False)
+        
+        self._power_cache[n] = power
+        if len(self._power_cache) > _POWER_CACHE_SIZE:
+            self._power_cache.popitem(last=False)
+        
+        return power
     
-    def stationary_distribution(self, max_iter: int = 1000, 
+    def _spectral_basis(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Eigendecomposition P = V diag(w) V^-1, computed once
+        
+        Returns (w, V, V^-1), or None when P is not safely diagonalizable
+        or is sparse (a dense eigenbasis would cost O(S^2) memory).
+        """
+        if self.is_sparse:
+            return None
+        
+        if self._spectrum is None:
+            eigvals, vecs = np.linalg.eig(self.P)
+            # A stochastic matrix has spectral radius exactly 1; remove
+            # rounding so that w^n stays stable for huge n
+            eigvals[np.isclose(eigvals, 1.0, rtol=0.0, atol=1e-12)] = 1.0
+            magnitudes = np.abs(eigvals)
+            eigvals = np.where(magnitudes > 1.0, eigvals / magnitudes, eigvals)
+            if np.linalg.cond(vecs) < _MAX_BASIS_CONDITION:
+                self._spectrum = (eigvals, vecs, np.linalg.inv(vecs))
+            else:
+                self._spectrum = False
+        
+        return self._spectrum or None
+    
+    def _spectral_powers(self, ns: np.ndarray) -> np.ndarray:
+        """Stack of P^n for every n in ns via the eigenbasis"""
+        eigvals, vecs, inv = self._spectral_basis()
+        scaled = eigvals ** ns[:, None]
+        powers = np.einsum("ij,nj,jk->nik", vecs, scaled, inv)
+        
+        return np.clip(powers.real, 0.0, None)
+    
+    def distribution_over_horizons(self, start: Union[str, np.ndarray, None],
+                                   ns: Iterable[int]) -> np.ndarray:
+        """
+        State distributions start @ P^n for every horizon n in ns
+        
+        Parameters:
+        -----------
+        start : str, np.ndarray or None
+            Current state, a starting distribution, or None for the
+            initial distribution
+        ns : Iterable[int]
+            Horizons in days
+        
+        Returns:
+        --------
+        np.ndarray
+            Array of shape (len(ns), n_states); row k is the distribution
+            after ns[k] days
+        """
+        ns = np.asarray(list(ns), dtype=np.int64)
+        if isinstance(start, str) or start is None:
+            start_vec = self._start_vector(start)
+        else:
+            start_vec = np.asarray(start, dtype=float)
+        
+        basis = self._spectral_basis()
+        if basis is not None:
+            eigvals, vecs, inv = basis
+            coeffs = start_vec @ vecs
+            dists = (coeffs * eigvals ** ns[:, None]) @ inv
+            return np.clip(dists.real, 0.0, None)
+        
+        # Sparse or near-defective P: walk the sorted horizons, stepping
+        # by the gaps
+        dists = np.empty((len(ns), len(start_vec)))
+        dist = start_vec
+        reached = 0
+        for k in np.argsort(ns, kind="stable"):
+            dist = self._propagate(dist, int(ns[k]) - reached)
+            reached = int(ns[k])
+            dists[k] = dist
+        
+        return dists
+    
+    def _propagate(self, dist: np.ndarray, steps: int) -> np.ndarray:
+        """dist @ P^steps; sparse models use repeated sparse products"""
+        if not self.is_sparse:
+            return dist @ self.n_step_transition(steps)
+        
+        for _ in range(steps):
+            dist = dist @ self.P
+        return np.asarray(dist).ravel()
+    
+    def stationary_distribution(self, method: str = "direct",
+                                max_iter: int = 1000, 
                                 tolerance: float = 1e-10) -> np.ndarray:
         """
         Find stationary distribution π such that πP = π
-        Using power iteration method
+        
+        The default direct method solves (P^T - I) π = 0 together with
+        sum(π) = 1 as one linear system. It is computed once and memoized
+        on the model. method="power" keeps the old power iteration and
+        warns if it stops at max_iter without converging.
+        """
+        if method == "power":
+            return self._stationary_power_iteration(max_iter, tolerance)
+        
+        if method != "direct":
+            raise ValueError(f"Unknown method: {method}")
+        
+        if self._stationary is None:
+            size = len(self.states)
+            rhs = np.zeros(size)
+            rhs[-1] = 1.0
+            
+            if self.is_sparse:
+                pi = self._sparse_stationary(rhs)
+            else:
+                system = self.P.T - np.eye(size)
+                # Replace one redundant balance equation by the normalization
+                system[-1] = 1.0
+                
+                try:
+                    pi = np.linalg.solve(system, rhs)
+                except np.linalg.LinAlgError:
+                    # Several closed classes: any stationary vector will do
+                    pi = np.linalg.lstsq(system, rhs, rcond=None)[0]
+            
+            pi = np.clip(pi, 0.0, None)
+            self._stationary = pi / pi.sum()
+        
+        return self._stationary.copy()
+    
+    def _sparse_stationary(self, rhs: np.ndarray) -> np.ndarray:
+        """Sparse LU solve of the balance equations plus normalization"""
+        size = len(self.states)
+        if size > _SPARSE_DIRECT_MAX_STATES:
+            return self._iterative_stationary()
+        
+        balance = (self.P.T - sparse.identity(size, format="csr")).tocsr()
+        system = sparse.vstack([
+            balance[:-1], sparse.csr_matrix(np.ones((1, size)))
+        ]).tocsc()
+        
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", sparse_linalg.MatrixRankWarning)
+            try:
+                return sparse_linalg.spsolve(system, rhs)
+            except (sparse_linalg.MatrixRankWarning, RuntimeError):
+                # Several closed classes: any stationary vector will do
+                return sparse_linalg.lsqr(system, rhs, atol=1e-12,
+                                          btol=1e-12)[0]
+    
+    def _iterative_stationary(self) -> np.ndarray:
         """
+        π of a large sparse chain without factorizing the balance system
+        
+        GMRES solves (I - P^T + u 1^T) π = u, u uniform, starting from u;
+        the rank-one term makes the system nonsingular for chains with a
+        single closed class and fixes sum(π) = 1. Only products with P^T
+        are needed. If GMRES stalls, the Perron vector comes from ARPACK.
+        """
+        size = len(self.states)
+        uniform = np.full(size, 1.0 / size)
+        transposed = self.P.T.tocsr()
+        system = sparse_linalg.LinearOperator(
+            (size, size), dtype=float,
+            matvec=lambda x: x - transposed @ x + uniform * x.sum()
+        )
+        pi, info = sparse_linalg.gmres(system, uniform, x0=uniform,
+                                       rtol=_STATIONARY_TOLERANCE,
+                                       atol=0.0, restart=50, maxiter=200)
+        if info == 0:
+            return pi
+        
+        _, vecs = sparse_linalg.eigs(transposed, k=1, which="LM", v0=uniform,
+                                     tol=_STATIONARY_TOLERANCE)
+        pi = vecs[:, 0].real
+        return pi * np.sign(pi.sum())
+    
+    def _stationary_power_iteration(self, max_iter: int,
+                                    tolerance: float) -> np.ndarray:
+        """Power iteration from the uniform distribution"""
         pi = np.ones(len(self.states)) / len(self.states)
         
         for _ in range(max_iter):
@@ -52,8 +361,235 @@ class MarkovWeatherModel:
                 return pi_next
             pi = pi_next
         
+        warnings.warn(
+            f"Power iteration did not converge in {max_iter} iterations "
+            f"for region {self.region}",
+            RuntimeWarning
+        )
         return pi
     
+    def spectral_gap(self) -> float:
+        """
+        Absolute spectral gap 1 - |λ2| of the transition matrix
+        
+        Reuses the eigendecomposition of the n-step engine. A gap of 0
+        means the chain is periodic or reducible and need not mix.
+        """
+        basis = self._spectral_basis()
+        if basis is not None:
+            eigvals = basis[0]
+        elif self.is_sparse and len(self.states) > 3:
+            # Two largest-modulus eigenvalues by Arnoldi iteration
+            eigvals = sparse_linalg.eigs(self.P.T, k=2, which="LM",
+                                         return_eigenvectors=False)
+        elif self.is_sparse:
+            eigvals = np.linalg.eigvals(self.P.toarray())
+        else:
+            eigvals = np.linalg.eigvals(self.P)
+        
+        moduli = np.sort(np.abs(eigvals))[::-1]
+        if len(moduli) < 2:
+            return 1.0
+        
+        return float(max(0.0, 1.0 - moduli[1]))
+    
+    def mixing_time_estimate(self, epsilon: float = 0.25) -> float:
+        """
+        Heuristic estimate of the total-variation mixing time
+        
+        Evaluates t_rel * log(1 / (ε * π_min)) with relaxation time
+        t_rel = 1 / spectral_gap (the absolute gap). This is an upper
+        bound on t_mix(ε) only for reversible chains (π_i P_ij = π_j P_ji);
+        the regional matrices are generally not reversible, where the
+        value can fall on either side of the true mixing time. Use
+        mixing_time for the exact value. Returns inf when the gap is 0.
+        """
+        gap = self.spectral_gap()
+        pi_min = self.stationary_distribution().min()
+        if gap <= 0.0 or pi_min <= 0.0:
+            return np.inf
+        
+        return float(np.ceil(np.log(1.0 / (epsilon * pi_min)) / gap))
+    
+    def convergence_curve(self, horizon: int,
+                          start: Union[str, np.ndarray, None] = None,
+                          metric: str = "tv") -> np.ndarray:
+        """
+        Distance to the stationary distribution after 0, 1, ..., horizon days
+        
+        All horizons come from one pass: for small chains the
+        eigendecomposition gives every start @ P^n at once (in blocks of
+        horizons); otherwise blocks of start distributions are propagated
+        one step at a time, so point masses for start=None are never all
+        held at once. worst_case_curve gives the row maximum without the
+        (horizon + 1, S) result.
+        
+        Parameters:
+        -----------
+        horizon : int
+            Last day of the curve
+        start : str, np.ndarray or None
+            None for every start state at once, a state label or
+            distribution of shape (S,), or k distributions of shape (k, S)
+        metric : str
+            "tv" for total variation distance, "l2" for Euclidean distance
+        
+        Returns:
+        --------
+        np.ndarray
+            Shape (horizon + 1, S) for start=None, (horizon + 1, k) for k
+            start distributions, (horizon + 1,) for a single start.
+            With start=None, the row maximum is the worst-case distance
+            d(n) used to define mixing times.
+        """
+        single = isinstance(start, str) or (start is not None
+                                            and np.ndim(start) == 1)
+        if start is None:
+            starts = np.eye(len(self.states))
+        elif isinstance(start, str):
+            starts = self._start_vector(start)[None]
+        else:
+            starts = np.atleast_2d(np.asarray(start, dtype=float))
+        
+        pi = self.stationary_distribution()
+        distances = np.empty((horizon + 1, len(starts)))
+        
+        basis = None
+        if len(self.states) <= _CURVE_SPECTRAL_MAX_STATES:
+            basis = self._spectral_basis()
+        if basis is not None:
+            eigvals, vecs, inv = basis
+            coeffs = starts @ vecs
+            block = max(1, _CURVE_BLOCK_ENTRIES // coeffs.size)
+            for first in range(0, horizon + 1, block):
+                ns = np.arange(first, min(first + block, horizon + 1))
+                scaled = coeffs * eigvals ** ns[:, None, None]
+                dists = (scaled.reshape(-1, len(inv)) @ inv).reshape(scaled.shape)
+                distances[ns] = _distribution_distance(
+                    np.clip(dists.real, 0.0, None), pi, metric
+                )
+        else:
+            for columns, dists in self._start_blocks(None if start is None
+                                                     else starts):
+                distances[0, columns] = _distribution_distance(dists, pi, metric)
+                for n in range(1, horizon + 1):
+                    dists = np.asarray(dists @ self.P)
+                    distances[n, columns] = _distribution_distance(dists, pi,
+                                                                   metric)
+        
+        return distances[:, 0] if single else distances
+    
+    def worst_case_curve(self, horizon: int, metric: str = "tv") -> np.ndarray:
+        """
+        Worst-case distance d(n) = max_s dist(P^n(s, .), π), n = 0..horizon
+        
+        Equals convergence_curve(horizon).max(axis=1), but large chains
+        keep only the running maximum per day while blocks of point
+        masses are propagated, so memory is one block.
+        """
+        if len(self.states) <= _CURVE_SPECTRAL_MAX_STATES:
+            return self.convergence_curve(horizon, metric=metric).max(axis=1)
+        
+        pi = self.stationary_distribution()
+        worst = np.zeros(horizon + 1)
+        for _, dists in self._start_blocks(None):
+            worst[0] = max(worst[0], _distribution_distance(dists, pi, metric).max())
+            for n in range(1, horizon + 1):
+                dists = np.asarray(dists @ self.P)
+                worst[n] = max(worst[n],
+                               _distribution_distance(dists, pi, metric).max())
+        
+        return worst
+    
+    def _start_blocks(self, starts: Optional[np.ndarray]):
+        """
+        Yield (columns, block) pairs covering the start distributions
+        
+        starts=None stands for a point mass on every state; those are
+        built one block at a time.
+        """
+        n_states = len(self.states)
+        block = max(1, _CURVE_BLOCK_ENTRIES // n_states)
+        total = n_states if starts is None else len(starts)
+        for first in range(0, total, block):
+            columns = slice(first, min(first + block, total))
+            if starts is not None:
+                yield columns, starts[columns]
+                continue
+            rows = np.arange(columns.start, columns.stop)
+            dists = np.zeros((len(rows), n_states))
+            dists[np.arange(len(rows)), rows] = 1.0
+            yield columns, dists
+    
+    def mixing_time(self, epsilon: float = 0.25,
+                    max_steps: int = _MAX_MIXING_STEPS) -> float:
+        """
+        Total-variation mixing time t_mix(ε)
+        
+        Smallest n with max_s ||P^n(s, .) - π||_TV <= ε. The worst-case
+        distance never increases with n, so it is found by doubling n and
+        then bisecting, with O(log n) cached matrix powers. Sparse chains
+        propagate point masses instead (see _sparse_mixing_time). Returns
+        inf if the chain has not mixed within max_steps (periodic or
+        reducible chains never do).
+        """
+        if not 0.0 < epsilon < 1.0:
+            raise ValueError(f"Epsilon must be between 0 and 1: {epsilon}")
+        
+        if self._worst_case_distance(0) <= epsilon:
+            return 0.0
+        if sparse.issparse(self.P):
+            return self._sparse_mixing_time(epsilon, max_steps)
+        
+        passed = 1
+        while self._worst_case_distance(passed) > epsilon:
+            if passed >= max_steps:
+                return np.inf
+            passed = min(2 * passed, max_steps)
+        
+        failed = passed // 2
+        while passed - failed > 1:
+            middle = (failed + passed) // 2
+            if self._worst_case_distance(middle) <= epsilon:
+                passed = middle
+            else:
+                failed = middle
+        
+        return float(passed)
+    
+    def _worst_case_distance(self, n: int) -> float:
+        """max over start states of the TV distance of P^n(s, .) from π"""
+        pi = self.stationary_distribution()
+        if n == 0:
+            return float(1.0 - pi.min())
+        
+        power = self.n_step_transition(n)
+        return float(0.5 * np.abs(power - pi).sum(axis=1).max())
+    
+    def _sparse_mixing_time(self, epsilon: float, max_steps: int) -> float:
+        """
+        t_mix(ε) of a sparse chain without forming matrix powers
+        
+        Point masses on a block of start states are stepped with sparse
+        products, as in convergence_curve, until the block's worst
+        distance is at most ε. The distance from any one start never
+        increases, so t_mix is the largest such step over the blocks.
+        Memory is one dense block and the power cache is left alone.
+        """
+        pi = self.stationary_distribution()
+        mixed = 0
+        
+        for _, dists in self._start_blocks(None):
+            steps = 0
+            while _distribution_distance(dists, pi, "tv").max() > epsilon:
+                if steps >= max_steps:
+                    return np.inf
+                dists = np.asarray(dists @ self.P)
+                steps += 1
+            mixed = max(mixed, steps)
+        
+        return float(mixed)
+    
     def probability_rain_in_n_days(self, n: int, 
                                    current_state: str = None) -> float:
         """
@@ -66,6 +602,14 @@ class MarkovWeatherModel:
         current_state : str or None
             If None, use initial distribution
         """
+        start_vec = self._start_vector(current_state)
+        
+        prob_n = self._propagate(start_vec, n)
+        
+        return prob_n @ self.rain_mask
+    
+    def _start_vector(self, current_state: str = None) -> np.ndarray:
+        """Point mass on current_state, or the initial distribution"""
         if current_state:
             idx = self.states.index(current_state)
             start_vec = np.zeros(len(self.states))
@@ -73,23 +617,186 @@ class MarkovWeatherModel:
         else:
             start_vec = self.initial
         
-        prob_n = start_vec @ np.linalg.matrix_power(self.P, n)
+        return start_vec
+    
+    def rain_probability_curve(self, horizon: int,
+                               current_state: str = None) -> np.ndarray:
+        """
+        Probability of rain on each of the next 'horizon' days
+        
+        Day 0 is the starting day itself, matching simulated sequences.
         
-        rain_idx = self.states.index("Rainy")
-        return prob_n[rain_idx]
+        Parameters:
+        -----------
+        horizon : int
+            Number of days
+        current_state : str or None
+            If None, use initial distribution
+        """
+        dists = self.distribution_over_horizons(current_state, range(horizon))
+        
+        return dists @ self.rain_mask
     
     def expected_rainy_days(self, horizon: int, 
-                           simulations: int = 1000) -> float:
+                           simulations: int = 1000,
+                           method: str = "analytic",
+                           current_state: str = None) -> float:
         """
         Expected number of rainy days in next 'horizon' days
+        
+        Parameters:
+        -----------
+        horizon : int
+            Number of days
+        simulations : int
+            Number of paths, used only by the Monte Carlo method
+        method : str
+            "analytic" for the exact value sum_k (start @ P^k)[Rainy],
+            or "monte_carlo" to estimate it by simulation (useful to
+            validate the analytic result)
+        current_state : str or None
+            If None, use initial distribution
+        """
+        if method == "monte_carlo":
+            paths = self.simulate_batch(simulations, horizon, current_state)
+            
+            return np.count_nonzero(np.isin(paths, self.rain_codes)) / simulations
+        
+        if method != "analytic":
+            raise ValueError(f"Unknown method: {method}")
+        
+        if horizon <= _DIRECT_SUM_HORIZON or self.is_sparse:
+            return self.rain_probability_curve(horizon, current_state).sum()
+        
+        return self._start_vector(current_state) @ self._power_sum(horizon) @ self.rain_mask
+    
+    def _power_sum(self, n: int) -> np.ndarray:
+        """
+        sum_{k<n} P^k of a dense model
+        
+        With a unique stationary distribution pi (Pi = 1 @ pi) the closed
+        form (n - 1) Pi + (I - P^n + Pi) Z with Z = (I - P + Pi)^-1 is
+        used. Chains with several closed classes make I - P + Pi
+        singular; they fall back to doubling, S(2m) = S(m) + P^m S(m) and
+        S(m + 1) = I + P S(m), over the bits of n.
+        """
+        size = len(self.states)
+        identity = np.eye(size)
+        pi_matrix = np.tile(self.stationary_distribution(), (size, 1))
+        system = identity - self.P + pi_matrix
+        if np.linalg.cond(system) < _MAX_BASIS_CONDITION:
+            fundamental = np.linalg.inv(system)
+            return ((n - 1) * pi_matrix
+                    + (identity - self.n_step_transition(n) + pi_matrix) @ fundamental)
+        
+        power_sum = np.zeros((size, size))
+        power = identity
+        for bit in bin(n)[2:]:
+            power_sum = power_sum + power @ power_sum
+            power = power @ power
+            if bit == "1":
+                power_sum = identity + self.P @ power_sum
+                power = power @ self.P
+        return power_sum
+    
+    def simulate_batch(self, n_paths: int, days: int,
+                       start_state: str = None,
+                       rng: np.random.Generator = None,
+                       dtype: np.dtype = np.intp,
+                       uniforms: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Simulate many weather sequences at once
+        
+        All paths are advanced together one day at a time. Uniforms are
+        drawn in bulk and mapped to the next state with an inverse-CDF
+        lookup against the cumulative transition table, or, for sparse
+        and many-state chains, with per-row alias tables in O(1).
+        
+        Parameters:
+        -----------
+        n_paths : int
+            Number of independent sequences
+        days : int
+            Length of each sequence
+        start_state : str or None
+            Starting weather state; if None, drawn from the initial
+            distribution
+        rng : np.random.Generator or None
+            Random source; defaults to the global NumPy random state
+        dtype : np.dtype
+            Integer type of the returned array, e.g. STATE_CODE_DTYPE
+            for compact storage
+        uniforms : np.ndarray or None
+            Pre-drawn (n_paths, days) uniforms (e.g. antithetic or
+            stratified) to use instead of drawing from rng; column 0
+            picks the starting state, column t the step into day t
+        
+        Returns:
+        --------
+        np.ndarray
+            Integer array of shape (n_paths, days) holding state indices
+        """
+        if rng is None:
+            rng = np.random
+        
+        paths = np.empty((n_paths, days), dtype=dtype)
+        if n_paths == 0 or days == 0:
+            return paths
+        
+        if uniforms is None:
+            uniforms = rng.random((n_paths, days))
+        
+        if start_state:
+            current = np.full(n_paths, self.states.index(start_state),
+                              dtype=np.intp)
+        else:
+            current = np.searchsorted(self._initial_cumulative,
+                                      uniforms[:, 0], side="right")
+        paths[:, 0] = current
+        
+        for t in range(1, days):
+            current = self._step(current, uniforms[:, t])
+            paths[:, t] = current
+        
+        return paths
+    
+    def continue_batch(self, history: np.ndarray, days: int,
+                       rng: np.random.Generator = None,
+                       dtype: np.dtype = np.intp) -> np.ndarray:
+        """
+        Continue existing paths for more days
+        
+        history is an (n_paths, k) array of the last k state codes of each
+        path, oldest first (only the last column matters here). Returns
+        the (n_paths, days) codes of the following days.
         """
-        total_rainy = 0
+        if rng is None:
+            rng = np.random
         
-        for _ in range(simulations):
-            weather_seq = self.simulate_sequence(horizon)
-            total_rainy += weather_seq.count("Rainy")
+        n_paths = len(history)
+        paths = np.empty((n_paths, days), dtype=dtype)
+        if n_paths == 0 or days == 0:
+            return paths
         
-        return total_rainy / simulations
+        uniforms = rng.random((n_paths, days))
+        current = np.asarray(history)[:, -1].astype(np.intp)
+        for t in range(days):
+            current = self._step(current, uniforms[:, t])
+            paths[:, t] = current
+        
+        return paths
+    
+    def _step(self, current: np.ndarray, uniforms: np.ndarray) -> np.ndarray:
+        """Next state of every path given one uniform per path"""
+        if self._cumulative is None:
+            if self._alias is None:
+                self._alias = _build_alias_tables(self.P)
+            return _alias_step(self._alias, current, uniforms)
+        
+        # Number of cumulative bins the uniform has passed = next state
+        return np.count_nonzero(
+            uniforms[:, None] >= self._cumulative[current], axis=1
+        )
     
     def simulate_sequence(self, days: int, 
                           start_state: str = None) -> List[str]:
@@ -103,19 +810,665 @@ class MarkovWeatherModel:
         start_state : str or None
             Starting weather state
         """
-        sequence = []
+        path = self.simulate_batch(1, days, start_state)[0]
+        
+        return self.decode(path)
+    
+    def decode(self, codes: np.ndarray) -> List[str]:
+        """
+        Convert an integer-coded sequence back to state labels
+        """
+        return [self.states[code] for code in codes]
+
+class RegionEnsemble:
+    """
+    Many first-order chains over the same states, stored as tensors
+    
+    Transition matrices are stacked into an (R, S, S) array and initial
+    distributions into (R, S), so simulation, stationary distributions
+    and n-step forecasts for all regions are single batched operations
+    instead of one model per region.
+    """
+    
+    def __init__(self, transition_matrices: np.ndarray,
+                 initial_dists: np.ndarray,
+                 region_names: Optional[List[str]] = None,
+                 states: Optional[List[str]] = None,
+                 rain_states: Optional[List[str]] = None):
+        """
+        Initialize ensemble
+        
+        Parameters:
+        -----------
+        transition_matrices : np.ndarray
+            Array of shape (R, S, S); entry [r, i, j] = probability of
+            going from state i to j in region r
+        initial_dists : np.ndarray
+            Array of shape (R, S) of initial distributions
+        region_names : List[str] or None
+            Names of the R regions; defaults to "Region 0", "Region 1", ...
+        states : List[str] or None
+            State labels shared by all regions; defaults to Sunny/Rainy/Cloudy
+        rain_states : List[str] or None
+            Labels counted as rain; defaults to ["Rainy"]
+        """
+        self.P = np.array(transition_matrices, dtype=float)
+        self.initial = np.array(initial_dists, dtype=float)
+        self.states = list(states) if states is not None else list(DEFAULT_STATES)
+        self.rain_states = list(rain_states) if rain_states is not None else ["Rainy"]
+        if region_names is None:
+            region_names = [f"Region {r}" for r in range(len(self.P))]
+        self.regions = list(region_names)
+        
+        self._validate_tensors()
+        
+        self.rain_mask = np.isin(self.states, self.rain_states).astype(float)
+        self.rain_codes = np.flatnonzero(self.rain_mask)
+        self.code_dtype = state_code_dtype(len(self.states))
+        
+        # Cumulative tables flattened to (R * S, S) so that row r * S + i
+        # is region r's state i
+        size = len(self.states)
+        self._cumulative = np.cumsum(self.P, axis=2).reshape(-1, size)
+        self._cumulative[:, -1] = 1.0
+        self._initial_cumulative = np.cumsum(self.initial, axis=1)
+        self._initial_cumulative[:, -1] = 1.0
+        self._stationary = None
+    
+    @classmethod
+    def from_regions(cls, regions: Dict) -> "RegionEnsemble":
+        """
+        Ensemble from region definitions in the US_REGIONS format
+        
+        All regions must be dense first-order chains over the same
+        state labels.
+        """
+        definitions = list(regions.values())
+        if not definitions:
+            raise ValueError("No regions given")
+        
+        labels = [region_data.get("state_labels") for region_data in definitions]
+        rain_states = [region_data.get("rain_states") for region_data in definitions]
+        if any(label != labels[0] for label in labels):
+            raise ValueError("All regions of an ensemble need the same states")
+        if any(rain != rain_states[0] for rain in rain_states):
+            raise ValueError("All regions of an ensemble need the same rain states")
+        if any(region_data.get("order", 1) > 1
+               or sparse.issparse(region_data["transition_matrix"])
+               for region_data in definitions):
+            raise ValueError("Ensembles only hold dense first-order chains")
+        
+        return cls(
+            transition_matrices=[region_data["transition_matrix"]
+                                 for region_data in definitions],
+            initial_dists=[region_data["initial_dist"]
+                           for region_data in definitions],
+            region_names=list(regions.keys()),
+            states=labels[0],
+            rain_states=rain_states[0]
+        )
+    
+    def _validate_tensors(self):
+        """Check shapes and that every region's matrix is stochastic"""
+        size = len(self.states)
+        n_regions = len(self.regions)
+        if self.P.shape != (n_regions, size, size):
+            raise ValueError(
+                f"Transition tensor shape {self.P.shape} doesn't match "
+                f"{n_regions} regions of {size} states"
+            )
+        if self.initial.shape != (n_regions, size):
+            raise ValueError(
+                f"Initial distributions shape {self.initial.shape}, "
+                f"expected {(n_regions, size)}"
+            )
+        
+        missing = set(self.rain_states) - set(self.states)
+        if missing:
+            raise ValueError(f"Unknown rain states: {sorted(missing)}")
+        
+        if np.any(self.P < 0):
+            raise ValueError("Transition probabilities must be non-negative")
+        
+        row_sums = self.P.sum(axis=2)
+        bad = np.argwhere(~np.isclose(row_sums, 1.0, atol=1e-10))
+        if len(bad):
+            r, i = bad[0]
+            raise ValueError(
+                f"Row {i} of {self.regions[r]} doesn't sum to 1: {row_sums[r, i]}"
+            )
+    
+    def __len__(self) -> int:
+        return len(self.regions)
+    
+    def region_model(self, region: Union[int, str]) -> MarkovWeatherModel:
+        """Standalone MarkovWeatherModel for one region"""
+        r = region if isinstance(region, (int, np.integer)) else self.regions.index(region)
+        return MarkovWeatherModel(self.P[r], self.initial[r],
+                                  region_name=self.regions[r],
+                                  states=self.states,
+                                  rain_states=self.rain_states)
+    
+    def n_step_transition(self, n: int) -> np.ndarray:
+        """P^n for every region, shape (R, S, S)"""
+        return np.linalg.matrix_power(self.P, n)
+    
+    def distribution_over_horizons(self, ns: Iterable[int],
+                                   start: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Distribution of every region after each horizon n in ns
+        
+        start is an (R, S) array of starting distributions (default: the
+        initial distributions). Horizons are visited in increasing order
+        and each gap is bridged with one batched matrix power.
+        
+        Returns:
+        --------
+        np.ndarray
+            Array of shape (R, len(ns), S)
+        """
+        ns = np.asarray(list(ns), dtype=np.int64)
+        dist = self.initial if start is None else np.asarray(start, dtype=float)
+        out = np.empty((len(self), len(ns), len(self.states)))
+        
+        reached = 0
+        for idx in np.argsort(ns, kind="stable"):
+            gap = ns[idx] - reached
+            if gap == 1:
+                dist = np.einsum("rs,rst->rt", dist, self.P)
+            elif gap > 1:
+                dist = np.einsum("rs,rst->rt", dist,
+                                 self.n_step_transition(int(gap)))
+            reached = ns[idx]
+            out[:, idx] = dist
+        
+        return out
+    
+    def rain_probability(self, ns: Iterable[int]) -> np.ndarray:
+        """Probability of rain n days ahead, shape (R, len(ns))"""
+        return self.distribution_over_horizons(ns) @ self.rain_mask
+    
+    def expected_rainy_days(self, horizon: int) -> np.ndarray:
+        """Expected rainy days in the next 'horizon' days, per region"""
+        return self.rain_probability(range(horizon)).sum(axis=1)
+    
+    def stationary_distribution(self) -> np.ndarray:
+        """
+        Stationary distribution of every region, shape (R, S)
+        
+        All balance systems (P^T - I with the last equation replaced by
+        the normalization) are solved in one batched call; if any is
+        singular, pseudo-inverses are used instead.
+        """
+        if self._stationary is None:
+            size = len(self.states)
+            systems = np.swapaxes(self.P, 1, 2) - np.eye(size)
+            systems[:, -1] = 1.0
+            rhs = np.zeros((len(self), size, 1))
+            rhs[:, -1] = 1.0
+            
+            try:
+                pi = np.linalg.solve(systems, rhs)[..., 0]
+            except np.linalg.LinAlgError:
+                pi = (np.linalg.pinv(systems) @ rhs)[..., 0]
+            
+            pi = np.clip(pi, 0.0, None)
+            self._stationary = pi / pi.sum(axis=1, keepdims=True)
+        
+        return self._stationary.copy()
+    
+    def spectral_gap(self) -> np.ndarray:
+        """Absolute spectral gap 1 - |λ2| of every region"""
+        if len(self.states) < 2:
+            return np.ones(len(self))
+        
+        moduli = np.sort(np.abs(np.linalg.eigvals(self.P)), axis=1)
+        return np.clip(1.0 - moduli[:, -2], 0.0, None)
+    
+    def simulate_batch(self, n_paths: int, days: int,
+                       rng: np.random.Generator = None,
+                       dtype: np.dtype = np.intp) -> np.ndarray:
+        """
+        Simulate n_paths sequences for every region in one step loop
+        
+        Each day draws one (R, n_paths) block of uniforms and advances all
+        paths of all regions with an inverse-CDF lookup against the
+        flattened cumulative tables, one gathered column at a time (no
+        (R, n_paths, S) temporaries).
+        
+        Returns:
+        --------
+        np.ndarray
+            Integer array of shape (R, n_paths, days) holding state indices
+        """
+        if rng is None:
+            rng = np.random
+        
+        n_regions, size = len(self), len(self.states)
+        paths = np.empty((n_regions, n_paths, days), dtype=dtype)
+        if n_paths == 0 or days == 0 or n_regions == 0:
+            return paths
+        
+        offsets = (np.arange(n_regions) * size)[:, None]
+        uniforms = rng.random((n_regions, n_paths))
+        current = np.count_nonzero(
+            uniforms[:, :, None] >= self._initial_cumulative[:, None, :], axis=2
+        )
+        paths[:, :, 0] = current
+        
+        # The last cumulative column is always 1 and never passed
+        columns = [np.ascontiguousarray(self._cumulative[:, j])
+                   for j in range(size - 1)]
+        for t in range(1, days):
+            uniforms = rng.random((n_regions, n_paths))
+            rows = offsets + current
+            current = np.zeros((n_regions, n_paths), dtype=np.intp)
+            for column in columns:
+                current += uniforms >= column[rows]
+            paths[:, :, t] = current
+        
+        return paths
+
+class HigherOrderMarkovWeatherModel:
+    """
+    k-th order Markov Chain model for weather prediction
+    
+    Tomorrow's weather depends on the last `order` days. A history
+    (s_1, ..., s_k), oldest first, is packed into the single integer
+    h = sum_i s_i * S^(k-i), so the transition table is an (S^k, S) array
+    and the next history is (h * S) mod S^k + s_next.
+    
+    Distributions, n-step transitions and the stationary distribution are
+    computed on the lifted first-order chain over histories, which is
+    sparse with S nonzeros per row. The query API speaks base states just
+    like MarkovWeatherModel.
+    """
+    
+    def __init__(self, transition_table: np.ndarray,
+                 initial_dist: List[float],
+                 order: int,
+                 region_name: str = "Generic",
+                 states: Optional[List[str]] = None,
+                 rain_states: Optional[List[str]] = None):
+        """
+        Initialize weather model
+        
+        Parameters:
+        -----------
+        transition_table : np.ndarray
+            Array of shape (S^order, S); row h is the distribution of the
+            next day's state given packed history h
+        initial_dist : List[float]
+            Distribution over the S base states (the unobserved earlier
+            days are taken to equal the first day) or over the S^order
+            packed histories
+        order : int
+            Number of past days the next day depends on
+        region_name : str
+            Name of the US region
+        states : List[str] or None
+            Base state labels; defaults to Sunny/Rainy/Cloudy
+        rain_states : List[str] or None
+            Labels counted as rain; defaults to ["Rainy"]
+        """
+        self.table = np.array(transition_table, dtype=float)
+        self.order = int(order)
+        self.region = region_name
+        self.states = list(states) if states is not None else list(DEFAULT_STATES)
+        self.rain_states = list(rain_states) if rain_states is not None else ["Rainy"]
+        
+        size = len(self.states)
+        self.n_histories = size ** self.order
+        if self.order < 1:
+            raise ValueError(f"Order must be at least 1: {self.order}")
+        if self.table.shape != (self.n_histories, size):
+            raise ValueError(
+                f"Transition table shape {self.table.shape} doesn't match "
+                f"({self.n_histories}, {size}) for order {self.order}"
+            )
+        
+        # Packed history of a run of one state, e.g. (s, s, ..., s)
+        self._repeat = np.arange(size) * sum(size ** i for i in range(self.order))
+        
+        initial = np.array(initial_dist, dtype=float)
+        if initial.shape == (size,):
+            history_initial = np.zeros(self.n_histories)
+            history_initial[self._repeat] = initial
+        elif initial.shape == (self.n_histories,):
+            history_initial = initial
+        else:
+            raise ValueError(
+                f"Initial distribution has {initial.size} entries, expected "
+                f"{size} or {self.n_histories}"
+            )
+        
+        self.lifted = MarkovWeatherModel(
+            transition_matrix=self._lifted_matrix(),
+            initial_dist=history_initial,
+            region_name=region_name,
+            states=[self._history_label(h) for h in range(self.n_histories)],
+            rain_states=[self._history_label(h) for h in range(self.n_histories)
+                         if self.states[h % size] in self.rain_states]
+        )
+        self.P = self.lifted.P
+        self.is_sparse = True
+        
+        # Base-state views used by the simulation and analysis code
+        self.initial = self._project(history_initial)
+        self.rain_mask = np.isin(self.states, self.rain_states).astype(float)
+        self.rain_codes = np.flatnonzero(self.rain_mask)
+        self.code_dtype = state_code_dtype(size)
+        
+        self._cumulative = np.cumsum(self.table, axis=1)
+        self._cumulative[:, -1] = 1.0
+        self._history_cumulative = np.cumsum(history_initial)
+        self._history_cumulative[-1] = 1.0
+    
+    def _lifted_matrix(self) -> sparse.csr_matrix:
+        """Sparse first-order transition matrix over packed histories"""
+        size = len(self.states)
+        shifted = (np.arange(self.n_histories) * size) % self.n_histories
+        indices = (shifted[:, None] + np.arange(size)).ravel()
+        indptr = np.arange(0, self.n_histories * size + 1, size)
+        
+        return sparse.csr_matrix((self.table.ravel(), indices, indptr),
+                                 shape=(self.n_histories, self.n_histories))
+    
+    def _history_label(self, history: int) -> str:
+        """Label such as "Sunny>Sunny>Rainy" (oldest day first)"""
+        size = len(self.states)
+        days = []
+        for _ in range(self.order):
+            days.append(self.states[history % size])
+            history //= size
+        return ">".join(reversed(days))
+    
+    def _project(self, dists: np.ndarray) -> np.ndarray:
+        """Marginal distribution of the latest day from history weights"""
+        size = len(self.states)
+        dists = np.asarray(dists)
+        return dists.reshape(dists.shape[:-1] + (-1, size)).sum(axis=-2)
+    
+    def _lifted_start(self, start: Union[str, np.ndarray, None]) -> np.ndarray:
+        """Starting distribution over histories"""
+        if start is None:
+            return self.lifted.initial
+        
+        size = len(self.states)
+        if isinstance(start, str):
+            start_vec = np.zeros(self.n_histories)
+            start_vec[self._repeat[self.states.index(start)]] = 1.0
+            return start_vec
+        
+        start = np.asarray(start, dtype=float)
+        if start.shape == (size,):
+            start_vec = np.zeros(self.n_histories)
+            start_vec[self._repeat] = start
+            return start_vec
+        return start
+    
+    def n_step_transition(self, n: int) -> sparse.csr_matrix:
+        """
+        n-step transition matrix of the lifted chain over histories
+        """
+        return self.lifted.n_step_transition(n)
+    
+    def distribution_over_horizons(self, start: Union[str, np.ndarray, None],
+                                   ns: Iterable[int]) -> np.ndarray:
+        """
+        Base-state distributions after every horizon n in ns
+        
+        start may be a base state, a distribution over base states or
+        packed histories, or None for the initial distribution.
+        """
+        dists = self.lifted.distribution_over_horizons(self._lifted_start(start), ns)
+        return self._project(dists)
+    
+    def stationary_distribution(self) -> np.ndarray:
+        """Long-run frequency of each base state"""
+        return self._project(self.lifted.stationary_distribution())
+    
+    def history_stationary_distribution(self) -> np.ndarray:
+        """Stationary distribution over packed histories"""
+        return self.lifted.stationary_distribution()
+    
+    def spectral_gap(self) -> float:
+        return self.lifted.spectral_gap()
+    
+    def mixing_time_estimate(self, epsilon: float = 0.25) -> float:
+        return self.lifted.mixing_time_estimate(epsilon)
+    
+    def mixing_time(self, epsilon: float = 0.25,
+                    max_steps: int = _MAX_MIXING_STEPS) -> float:
+        """TV mixing time of the lifted chain over histories"""
+        return self.lifted.mixing_time(epsilon, max_steps)
+    
+    def convergence_curve(self, horizon: int,
+                          start: Union[str, np.ndarray, None] = None,
+                          metric: str = "tv") -> np.ndarray:
+        """
+        Distance of the base-state distribution from its stationary value
+        after 0, 1, ..., horizon days
+        
+        start=None gives one column per base start state (a run of that
+        state); otherwise as in MarkovWeatherModel.convergence_curve.
+        """
+        pi = self.stationary_distribution()
+        horizons = range(horizon + 1)
+        if start is None:
+            return np.stack([
+                _distribution_distance(
+                    self.distribution_over_horizons(state, horizons), pi, metric
+                )
+                for state in self.states
+            ], axis=1)
+        
+        if isinstance(start, str) or np.ndim(start) == 1:
+            return _distribution_distance(
+                self.distribution_over_horizons(start, horizons), pi, metric
+            )
+        
+        return np.stack([
+            _distribution_distance(
+                self.distribution_over_horizons(row, horizons), pi, metric
+            )
+            for row in np.asarray(start, dtype=float)
+        ], axis=1)
+    
+    def worst_case_curve(self, horizon: int, metric: str = "tv") -> np.ndarray:
+        """Row maximum of convergence_curve over the base start states"""
+        return self.convergence_curve(horizon, metric=metric).max(axis=1)
+    
+    def probability_rain_in_n_days(self, n: int,
+                                   current_state: str = None) -> float:
+        """
+        Calculate probability of rain in exactly n days
+        """
+        return self.rain_probability_curve(n + 1, current_state)[-1]
+    
+    def rain_probability_curve(self, horizon: int,
+                               current_state: str = None) -> np.ndarray:
+        """
+        Probability of rain on each of the next 'horizon' days
+        """
+        return self.distribution_over_horizons(current_state,
+                                               range(horizon)) @ self.rain_mask
+    
+    def expected_rainy_days(self, horizon: int,
+                            simulations: int = 1000,
+                            method: str = "analytic",
+                            current_state: str = None) -> float:
+        """
+        Expected number of rainy days in next 'horizon' days
+        
+        method="monte_carlo" estimates it by simulation instead.
+        """
+        if method == "monte_carlo":
+            paths = self.simulate_batch(simulations, horizon, current_state)
+            return np.count_nonzero(np.isin(paths, self.rain_codes)) / simulations
+        
+        if method != "analytic":
+            raise ValueError(f"Unknown method: {method}")
+        
+        return self.rain_probability_curve(horizon, current_state).sum()
+    
+    def simulate_batch(self, n_paths: int, days: int,
+                       start_state: str = None,
+                       rng: np.random.Generator = None,
+                       dtype: np.dtype = np.intp,
+                       uniforms: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Simulate many weather sequences at once
+        
+        Paths carry their packed history; each day one bulk uniform per
+        path is mapped through the cumulative table row of its history.
+        Returns base-state codes of shape (n_paths, days). uniforms
+        optionally supplies the (n_paths, days) draws, as for the
+        first-order model.
+        """
+        if rng is None:
+            rng = np.random
+        
+        paths = np.empty((n_paths, days), dtype=dtype)
+        if n_paths == 0 or days == 0:
+            return paths
+        
+        size = len(self.states)
+        if uniforms is None:
+            uniforms = rng.random((n_paths, days))
         
         if start_state:
-            current_idx = self.states.index(start_state)
+            history = np.full(n_paths, self._repeat[self.states.index(start_state)],
+                              dtype=np.intp)
         else:
-            current_idx = np.random.choice(len(self.states), p=self.initial)
+            history = np.searchsorted(self._history_cumulative,
+                                      uniforms[:, 0], side="right")
+        paths[:, 0] = history % size
         
-        for _ in range(days):
-            sequence.append(self.states[current_idx])
-            
-            current_idx = np.random.choice(
-                len(self.states), 
-                p=self.P[current_idx]
+        for t in range(1, days):
+            current = np.count_nonzero(
+                uniforms[:, t, None] >= self._cumulative[history], axis=1
+            )
+            history = (history * size) % self.n_histories + current
+            paths[:, t] = current
+        
+        return paths
+    
+    def continue_batch(self, history: np.ndarray, days: int,
+                       rng: np.random.Generator = None,
+                       dtype: np.dtype = np.intp) -> np.ndarray:
+        """
+        Continue existing paths for more days
+        
+        history is an (n_paths, order) array of the last `order` state
+        codes of each path, oldest first. Returns the (n_paths, days)
+        codes of the following days.
+        """
+        if rng is None:
+            rng = np.random
+        
+        n_paths = len(history)
+        paths = np.empty((n_paths, days), dtype=dtype)
+        if n_paths == 0 or days == 0:
+            return paths
+        
+        size = len(self.states)
+        history = np.asarray(history, dtype=np.intp)
+        if history.shape[1] != self.order:
+            raise ValueError(
+                f"History has {history.shape[1]} days, expected {self.order}"
             )
+        packed = history @ (size ** np.arange(self.order - 1, -1, -1))
         
-        return sequence
\ No newline at end of file
+        uniforms = rng.random((n_paths, days))
+        for t in range(days):
+            current = np.count_nonzero(
+                uniforms[:, t, None] >= self._cumulative[packed], axis=1
+            )
+            packed = (packed * size) % self.n_histories + current
+            paths[:, t] = current
+        
+        return paths
+    
+    def simulate_sequence(self, days: int,
+                          start_state: str = None) -> List[str]:
+        """
+        Simulate a weather sequence
+        """
+        return self.decode(self.simulate_batch(1, days, start_state)[0])
+    
+    def decode(self, codes: np.ndarray) -> List[str]:
+        """
+        Convert an integer-coded sequence back to state labels
+        """
+        return [self.states[code] for code in codes]
+
+def _distribution_distance(dists: np.ndarray, pi: np.ndarray,
+                           metric: str) -> np.ndarray:
+    """Distance of each distribution (last axis) from pi"""
+    if metric == "tv":
+        return 0.5 * np.abs(dists - pi).sum(axis=-1)
+    if metric == "l2":
+        return np.linalg.norm(dists - pi, axis=-1)
+    raise ValueError(f"Unknown metric: {metric}")
+
+def _sparse_matrix_power(matrix: sparse.csr_matrix, n: int) -> sparse.csr_matrix:
+    """P^n by repeated squaring with sparse products"""
+    result = sparse.identity(matrix.shape[0], format="csr")
+    base = matrix
+    while n > 0:
+        if n & 1:
+            result = result @ base
+        n >>= 1
+        if n:
+            base = base @ base
+    return result.tocsr()
+
+def _build_alias_tables(matrix) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Walker/Vose alias tables for every row, laid out like CSR
+    
+    Row i owns slots indptr[i]:indptr[i+1], one per nonzero transition.
+    A slot keeps its own target with probability accept[slot] and
+    otherwise jumps to alias[slot], so sampling is O(1) per draw and the
+    tables take O(nonzeros) memory.
+    """
+    csr = sparse.csr_matrix(matrix)
+    csr.eliminate_zeros()
+    indptr = csr.indptr.astype(np.intp)
+    targets = csr.indices.astype(np.intp)
+    accept = np.ones(len(targets))
+    alias = targets.copy()
+    
+    for row in range(csr.shape[0]):
+        lo, hi = indptr[row], indptr[row + 1]
+        width = hi - lo
+        scaled = csr.data[lo:hi] * width / csr.data[lo:hi].sum()
+        small = [k for k in range(width) if scaled[k] < 1.0]
+        large = [k for k in range(width) if scaled[k] >= 1.0]
+        
+        while small and large:
+            k_small, k_large = small.pop(), large[-1]
+            accept[lo + k_small] = scaled[k_small]
+            alias[lo + k_small] = targets[lo + k_large]
+            scaled[k_large] -= 1.0 - scaled[k_small]
+            if scaled[k_large] < 1.0:
+                small.append(large.pop())
+        # Leftovers are 1 up to rounding and always keep their own target
+    
+    return indptr, targets, accept, alias
+
+def _alias_step(tables: Tuple, current: np.ndarray,
+                uniforms: np.ndarray) -> np.ndarray:
+    """Next state of every path from one uniform each"""
+    indptr, targets, accept, alias = tables
+    start = indptr[current]
+    width = indptr[current + 1] - start
+    
+    # Integer part picks the slot, fractional part decides accept/alias
+    scaled = uniforms * width
+    offset = np.minimum(scaled.astype(np.intp), width - 1)
+    slot = start + offset
+    keep = (scaled - offset) < accept[slot]
+    
+    return np.where(keep, targets[slot], alias[slot])